@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ChatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chats'
+
+    def ready(self):
+        """
+        Import the signals module to connect the receivers when the app is ready.
+        """
+        import chats.signals # noqa: F401
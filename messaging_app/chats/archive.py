@@ -0,0 +1,159 @@
+"""
+Cold storage for old messages.
+
+`manage.py archive_messages` moves the messages older than
+CHATS_ARCHIVE_AFTER_DAYS out of the messages table, in batches, into
+ArchivedMessageChunk rows of up to CHATS_ARCHIVE_CHUNK_SIZE messages each,
+stored as compressed JSON. The messages table and its indexes then only hold
+the recent messages most reads are for.
+
+Reads that reach past the oldest message left in the table continue in the
+archive: MessageViewSet pages (`archived_messages`) and the conversation
+export (`iter_archived_messages`). Archived messages cannot be retrieved,
+edited or deleted one by one, and are not in the search index.
+"""
+
+import json
+import uuid
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from . import caching, search
+from .models import ArchivedMessageChunk, Message, User
+from .sharding import atomic_with_shard
+
+
+def get_archive_age():
+    return timedelta(days=getattr(settings, 'CHATS_ARCHIVE_AFTER_DAYS', 90))
+
+
+def get_archive_chunk_size():
+    return getattr(settings, 'CHATS_ARCHIVE_CHUNK_SIZE', 500)
+
+
+def pack(messages):
+    rows = [
+        [message.message_id.hex, message.sender_id.hex, message.sent_at.isoformat(), message.message_body]
+        for message in messages
+    ]
+    return zlib.compress(json.dumps(rows, ensure_ascii=False).encode('utf-8'))
+
+
+def unpack(chunk):
+    """
+    Returns the chunk's messages, oldest first, as unsaved Message instances.
+    """
+    return [
+        Message(
+            message_id=uuid.UUID(message_id),
+            conversation_id=chunk.conversation_id,
+            sender_id=uuid.UUID(sender_id),
+            sent_at=parse_datetime(sent_at),
+            message_body=message_body,
+        )
+        for message_id, sender_id, sent_at, message_body in json.loads(zlib.decompress(chunk.payload))
+    ]
+
+
+def archive_conversation(conversation_id, before, chunk_size=None):
+    """
+    Moves the conversation's messages sent before `before` into the archive,
+    oldest first, and returns how many were moved.
+
+    Each batch fills up the conversation's newest chunk, or starts a new one,
+    and is moved in one transaction. The rows are deleted without signals:
+    inbox rows and the response cache stay valid, only the search index
+    drops them.
+    """
+    chunk_size = chunk_size or get_archive_chunk_size()
+    archived = 0
+    while True:
+        with atomic_with_shard(conversation_id) as alias:
+            chunk = ArchivedMessageChunk.objects.select_for_update().filter(
+                conversation_id=conversation_id
+            ).order_by('-newest_sent_at').first()
+            if chunk is not None and chunk.message_count >= chunk_size:
+                chunk = None
+            batch = list(
+                Message.objects.using(alias).filter(
+                    conversation_id=conversation_id, sent_at__lt=before
+                ).order_by('sent_at', 'message_id')[:chunk_size - (chunk.message_count if chunk else 0)]
+            )
+            if not batch:
+                break
+            messages = (unpack(chunk) if chunk else []) + batch
+            if chunk is None:
+                chunk = ArchivedMessageChunk(conversation_id=conversation_id)
+            chunk.oldest_sent_at = messages[0].sent_at
+            chunk.newest_sent_at = messages[-1].sent_at
+            chunk.message_count = len(messages)
+            chunk.payload = pack(messages)
+            chunk.save()
+            Message.objects.using(alias).filter(pk__in=[message.pk for message in batch])._raw_delete(alias)
+            search.unindex_messages(batch)
+        archived += len(batch)
+    if archived:
+        caching.bump_conversation(conversation_id)
+    return archived
+
+
+async def ahas_archive(conversation_id):
+    return await ArchivedMessageChunk.objects.filter(conversation_id=conversation_id).aexists()
+
+
+def archived_messages(conversation_id, position=None, reverse=False, limit=None, min_sent_at=None, max_sent_at=None):
+    """
+    Returns up to `limit` archived messages of the conversation past
+    `position`, a (sent_at, message_id) pair: older ones newest first, or
+    with `reverse` newer ones oldest first, like MessageCursorPagination.
+    `min_sent_at` and `max_sent_at` bound sent_at like MessageFilter does.
+
+    Only the chunks overlapping the range are read. Senders are loaded with
+    one query; messages of deleted users are dropped, as the delete cascade
+    would have dropped them from the table.
+    """
+    chunks = ArchivedMessageChunk.objects.filter(conversation_id=conversation_id)
+    lower, upper = min_sent_at, max_sent_at
+    if position is not None and reverse:
+        lower = max(lower, position[0]) if lower else position[0]
+    elif position is not None:
+        upper = min(upper, position[0]) if upper else position[0]
+    if lower is not None:
+        chunks = chunks.filter(newest_sent_at__gte=lower)
+    if upper is not None:
+        chunks = chunks.filter(oldest_sent_at__lte=upper)
+
+    found = []
+    for chunk in chunks.order_by('newest_sent_at' if reverse else '-newest_sent_at').iterator(chunk_size=10):
+        messages = unpack(chunk)
+        if not reverse:
+            messages.reverse()
+        for message in messages:
+            key = (message.sent_at, message.message_id)
+            if position is not None and (key <= position if reverse else key >= position):
+                continue
+            if (lower is not None and message.sent_at < lower) or (upper is not None and message.sent_at > upper):
+                continue
+            found.append(message)
+        if limit is not None and len(found) >= limit:
+            break
+
+    found = found[:limit]
+    senders = User.objects.in_bulk({message.sender_id for message in found})
+    found = [message for message in found if message.sender_id in senders]
+    for message in found:
+        message.sender = senders[message.sender_id]
+    return found
+
+
+def iter_archived_messages(conversation_id):
+    """
+    Yields the conversation's archived messages oldest first, one chunk in
+    memory at a time. Senders are not loaded.
+    """
+    chunks = ArchivedMessageChunk.objects.filter(conversation_id=conversation_id).order_by('newest_sent_at')
+    for chunk in chunks.iterator(chunk_size=10):
+        yield from unpack(chunk)
@@ -0,0 +1,225 @@
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .archive import ahas_archive
+from .auth import CachedClaimsJWTAuthentication
+from .caching import (
+    aget_version, conversation_version_key, get_cache, get_response_cache_timeout, get_user_versions,
+    patch_cached_response_headers, response_cache_key, response_etag,
+)
+from .fastpath import conversation_dicts, conversation_rows, message_dict, message_dicts, message_rows
+from .filters import MessageFilter
+from .pagination import MessageCursorPagination
+from .renderers import ORJSONRenderer
+from .routers import ause_replica, current_replica, reset_replica
+from .sharding import is_sharded
+from .timing import phase
+from .views import ConversationViewSet, MessageViewSet
+
+# The synchronous DRF views the async ones stand in for, mapped the way the
+# routers in chats.urls map them. Anything the async views do not serve
+# (writes, the browsable API, session auth, filters on participants) is
+# handed to these.
+conversation_list_view = ConversationViewSet.as_view(
+    {'get': 'list', 'post': 'create'}, basename='conversation', detail=False
+)
+conversation_detail_view = ConversationViewSet.as_view(
+    {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'},
+    basename='conversation', detail=True,
+)
+message_list_view = MessageViewSet.as_view(
+    {'get': 'list', 'post': 'create'}, basename='conversation-messages', detail=False
+)
+message_detail_view = MessageViewSet.as_view(
+    {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'},
+    basename='conversation-messages', detail=True,
+)
+
+JSON_MEDIA_TYPE = 'application/json'
+
+# Steps that run several queries each take one thread hop for all of them;
+# the async ORM would take one per query.
+aconversation_dicts = sync_to_async(conversation_dicts)
+aget_user_versions = sync_to_async(get_user_versions)
+
+
+def json_response(data, status=200):
+    with phase('render'):
+        content = ORJSONRenderer().render(data)
+    return HttpResponse(content, status=status, content_type=JSON_MEDIA_TYPE)
+
+
+def exception_response(exc):
+    """
+    Renders an APIException the way DRF's default exception handler does.
+    """
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return json_response(data, status=exc.status_code)
+
+
+@sync_to_async
+def authenticate(request):
+    """
+    Returns the user for the request's access token, or None.
+    """
+    try:
+        result = CachedClaimsJWTAuthentication().authenticate(request)
+    except exceptions.AuthenticationFailed:
+        return None
+    return result[0] if result is not None else None
+
+
+def wants_json(request):
+    requested_format = request.GET.get(api_settings.URL_FORMAT_OVERRIDE)
+    if requested_format is not None:
+        return requested_format == 'json'
+    return 'text/html' not in request.headers.get('Accept', '')
+
+
+def async_read_view(handler, sync_view):
+    """
+    Builds a view that serves token-authenticated JSON GETs with `handler`, a
+    coroutine taking (request, user, **kwargs), and hands everything else to
+    the synchronous `sync_view`. The handler may return None to hand over too.
+    Sharded messages are always served by `sync_view`, which knows how to
+    gather them.
+    """
+    async def view(request, **kwargs):
+        if (
+            request.method == 'GET' and 'authorization' in request.headers and wants_json(request)
+            and not is_sharded()
+        ):
+            user = await authenticate(request)
+            # Invalid tokens fall through so DRF answers with its usual 401.
+            if user is not None:
+                replica_token = await ause_replica(user)
+                try:
+                    response = await handler(request, user, **kwargs)
+                except exceptions.APIException as exc:
+                    return exception_response(exc)
+                finally:
+                    reset_replica(replica_token)
+                if response is not None:
+                    return response
+        return await sync_to_async(sync_view)(request, **kwargs)
+
+    view.__name__ = view.__qualname__ = handler.__name__
+    view.__doc__ = handler.__doc__
+    return view
+
+
+async def cached_json_response(request, user, basename, action, versions, build):
+    """
+    Async counterpart of VersionedResponseCacheMixin.cached_response. Keys,
+    ETags and headers are computed the same way, so both paths share cache
+    entries and validators.
+    """
+    key = response_cache_key(basename, action, user.pk, versions, request.get_full_path())
+    etag = response_etag(key, JSON_MEDIA_TYPE)
+    last_modified = max(versions) // 1_000_000_000
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    cache = get_cache()
+    data = await cache.aget(key)
+    if data is None:
+        data = await build()
+        if current_replica() is not None:
+            # See ReplicaReadMixin: replica reads may predate the versions.
+            response = json_response(data)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        await cache.aset(key, data, timeout=get_response_cache_timeout())
+
+    response = json_response(data)
+    patch_cached_response_headers(response, etag, last_modified)
+    return response
+
+
+def get_view_queryset(viewset_class, user, action, **kwargs):
+    """
+    Returns the viewset's queryset for `user`, so both paths read the same rows.
+    Building it runs no queries.
+    """
+    viewset = viewset_class(request=SimpleNamespace(user=user), action=action, kwargs=kwargs, format_kwarg=None)
+    return viewset.get_queryset()
+
+
+async def list_conversations(request, user):
+    """Conversation list, paginated by the viewset's paginator."""
+    if 'participants' in request.GET:
+        return None
+    rows = conversation_rows(get_view_queryset(ConversationViewSet, user, 'list'))
+
+    async def build():
+        paginator = ConversationViewSet.pagination_class()
+        page = await sync_to_async(paginator.paginate_queryset)(rows, Request(request))
+        return paginator.get_paginated_response(await aconversation_dicts(page)).data
+
+    return await cached_json_response(
+        request, user, 'conversation', 'list', await aget_user_versions(user.pk), build
+    )
+
+
+async def retrieve_conversation(request, user, pk):
+    """A single conversation with its participants and message preview."""
+    async def build():
+        queryset = get_view_queryset(ConversationViewSet, user, 'retrieve', pk=pk).filter(pk=pk)
+        rows = [row async for row in conversation_rows(queryset)]
+        if not rows:
+            raise exceptions.NotFound('No Conversation matches the given query.')
+        return (await aconversation_dicts(rows))[0]
+
+    return await cached_json_response(
+        request, user, 'conversation', 'retrieve', [await aget_version(conversation_version_key(pk))], build
+    )
+
+
+async def list_messages(request, user, conversation_pk):
+    """Message list of a conversation, paginated by MessageCursorPagination."""
+    if await ahas_archive(conversation_pk):
+        # Pages reading through to the archive are built by the viewset.
+        return None
+    queryset = get_view_queryset(MessageViewSet, user, 'list', conversation_pk=conversation_pk)
+    filterset = MessageFilter(request.GET, queryset=queryset)
+    if not filterset.is_valid():
+        raise exceptions.ValidationError(filterset.errors)
+
+    async def build():
+        paginator = MessageCursorPagination()
+        page = await paginator.apaginate_queryset(message_rows(filterset.qs), Request(request))
+        return {
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
+            'results': message_dicts(page),
+        }
+
+    versions = [await aget_version(conversation_version_key(conversation_pk))]
+    return await cached_json_response(request, user, 'conversation-messages', 'list', versions, build)
+
+
+async def retrieve_message(request, user, conversation_pk, pk):
+    """A single message of a conversation."""
+    async def build():
+        queryset = get_view_queryset(MessageViewSet, user, 'retrieve', conversation_pk=conversation_pk, pk=pk)
+        row = await message_rows(queryset.filter(pk=pk)).afirst()
+        if row is None:
+            raise exceptions.NotFound('No Message matches the given query.')
+        return message_dict(row)
+
+    versions = [await aget_version(conversation_version_key(conversation_pk))]
+    return await cached_json_response(request, user, 'conversation-messages', 'retrieve', versions, build)
+
+
+conversation_list = async_read_view(list_conversations, conversation_list_view)
+conversation_detail = async_read_view(retrieve_conversation, conversation_detail_view)
+message_list = async_read_view(list_messages, message_list_view)
+message_detail = async_read_view(retrieve_message, message_detail_view)
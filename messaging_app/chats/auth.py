@@ -1,4 +1,16 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import router
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+from .serializers import UserSerializer
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     """
@@ -11,8 +23,104 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 
         # Add custom claims here
         token['username'] = user.username
-        # Assuming you have a 'role' field on your custom User model
-        # token['role'] = user.role.name
+        token['role'] = user.role
         token['is_staff'] = user.is_staff
 
-        return token
\ No newline at end of file
+        return token
+
+
+# Columns loaded into the lightweight request user. They are the token's
+# claims, the flags permission checks read and every field UserSerializer
+# renders, since responses and push payloads serialize the request user;
+# anything else is deferred and loaded from the database only if a view
+# actually touches it. Kept in model field order, which Model.from_db()
+# expects.
+CLAIM_FIELDS = tuple(
+    field.attname for field in User._meta.concrete_fields
+    if field.attname in {
+        'user_id', 'username', 'role', 'is_staff', 'is_superuser', 'is_active',
+        *UserSerializer.Meta.fields,
+    }
+)
+
+
+def get_user_cache_ttl():
+    return getattr(settings, 'CHATS_AUTH_USER_CACHE_TTL', 30)
+
+
+class UserClaimsCache:
+    """
+    Bounded, thread-safe LRU cache of user claim rows, keyed by user id.
+
+    It is per process. Saving or deleting a user evicts their row in the
+    process that made the change (see chats.signals); every other process,
+    and changes that bypass the model signals, catch up when the row expires
+    after CHATS_AUTH_USER_CACHE_TTL seconds.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, row = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return row
+
+    def set(self, user_id, row):
+        expires_at = time.monotonic() + get_user_cache_ttl()
+        with self._lock:
+            self._entries[user_id] = (expires_at, row)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def evict(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_claims_cache = UserClaimsCache(getattr(settings, 'CHATS_AUTH_USER_CACHE_SIZE', 10000))
+
+
+class CachedClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that does not load the User row on every request.
+
+    The request user is a User instance built from a cached claims row
+    (`CLAIM_FIELDS`) with every other field deferred, so related managers,
+    foreign key assignments and permission checks behave as usual while a
+    warm request does no user lookup. A cold cache costs one narrow query.
+    Saving or deleting a user evicts their row, so deactivation, deletion
+    and role changes take effect on the next request of this process, and
+    within CHATS_AUTH_USER_CACHE_TTL seconds everywhere else.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = str(validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        row = user_claims_cache.get(user_id)
+        if row is None:
+            row = User.objects.filter(pk=user_id).values_list(*CLAIM_FIELDS).first()
+            if row is None:
+                raise AuthenticationFailed("User not found", code="user_not_found")
+            user_claims_cache.set(user_id, row)
+
+        user = User.from_db(router.db_for_read(User), CLAIM_FIELDS, row)
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        return user
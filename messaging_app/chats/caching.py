@@ -0,0 +1,216 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from .models import Conversation
+
+
+def get_cache():
+    return caches[getattr(settings, 'CHATS_CACHE_ALIAS', 'default')]
+
+
+def conversation_version_key(conversation_id):
+    return f'chats:version:conversation:{conversation_id}'
+
+
+def user_version_key(user_id):
+    return f'chats:version:user:{user_id}'
+
+
+def user_conversations_key(user_id, user_version):
+    return f'chats:conversations:user:{user_id}:{user_version}'
+
+
+def get_version(key):
+    """
+    Returns the current version token stored under `key`, creating one if
+    the key is missing (first use or evicted). A fresh token simply makes
+    every response cached under the old one unreachable.
+    """
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+async def aget_version(key):
+    """
+    Async version of get_version, for the ASGI read views.
+    """
+    cache = get_cache()
+    version = await cache.aget(key)
+    if version is None:
+        version = time.time_ns()
+        if not await cache.aadd(key, version, timeout=None):
+            version = await cache.aget(key, version)
+    return version
+
+
+def get_user_versions(user_id):
+    """
+    Returns the version tokens of everything the user's conversation lists
+    depend on: the user's own token, replaced when they join or leave a
+    conversation, and the token of each of their conversations, replaced on
+    every message write. A write so replaces one token however many
+    participants the conversation has.
+
+    The user's conversation ids are cached under their token and read from
+    the primary, since a lagging replica would leave a joined conversation
+    out until the next membership change.
+    """
+    cache = get_cache()
+    user_version = get_version(user_version_key(user_id))
+    ids_key = user_conversations_key(user_id, user_version)
+    conversation_ids = cache.get(ids_key)
+    if conversation_ids is None:
+        conversation_ids = sorted(
+            str(pk) for pk in Conversation.participants.through.objects.using(DEFAULT_DB_ALIAS).filter(
+                user_id=user_id
+            ).values_list('conversation_id', flat=True)
+        )
+        cache.set(ids_key, conversation_ids, timeout=get_response_cache_timeout())
+    keys = [conversation_version_key(pk) for pk in conversation_ids]
+    versions = cache.get_many(keys)
+    return [user_version] + [versions[key] if key in versions else get_version(key) for key in keys]
+
+
+def response_cache_key(basename, action, user_id, versions, full_path):
+    path_hash = hashlib.md5(full_path.encode('utf-8')).hexdigest()
+    version = versions[0] if len(versions) == 1 else hashlib.md5(
+        ':'.join(map(str, versions)).encode('utf-8')
+    ).hexdigest()
+    return f'chats:response:{basename}:{action}:{user_id}:{version}:{path_hash}'
+
+
+def response_etag(cache_key, media_type):
+    """
+    The ETag covers the cache key and the negotiated media type, since the
+    browsable API and JSON renderings of the same data differ.
+    """
+    return quote_etag(hashlib.md5(f'{cache_key}:{media_type}'.encode('utf-8')).hexdigest())
+
+
+def get_response_cache_timeout():
+    return getattr(settings, 'CHATS_RESPONSE_CACHE_TIMEOUT', 300)
+
+
+def patch_cached_response_headers(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Responses are per user: keep them out of shared caches and make
+    # clients revalidate every time.
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization'])
+
+
+def bump_versions(conversation_ids=(), user_ids=()):
+    """
+    Replaces the version tokens of the given conversations and users.
+    Runs after the current transaction commits, so a concurrent request can
+    never cache uncommitted data under the new token.
+    """
+    keys = [conversation_version_key(pk) for pk in conversation_ids]
+    keys += [user_version_key(pk) for pk in user_ids]
+    if not keys:
+        return
+
+    def bump():
+        version = time.time_ns()
+        get_cache().set_many({key: version for key in keys}, timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def bump_conversation(conversation_id):
+    """
+    Invalidates everything derived from a conversation: its own detail and
+    message pages, and the conversation list of each of its participants,
+    which is keyed by the conversation's token too (see get_user_versions).
+    """
+    bump_versions(conversation_ids=[conversation_id])
+
+
+class VersionedResponseCacheMixin:
+    """
+    Caches the data of list and retrieve responses per user and answers
+    conditional GETs.
+
+    Cache keys include the version tokens chosen by the view (see
+    `get_cache_versions`); writes replace a token, so invalidation is
+    immediate and a hit costs a cache read or two for the versions and one
+    for the data, with no database work. Only successful responses read from the
+    primary are cached, and the key contains the user, so a hit never
+    exposes data the user could not already read under the same version.
+
+    The same tokens yield the ETag and Last-Modified headers. A request whose
+    If-None-Match (or If-Modified-Since) matches gets a 304 before any data
+    is read or serialized.
+    """
+    cached_actions = ('list', 'retrieve')
+
+    def get_cache_version_key(self):
+        raise NotImplementedError('Views must define which version key their responses depend on.')
+
+    def get_cache_versions(self):
+        """
+        Returns the version tokens responses depend on: by default the one
+        under `get_cache_version_key`.
+        """
+        return [get_version(self.get_cache_version_key())]
+
+    def response_is_cacheable(self):
+        """
+        Whether a response built for this request may be stored and
+        validated under the current version token. ReplicaReadMixin says no
+        for replica reads, which may predate the token.
+        """
+        return True
+
+    def get_response_cache_key(self, versions):
+        return response_cache_key(
+            self.basename, self.action, self.request.user.pk, versions, self.request.get_full_path()
+        )
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if self.action not in self.cached_actions:
+            return handler(request, *args, **kwargs)
+        versions = self.get_cache_versions()
+        key = self.get_response_cache_key(versions)
+        etag = response_etag(key, getattr(request, 'accepted_media_type', ''))
+        # Version tokens are nanosecond timestamps of the last change.
+        last_modified = max(versions) // 1_000_000_000
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        cache = get_cache()
+        data = cache.get(key)
+        if data is not None:
+            response = Response(data)
+        else:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            if not self.response_is_cacheable():
+                patch_cache_control(response, private=True, no_cache=True)
+                return response
+            cache.set(key, response.data, timeout=get_response_cache_timeout())
+
+        patch_cached_response_headers(response, etag, last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,59 @@
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .models import ConversationParticipant
+from .realtime import conversation_group_name, user_group_name
+from .ws_auth import BEARER_SUBPROTOCOL
+
+
+class ConversationConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes new messages to a user over a WebSocket.
+
+    On connect the socket joins the channel layer group of every conversation
+    the user participates in; messages created through the API are broadcast
+    to those groups (see chats.realtime). It also joins the user's own group,
+    through which it follows conversations the user joins or leaves while
+    connected. Unauthenticated sockets are closed with code 4401.
+    """
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+        self.groups_joined = [user_group_name(user.pk)] + [
+            conversation_group_name(conversation_id)
+            for conversation_id in await self.get_conversation_ids(user)
+        ]
+        for group in self.groups_joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+        # Browsers drop the connection unless an offered subprotocol is
+        # accepted (see chats.ws_auth).
+        subprotocol = BEARER_SUBPROTOCOL if BEARER_SUBPROTOCOL in self.scope.get('subprotocols', ()) else None
+        await self.accept(subprotocol=subprotocol)
+
+    async def disconnect(self, code):
+        for group in getattr(self, 'groups_joined', []):
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def chat_message(self, event):
+        await self.send_json({'type': 'message', 'message': event['message']})
+
+    async def chat_join(self, event):
+        group = conversation_group_name(event['conversation'])
+        if group not in self.groups_joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+            self.groups_joined.append(group)
+
+    async def chat_leave(self, event):
+        group = conversation_group_name(event['conversation'])
+        if group in self.groups_joined:
+            await self.channel_layer.group_discard(group, self.channel_name)
+            self.groups_joined.remove(group)
+
+    @database_sync_to_async
+    def get_conversation_ids(self, user):
+        return list(
+            ConversationParticipant.objects.filter(user_id=user.pk).values_list('conversation_id', flat=True)
+        )
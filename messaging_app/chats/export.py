@@ -0,0 +1,143 @@
+import csv
+import json
+from itertools import chain, islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework import renderers
+
+from .archive import iter_archived_messages
+from .sharding import fill_sender_columns, is_sharded, messages_for
+
+EXPORT_FIELDS = ['message_id', 'sent_at', 'sender_id', 'sender_username', 'message_body']
+EXPORT_COLUMNS = ('message_id', 'sent_at', 'sender_id', 'sender__username', 'message_body')
+
+
+def iter_archived_rows(conversation_id, chunk_size):
+    """
+    Yields the rows of the conversation's archived messages, oldest first,
+    with sender usernames loaded per chunk. Messages of deleted users are
+    dropped, as they are from the table.
+    """
+    messages = iter_archived_messages(conversation_id)
+    while chunk := list(islice(messages, chunk_size)):
+        rows = fill_sender_columns([
+            {
+                'message_id': message.message_id,
+                'sent_at': message.sent_at,
+                'sender_id': message.sender_id,
+                'message_body': message.message_body,
+            }
+            for message in chunk
+        ], ['sender__username'])
+        yield from (row for row in rows if row['sender__username'] is not None)
+
+
+def iter_message_rows(conversation_id, chunk_size):
+    """
+    Yields the values() rows of the conversation's messages, oldest first,
+    read from a database cursor in chunks. Sharded messages cannot join their
+    senders, whose usernames are then loaded per chunk from the primary.
+    """
+    queryset = messages_for(conversation_id).order_by('sent_at', 'message_id')
+    if not is_sharded():
+        yield from queryset.values(*EXPORT_COLUMNS).iterator(chunk_size=chunk_size)
+        return
+    rows = queryset.values(*(column for column in EXPORT_COLUMNS if column != 'sender__username')).iterator(
+        chunk_size=chunk_size
+    )
+    while chunk := list(islice(rows, chunk_size)):
+        yield from fill_sender_columns(chunk, ['sender__username'])
+
+
+def get_export_chunk_size():
+    return getattr(settings, 'CHATS_EXPORT_CHUNK_SIZE', 2000)
+
+
+def iter_conversation_messages(conversation_id):
+    """
+    Yields one dict per message of the conversation, oldest first, starting
+    with the archived ones. Rows are read from a database cursor in chunks,
+    so memory use does not grow with the length of the conversation.
+    """
+    chunk_size = get_export_chunk_size()
+    rows = chain(iter_archived_rows(conversation_id, chunk_size), iter_message_rows(conversation_id, chunk_size))
+    for row in rows:
+        yield {
+            'message_id': str(row['message_id']),
+            'sent_at': format_datetime(row['sent_at']),
+            'sender_id': str(row['sender_id']),
+            'sender_username': row['sender__username'],
+            'message_body': row['message_body'],
+        }
+
+
+async def aiter_in_chunks(iterable, chunk_size):
+    """
+    Async iterator over a synchronous one, advanced `chunk_size` items at a
+    time in a thread. Under ASGI, Django consumes a sync streaming iterator
+    with one sync_to_async(list) call, holding the whole export in memory;
+    this keeps it streaming. thread_sensitive keeps every step on the
+    request's thread, which the database cursor belongs to.
+    """
+    iterator = iter(iterable)
+    read_chunk = sync_to_async(lambda: list(islice(iterator, chunk_size)), thread_sensitive=True)
+    while chunk := await read_chunk():
+        for item in chunk:
+            yield item
+
+
+def format_datetime(value):
+    """
+    Formats a datetime the way DRF's DateTimeField does.
+    """
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+class _Echo:
+    """
+    File-like object whose write() returns the written value, so csv.writer
+    can produce one line at a time for a streaming response.
+    """
+    def write(self, value):
+        return value
+
+
+class ExportRenderer(renderers.BaseRenderer):
+    """
+    Base class for export formats. `stream` turns message rows into encoded
+    chunks for a StreamingHttpResponse; `render` is only used for error
+    responses (403, 404) raised before streaming starts.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data).encode(self.charset)
+
+    def stream(self, rows):
+        raise NotImplementedError
+
+
+class JSONLinesExportRenderer(ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
+
+    def stream(self, rows):
+        for row in rows:
+            yield (json.dumps(row, ensure_ascii=False) + '\n').encode(self.charset)
+
+
+class CSVExportRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows):
+        writer = csv.DictWriter(_Echo(), fieldnames=EXPORT_FIELDS)
+        yield writer.writeheader().encode(self.charset)
+        for row in rows:
+            yield writer.writerow(row).encode(self.charset)
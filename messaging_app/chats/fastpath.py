@@ -0,0 +1,165 @@
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from .models import Conversation, Message
+from .serializers import UserSerializer, get_message_preview_size
+from .sharding import fill_sender_columns, is_sharded, scatter_values
+from .timing import phase
+
+# Formats datetimes exactly like the serializers' DateTimeFields.
+_datetime = serializers.DateTimeField()
+
+# (output key, column) pairs, computed once from the serializers' field lists.
+SENDER_COLUMNS = tuple((field, f'sender__{field}') for field in UserSerializer.Meta.fields)
+PARTICIPANT_COLUMNS = tuple((field, f'user__{field}') for field in UserSerializer.Meta.fields)
+SENDER_JOINED_COLUMNS = tuple(column for _, column in SENDER_COLUMNS)
+MESSAGE_COLUMNS = ('message_id', 'conversation_id', 'message_body', 'sent_at') + SENDER_JOINED_COLUMNS
+# Sharded messages cannot join their senders; those columns are filled in
+# from the primary by message_dicts.
+SHARDED_MESSAGE_COLUMNS = ('message_id', 'conversation_id', 'message_body', 'sent_at', 'sender_id')
+
+
+def _user_dict(row, columns):
+    user = {key: row[column] for key, column in columns}
+    user['user_id'] = str(user['user_id'])
+    return user
+
+
+def message_dict(row):
+    """
+    Builds the MessageSerializer representation from a values() row.
+    """
+    return {
+        'message_id': str(row['message_id']),
+        'sender': _user_dict(row, SENDER_COLUMNS),
+        'conversation': str(row['conversation_id']),
+        'message_body': row['message_body'],
+        'sent_at': _datetime.to_representation(row['sent_at']),
+    }
+
+
+def message_dicts(rows):
+    if is_sharded():
+        fill_sender_columns(rows, SENDER_JOINED_COLUMNS)
+    with phase('serializer'):
+        return [message_dict(row) for row in rows]
+
+
+def message_rows(queryset):
+    """
+    Narrows a Message queryset to the columns the representation needs.
+    """
+    if is_sharded():
+        return queryset.values(*SHARDED_MESSAGE_COLUMNS)
+    return queryset.values(*MESSAGE_COLUMNS)
+
+
+def instance_rows(messages):
+    """
+    Builds message_rows() rows from Message instances with their senders
+    loaded, for messages that are not in the table (see chats.archive).
+    """
+    return [
+        {
+            'message_id': message.message_id,
+            'conversation_id': message.conversation_id,
+            'message_body': message.message_body,
+            'sent_at': message.sent_at,
+            'sender_id': message.sender_id,
+            **{column: getattr(message.sender, field) for field, column in SENDER_COLUMNS},
+        }
+        for message in messages
+    ]
+
+
+def conversation_rows(queryset):
+    return queryset.prefetch_related(None).values('conversation_id', 'created_at')
+
+
+def preview_rows(queryset, conversation_ids):
+    """
+    Returns the values() rows of the latest messages of each conversation,
+    oldest first within a conversation.
+    """
+    latest = queryset.filter(conversation_id__in=conversation_ids).annotate(
+        position=Window(
+            RowNumber(),
+            partition_by=F('conversation_id'),
+            order_by=[F('sent_at').asc(), F('message_id').asc()],
+        ),
+        remaining=Window(
+            RowNumber(),
+            partition_by=F('conversation_id'),
+            order_by=[F('sent_at').desc(), F('message_id').desc()],
+        ),
+    ).filter(remaining__lte=get_message_preview_size()).order_by('position')
+    return message_rows(latest)
+
+
+def conversation_dicts(rows):
+    """
+    Builds ConversationSerializer representations for a page of values()
+    rows, loading participants and the message preview with one query each.
+    """
+    conversation_ids = [row['conversation_id'] for row in rows]
+    participant_rows = Conversation.participants.through.objects.filter(
+        conversation_id__in=conversation_ids
+    ).order_by('user__username').values('conversation_id', *(column for _, column in PARTICIPANT_COLUMNS))
+    if is_sharded():
+        # One preview query per shard holding any of the conversations.
+        previews = fill_sender_columns(
+            scatter_values(lambda queryset, ids: list(preview_rows(queryset, ids)), conversation_ids),
+            SENDER_JOINED_COLUMNS,
+        )
+    else:
+        previews = preview_rows(Message.objects, conversation_ids)
+
+    with phase('serializer'):
+        participants = {pk: [] for pk in conversation_ids}
+        for row in participant_rows:
+            participants[row['conversation_id']].append(_user_dict(row, PARTICIPANT_COLUMNS))
+        messages = {pk: [] for pk in conversation_ids}
+        for row in previews:
+            messages[row['conversation_id']].append(message_dict(row))
+
+        return [
+            {
+                'conversation_id': str(row['conversation_id']),
+                'participants': participants[row['conversation_id']],
+                'messages': messages[row['conversation_id']],
+                'created_at': _datetime.to_representation(row['created_at']),
+            }
+            for row in rows
+        ]
+
+
+class FastListMixin:
+    """
+    Serves the list action from values() rows turned into plain dicts,
+    skipping per-field ModelSerializer work. The output matches the
+    serializer byte for byte. Enabled by CHATS_FAST_LIST_SERIALIZATION and
+    only used for JSON responses; the browsable API keeps the serializers.
+
+    Views set `fast_list_rows` (queryset -> values() queryset) and
+    `fast_list_dicts` (list of rows -> list of dicts) as staticmethods.
+    """
+    fast_list_rows = None
+    fast_list_dicts = None
+
+    def use_fast_list(self):
+        if not getattr(settings, 'CHATS_FAST_LIST_SERIALIZATION', False):
+            return False
+        renderer = getattr(self.request, 'accepted_renderer', None)
+        return renderer is not None and renderer.format == 'json'
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_list():
+            return super().list(request, *args, **kwargs)
+        rows = self.fast_list_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.fast_list_dicts(page))
+        return Response(self.fast_list_dicts(list(rows)))
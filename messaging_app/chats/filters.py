@@ -2,35 +2,41 @@
 # messaging_app/chats/filters.py
 
 import django_filters
-from chats.models import Message, Conversation # Assume these models exist
-from django.db.models import Q
+from django.db import DEFAULT_DB_ALIAS
+from chats.models import ConversationParticipant, Message
+from chats.sharding import is_sharded
 
 class MessageFilter(django_filters.FilterSet):
     """
     Filter class for the Message model.
     Allows filtering by:
     - user_id: Messages in conversations involving a specific user.
-    - min_date: Messages after or on a specific date/time.
-    - max_date: Messages before or on a specific date/time.
+    - min_date: Messages sent on or after a specific date/time.
+    - max_date: Messages sent on or before a specific date/time.
+
+    Date bounds are range predicates on `sent_at`, which the
+    (conversation, sent_at, message_id) index serves. The participant filter
+    is a semi-join subquery on the participants table, so no join or
+    DISTINCT is added to the message query.
     """
 
     # Filter by user participant in the conversation
     # Searches for messages belonging to conversations where the given user ID is a participant
-    user_id = django_filters.NumberFilter(
+    user_id = django_filters.UUIDFilter(
         method='filter_by_participant',
         label='Participant User ID'
     )
 
-    # Filter messages on or after a minimum timestamp
+    # Filter messages sent on or after a minimum timestamp
     min_date = django_filters.DateTimeFilter(
-        field_name="timestamp",
+        field_name="sent_at",
         lookup_expr='gte',
         label='Minimum Date (YYYY-MM-DD HH:MM:SS)'
     )
 
-    # Filter messages on or before a maximum timestamp
+    # Filter messages sent on or before a maximum timestamp
     max_date = django_filters.DateTimeFilter(
-        field_name="timestamp",
+        field_name="sent_at",
         lookup_expr='lte',
         label='Maximum Date (YYYY-MM-DD HH:MM:SS)'
     )
@@ -45,5 +51,16 @@ class MessageFilter(django_filters.FilterSet):
         Custom method to filter messages based on a participant's ID
         in the message's conversation.
         """
-        return queryset.filter(conversation__participants__id=value).distinct()
-
+        # An uncorrelated IN (SELECT ...) rather than a correlated EXISTS:
+        # both are semi-joins, but SQLite only drives the uncorrelated form
+        # from the (user, conversation) index instead of scanning messages.
+        conversation_ids = ConversationParticipant.objects.filter(
+            user_id=value
+        ).values('conversation_id')
+        if is_sharded():
+            # Sharded messages are read from a shard, whose participants
+            # table is empty; read the ids from the primary first.
+            conversation_ids = list(
+                conversation_ids.using(DEFAULT_DB_ALIAS).values_list('conversation_id', flat=True)
+            )
+        return queryset.filter(conversation_id__in=conversation_ids)
@@ -0,0 +1,152 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+
+from .models import Conversation, InboxEntry
+from .sharding import messages_for
+
+
+def open_inbox_entries(conversation_id, user_ids):
+    """
+    Creates inbox rows for users who joined a conversation.
+    Existing rows are left untouched. New members start with the history
+    already read.
+    """
+    conversation = Conversation.objects.get(pk=conversation_id)
+    latest = conversation.messages.order_by('-sent_at', '-message_id').first()
+    last_message_at = latest.sent_at if latest else conversation.created_at
+    preview = latest.message_body[:InboxEntry.PREVIEW_LENGTH] if latest else ''
+    InboxEntry.objects.bulk_create(
+        [
+            InboxEntry(
+                user_id=user_id,
+                conversation_id=conversation_id,
+                last_message_at=last_message_at,
+                last_message_preview=preview,
+                last_read_at=latest.sent_at if latest else None,
+                last_read_message_id=latest.message_id if latest else None,
+            )
+            for user_id in user_ids
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def close_inbox_entries(conversation_id, user_ids=None):
+    """
+    Removes inbox rows for users who left a conversation (all of them if
+    `user_ids` is None).
+    """
+    entries = InboxEntry.objects.filter(conversation_id=conversation_id)
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+    entries.delete()
+
+
+def record_messages(conversation_id, messages):
+    """
+    Updates every participant's inbox row for newly created messages.
+
+    Must run in the transaction that inserted the messages. The latest message
+    becomes the preview, and each participant's unread counter grows by the
+    number of new messages they did not send themselves. This costs one UPDATE
+    per distinct sender (a single UPDATE for the usual one-message case).
+    """
+    if not messages:
+        return
+    latest = max(messages, key=lambda message: (message.sent_at, str(message.message_id)))
+    per_sender = Counter(message.sender_id for message in messages)
+    preview = latest.message_body[:InboxEntry.PREVIEW_LENGTH]
+
+    for index, (sender_id, count) in enumerate(per_sender.items()):
+        changes = {
+            'unread_count': Case(
+                When(user_id=sender_id, then=F('unread_count')),
+                default=F('unread_count') + count,
+            ),
+        }
+        if index == 0:
+            changes['last_message_at'] = latest.sent_at
+            changes['last_message_preview'] = preview
+        InboxEntry.objects.filter(conversation_id=conversation_id).update(**changes)
+
+
+def refresh_latest_message(conversation_id):
+    """
+    Recomputes the preview and activity time of every participant's inbox
+    row from the conversation's latest message, after it was edited or
+    deleted.
+    """
+    latest = messages_for(conversation_id).order_by('-sent_at', '-message_id').first()
+    if latest is not None:
+        last_message_at, preview = latest.sent_at, latest.message_body[:InboxEntry.PREVIEW_LENGTH]
+    else:
+        created_at = Conversation.objects.filter(pk=conversation_id).values_list('created_at', flat=True).first()
+        if created_at is None:
+            return
+        last_message_at, preview = created_at, ''
+    InboxEntry.objects.filter(conversation_id=conversation_id).exclude(
+        last_message_at=last_message_at, last_message_preview=preview
+    ).update(last_message_at=last_message_at, last_message_preview=preview)
+
+
+def forget_message(message):
+    """
+    Updates the inbox rows after a message was deleted: one unread message
+    less for the participants who had not read past it, and a new preview if
+    it was the latest.
+    """
+    InboxEntry.objects.filter(conversation_id=message.conversation_id, unread_count__gt=0).exclude(
+        user_id=message.sender_id
+    ).filter(
+        Q(last_read_at__isnull=True)
+        | Q(last_read_at__lt=message.sent_at)
+        | Q(last_read_at=message.sent_at, last_read_message_id__lt=message.message_id)
+    ).update(unread_count=F('unread_count') - 1)
+    refresh_latest_message(message.conversation_id)
+
+
+def mark_read(user_id, conversation_id, position):
+    """
+    Advances the user's read watermark to `position`, a (sent_at, message_id)
+    pair, and returns their inbox row (None if they are not a participant).
+
+    A watermark never moves backwards. The unread counter is recounted from
+    the messages past the new watermark, an index range on
+    (conversation, sent_at, message_id), so it also heals any drift. The row
+    is locked for the update, which orders it against record_messages.
+    """
+    sent_at, message_id = position
+    with transaction.atomic():
+        entry = InboxEntry.objects.select_for_update().filter(
+            user_id=user_id, conversation_id=conversation_id
+        ).first()
+        if entry is None:
+            return None
+        if entry.last_read_at is not None and (entry.last_read_at, str(entry.last_read_message_id)) >= (
+            sent_at, str(message_id)
+        ):
+            return entry
+        entry.last_read_at, entry.last_read_message_id = sent_at, message_id
+        entry.unread_count = messages_for(conversation_id).filter(
+            Q(sent_at__gte=sent_at) & ~Q(sent_at=sent_at, message_id__lte=message_id),
+        ).exclude(sender_id=user_id).count()
+        entry.save(update_fields=['last_read_at', 'last_read_message_id', 'unread_count'])
+    return entry
+
+
+def rebuild_inbox_entries(conversation_ids=None):
+    """
+    Recreates inbox rows from the participants and messages tables.
+    Used after loading data that bypassed the model signals.
+    """
+    Participant = Conversation.participants.through
+    if conversation_ids is None:
+        conversation_ids = Conversation.objects.values_list('pk', flat=True).iterator()
+    for conversation_id in conversation_ids:
+        close_inbox_entries(conversation_id)
+        user_ids = Participant.objects.filter(
+            conversation_id=conversation_id
+        ).values_list('user_id', flat=True)
+        open_inbox_entries(conversation_id, list(user_ids))
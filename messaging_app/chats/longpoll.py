@@ -0,0 +1,111 @@
+import asyncio
+import math
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import Q
+
+from .async_views import authenticate, json_response
+from .fastpath import SENDER_JOINED_COLUMNS, message_dicts, message_rows
+from .models import ConversationParticipant
+from .pagination import MessageCursorPagination
+from .realtime import conversation_group_name
+from .sharding import afill_sender_columns, amessages_for
+
+
+def get_long_poll_timeout():
+    return getattr(settings, 'CHATS_LONG_POLL_TIMEOUT', 25)
+
+
+async def messages_after(conversation_id, position, limit):
+    """
+    Returns up to `limit` messages newer than `position`, oldest first.
+    """
+    queryset = await amessages_for(conversation_id)
+    if position is not None:
+        sent_at, message_id = position
+        queryset = queryset.filter(Q(sent_at__gte=sent_at) & ~Q(sent_at=sent_at, message_id__lte=message_id))
+    queryset = queryset.order_by('sent_at', 'message_id')[:limit]
+    rows = [row async for row in message_rows(queryset)]
+    # Sharded rows come without their senders.
+    return await afill_sender_columns(rows, SENDER_JOINED_COLUMNS)
+
+
+async def latest_position(conversation_id):
+    row = await (await amessages_for(conversation_id)).order_by(
+        '-sent_at', '-message_id'
+    ).values('sent_at', 'message_id').afirst()
+    return (row['sent_at'], row['message_id']) if row else None
+
+
+async def poll_messages(request, conversation_pk):
+    """
+    Long-polls for messages newer than the `after` cursor.
+
+    Returns as soon as the conversation has messages past the cursor, or an
+    empty page once `timeout` seconds (capped at CHATS_LONG_POLL_TIMEOUT) pass
+    without any. The response's `after` cursor is the one to send next. Without
+    `after` the poll starts from the newest message, so only messages created
+    from now on are returned.
+
+    Waiting happens on the event loop: the request subscribes to the
+    conversation's channel layer group, which new messages are pushed to on
+    commit (see chats.realtime), and holds no thread or connection meanwhile.
+    """
+    if request.method != 'GET':
+        return json_response({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+    user = await authenticate(request)
+    if user is None:
+        return json_response({'detail': 'Authentication credentials were not provided.'}, status=401)
+    if not await ConversationParticipant.objects.filter(conversation_id=conversation_pk, user_id=user.pk).aexists():
+        return json_response({'detail': 'You are not a participant in this conversation.'}, status=403)
+
+    pagination = MessageCursorPagination
+    try:
+        limit = min(int(request.GET.get('page_size', pagination.page_size)), pagination.max_page_size)
+        timeout = float(request.GET.get('timeout', get_long_poll_timeout()))
+        # nan would slip through min() and max() below.
+        if not math.isfinite(timeout):
+            raise ValueError(timeout)
+        timeout = min(timeout, get_long_poll_timeout())
+    except ValueError:
+        return json_response({'detail': "'page_size' and 'timeout' must be numbers."}, status=400)
+    limit, timeout = max(limit, 1), max(timeout, 0)
+
+    after = request.GET.get('after')
+    if after:
+        try:
+            position = pagination.decode_position(after)['position']
+        except (TypeError, ValueError):
+            return json_response({'detail': pagination.invalid_cursor_message}, status=404)
+    else:
+        position = await latest_position(conversation_pk)
+
+    channel_layer = get_channel_layer()
+    group = conversation_group_name(conversation_pk)
+    channel = None
+    if channel_layer is not None and timeout:
+        # Subscribe before reading so a message committed in between still
+        # wakes us up.
+        channel = await channel_layer.new_channel()
+        await channel_layer.group_add(group, channel)
+    try:
+        rows = await messages_after(conversation_pk, position, limit)
+        if not rows and channel is not None:
+            try:
+                await asyncio.wait_for(channel_layer.receive(channel), timeout)
+            except asyncio.TimeoutError:
+                # Read once more anyway: the wake-up may have been missed,
+                # e.g. for a message that sent no event.
+                pass
+            rows = await messages_after(conversation_pk, position, limit)
+    finally:
+        if channel is not None:
+            await channel_layer.group_discard(group, channel)
+
+    if rows:
+        position = (rows[-1]['sent_at'], rows[-1]['message_id'])
+    return json_response({
+        'after': pagination.encode_position(*position) if position else None,
+        'results': message_dicts(rows),
+    })
@@ -0,0 +1,45 @@
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chats.archive import archive_conversation, get_archive_age, get_archive_chunk_size
+from chats.models import Conversation
+
+
+class Command(BaseCommand):
+    """
+    Moves messages older than CHATS_ARCHIVE_AFTER_DAYS into the compressed
+    archive (see chats.archive), one conversation and one chunk at a time.
+    Meant to run periodically; each run only moves what aged since the last.
+    """
+    help = "Move old messages into the compressed message archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archive messages older than this many days.')
+        parser.add_argument('--chunk-size', type=int, help='Messages per archive chunk.')
+        parser.add_argument('--conversation', type=uuid.UUID, help='Only archive this conversation.')
+
+    def handle(self, *args, **options):
+        age = get_archive_age() if options['days'] is None else timedelta(days=options['days'])
+        before = timezone.now() - age
+        chunk_size = options['chunk_size'] or get_archive_chunk_size()
+        conversation_ids = Conversation.objects.values_list('pk', flat=True)
+        if options['conversation']:
+            conversation_ids = conversation_ids.filter(pk=options['conversation'])
+
+        total = conversations = 0
+        # Each conversation's messages are found through the
+        # (conversation, sent_at, message_id) index; no index on sent_at alone
+        # is needed.
+        for conversation_id in conversation_ids.iterator():
+            archived = archive_conversation(conversation_id, before, chunk_size)
+            if archived:
+                total += archived
+                conversations += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'Archived {archived} messages of {conversation_id}.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {total} messages sent before {before:%Y-%m-%d %H:%M} from {conversations} conversation(s).'
+        ))
@@ -0,0 +1,234 @@
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chats.models import Conversation, Message, User
+from chats.signals import messages_bulk_created
+
+BENCHMARK_USERNAME = 'asgi-benchmark'
+
+# Server modes: gunicorn with sync workers, and with uvicorn workers serving
+# either the viewsets or chats.async_views.
+MODES = ('wsgi', 'asgi', 'asgi-async')
+
+
+class Command(BaseCommand):
+    """
+    Compares the throughput of the chats read paths served by gunicorn with
+    sync workers (WSGI) and with uvicorn workers (ASGI, as in production,
+    with the viewsets or with the async views) under a large number of
+    concurrent keep-alive connections.
+
+    The servers are started against the configured database, unless their
+    URLs are given, and every connection issues the same sequence of
+    authenticated GETs. Meanwhile `--slow-clients` connections send their
+    request headers a byte at a time, like clients on poor networks, until
+    the run ends. A server that gives each of them a thread stops serving
+    everyone else once they hold all its threads.
+    """
+    help = "Benchmark the chats read paths under WSGI and ASGI with many concurrent connections."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=1000, help='Concurrent client connections.')
+        parser.add_argument('--requests', type=int, default=5, help='Requests issued by each connection.')
+        parser.add_argument('--username', help='User to authenticate as (default: a seeded benchmark user).')
+        parser.add_argument(
+            '--slow-clients', type=int, default=100, help='Connections trickling their headers during the run.'
+        )
+        parser.add_argument('--slow-interval', type=float, default=1, help='Seconds between the bytes of a slow client.')
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES), help='Servers to benchmark.')
+        parser.add_argument('--wsgi-url', help='Base URL of an already running WSGI server.')
+        parser.add_argument('--asgi-url', help='Base URL of an already running ASGI server.')
+        parser.add_argument('--asgi-async-url', help='Base URL of an already running ASGI server with async views.')
+        parser.add_argument('--workers', type=int, default=1, help='gunicorn worker processes of each server.')
+        parser.add_argument('--wsgi-threads', type=int, default=8, help='Threads per gunicorn worker.')
+        parser.add_argument('--timeout', type=float, default=120, help='Per-request timeout in seconds.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+
+    def handle(self, *args, **options):
+        try:
+            import httpx  # noqa: F401
+        except ImportError:
+            raise CommandError('The benchmark needs httpx (see requirements.txt).')
+
+        user = self.get_user(options['username'])
+        conversation = Conversation.objects.filter(inbox_entries__user=user).first()
+        if conversation is None:
+            raise CommandError(f'User "{user.username}" has no conversations to read.')
+        token = str(AccessToken.for_user(user))
+        paths = [
+            '/api/conversations/',
+            f'/api/conversations/{conversation.pk}/',
+            f'/api/conversations/{conversation.pk}/messages/',
+        ]
+
+        results = []
+        for mode in options['modes']:
+            base_url = options[f'{mode.replace("-", "_")}_url']
+            server = None
+            if base_url is None:
+                server, base_url = self.start_server(mode, options)
+            try:
+                self.stdout.write(
+                    f'{mode}: {options["connections"]} connections and {options["slow_clients"]} slow clients '
+                    f'against {base_url}'
+                )
+                results.append(dict(
+                    mode=mode,
+                    **asyncio.run(self.drive(base_url, token, paths, options)),
+                ))
+            finally:
+                if server is not None:
+                    server.terminate()
+                    server.wait(timeout=30)
+
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'No user named "{username}".')
+        user, created = User.objects.get_or_create(
+            username=BENCHMARK_USERNAME,
+            defaults={'email': f'{BENCHMARK_USERNAME}@example.com', 'first_name': 'ASGI', 'last_name': 'Benchmark'},
+        )
+        if created:
+            self.stdout.write(f'Seeding user "{user.username}" with 30 conversations of 50 messages.')
+            for _ in range(30):
+                with transaction.atomic():
+                    conversation = Conversation.objects.create()
+                    conversation.participants.add(user)
+                    messages = Message.objects.bulk_create(
+                        Message(conversation=conversation, sender=user, message_body=f'Benchmark message {index}')
+                        for index in range(50)
+                    )
+                    messages_bulk_created.send(sender=Message, conversation=conversation, messages=messages)
+        return user
+
+    def start_server(self, mode, options):
+        """
+        Starts gunicorn with sync (wsgi) or uvicorn (asgi, asgi-async) workers
+        on a free local port and waits until it accepts connections.
+        """
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        command = [
+            sys.executable, '-m', 'gunicorn', f'messaging_app.{mode.split("-")[0]}:application',
+            '--bind', f'127.0.0.1:{port}', '--workers', str(options['workers']),
+            '--backlog', str(max(options['connections'], 2048)),
+        ]
+        # The worker class is always given: gunicorn also reads the
+        # gunicorn.conf.py in its working directory, which picks uvicorn.
+        if mode == 'wsgi':
+            command += ['--worker-class', 'sync', '--threads', str(options['wsgi_threads'])]
+        else:
+            command += ['--worker-class', 'uvicorn_worker.UvicornWorker']
+        env = dict(os.environ, CHATS_ASYNC_READ_VIEWS='1' if mode == 'asgi-async' else '0')
+        server = subprocess.Popen(
+            command, cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'{mode} server exited early: {" ".join(command)}')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return server, f'http://127.0.0.1:{port}'
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f'{mode} server did not start: {" ".join(command)}')
+
+    async def drive(self, base_url, token, paths, options):
+        import httpx
+
+        connections = options['connections']
+        limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+        headers = {'Authorization': f'Bearer {token}', 'Accept': 'application/json'}
+        latencies, errors = [], 0
+
+        async with httpx.AsyncClient(
+            base_url=base_url, headers=headers, limits=limits, timeout=options['timeout']
+        ) as client:
+            async def connection(index):
+                nonlocal errors
+                for number in range(options['requests']):
+                    path = paths[(index + number) % len(paths)]
+                    started = time.perf_counter()
+                    try:
+                        response = await client.get(path)
+                        ok = response.status_code == 200
+                    except httpx.HTTPError:
+                        ok = False
+                    latencies.append(time.perf_counter() - started)
+                    errors += not ok
+
+            done = asyncio.Event()
+            slow_clients = [
+                asyncio.create_task(self.slow_client(base_url, token, paths[0], options['slow_interval'], done))
+                for _ in range(options['slow_clients'])
+            ]
+            # Let the slow clients connect first, as they would on a live server.
+            await asyncio.sleep(min(options['slow_interval'], 1))
+            started = time.perf_counter()
+            await asyncio.gather(*(connection(index) for index in range(connections)))
+            elapsed = time.perf_counter() - started
+            done.set()
+            await asyncio.gather(*slow_clients)
+
+        latencies.sort()
+        return {
+            'requests': len(latencies),
+            'errors': errors,
+            'seconds': round(elapsed, 3),
+            'requests_per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(statistics.median(latencies) * 1000, 1),
+            'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+            'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+        }
+
+    async def slow_client(self, base_url, token, path, interval, done):
+        """
+        Sends the request line and headers of a GET, then one more header
+        byte every `interval` seconds until `done` is set, and hangs up.
+        """
+        host, port = base_url.split('://')[1].rsplit(':', 1)
+        try:
+            _, writer = await asyncio.open_connection(host, int(port))
+        except OSError:
+            return
+        try:
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nAuthorization: Bearer {token}\r\nX-Slow: '.encode())
+            while not done.is_set():
+                await writer.drain()
+                try:
+                    await asyncio.wait_for(done.wait(), interval)
+                except asyncio.TimeoutError:
+                    writer.write(b'x')
+        except OSError:
+            pass
+        finally:
+            writer.close()
+
+    def report(self, results):
+        columns = ('mode', 'requests', 'errors', 'requests_per_second', 'p50_ms', 'p95_ms', 'p99_ms')
+        self.stdout.write('')
+        self.stdout.write('  '.join(f'{column:>19}' for column in columns))
+        for result in results:
+            self.stdout.write('  '.join(f'{result[column]!s:>19}' for column in columns))
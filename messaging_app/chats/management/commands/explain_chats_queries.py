@@ -0,0 +1,93 @@
+import uuid
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from chats.models import Conversation, Message, User
+from chats.pagination import MessageCursorPagination
+from chats.views import ConversationViewSet, MessageViewSet
+
+
+class Command(BaseCommand):
+    """
+    Prints the EXPLAIN output for the main query of each chats endpoint and
+    flags plans that fall back to a full table scan.
+    """
+    help = "Print EXPLAIN output for the main query of each chats endpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='User whose data the queries are built for.')
+        parser.add_argument('--database', default='default', help='Database alias to explain against.')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['username'])
+        conversation = user.conversations.first() if user.pk else None
+        conversation_id = conversation.pk if conversation else uuid.uuid4()
+        request = SimpleNamespace(user=user, _request=SimpleNamespace())
+
+        paginator = MessageCursorPagination()
+        cursor = {'position': (timezone.now(), uuid.uuid4()), 'reverse': False}
+        messages = self.get_view_queryset(MessageViewSet, request, 'list', conversation_pk=conversation_id)
+        # The same EXISTS query chats.membership.is_participant runs.
+        membership = Conversation.participants.through.objects.filter(
+            conversation_id=conversation_id, user_id=user.pk
+        )
+
+        queries = [
+            ('conversation list', self.get_view_queryset(ConversationViewSet, request, 'list')),
+            ('conversation membership (EXISTS)', membership[:1]),
+            ('message list, first page', paginator.get_page_queryset(messages, None, paginator.page_size)),
+            ('message list, cursor page', paginator.get_page_queryset(messages, cursor, paginator.page_size)),
+            ('messages by sender', Message.objects.filter(sender_id=user.pk).order_by('-sent_at')[:50]),
+        ]
+
+        scans = []
+        for name, queryset in queries:
+            plan = queryset.using(options['database']).explain()
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(plan)
+            self.stdout.write('')
+            if self.has_full_scan(plan, connections[options['database']].vendor):
+                scans.append(name)
+
+        if scans:
+            self.stdout.write(self.style.WARNING('Full table scans in: ' + ', '.join(scans)))
+        else:
+            self.stdout.write(self.style.SUCCESS('No full table scans found.'))
+
+    def get_user(self, username):
+        if username is None:
+            # A placeholder is enough: plans do not depend on the user existing.
+            return User.objects.first() or User(user_id=uuid.uuid4())
+        try:
+            return User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f"User '{username}' does not exist.")
+
+    @staticmethod
+    def get_view_queryset(viewset_class, request, action, **kwargs):
+        """
+        Builds the queryset exactly as the viewset would for the given action.
+        """
+        view = viewset_class()
+        view.request = request
+        view.action = action
+        view.kwargs = kwargs
+        view.format_kwarg = None
+        return view.get_queryset()
+
+    @staticmethod
+    def has_full_scan(plan, vendor):
+        """
+        Detects full table scans in SQLite and MySQL plans.
+        """
+        if vendor == 'sqlite':
+            return any(
+                line.strip().startswith('SCAN') and ' USING ' not in line
+                for line in plan.splitlines()
+            )
+        if vendor == 'mysql':
+            return ' ALL ' in f' {plan} '
+        return 'Seq Scan' in plan
@@ -0,0 +1,285 @@
+import json
+import random
+import subprocess
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from chats import search
+from chats.inbox import rebuild_inbox_entries
+from chats.models import Conversation, ConversationParticipant, Message, User
+
+USERNAME_PREFIX = 'loadtest-'
+PASSWORD = 'loadtest-password'
+BATCH_SIZE = 1000
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    return sorted_values[max(int(round(fraction * len(sorted_values))) - 1, 0)]
+
+
+class QueryCounter:
+    """
+    Database execute wrapper that counts the queries run on a connection and
+    the time they took.
+    """
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    """
+    Load-tests the messaging API in process.
+
+    Seeds `loadtest-*` users, conversations and messages (once; later runs
+    reuse them unless --reseed is given), then runs --clients simulated
+    clients on as many threads. Each client obtains a JWT from /api/token/
+    and issues --requests requests drawn from the conversation list, a
+    message page of one of its conversations and send_message, through the
+    full Django stack (middleware, routing, views, rendering) without a
+    network in between. Every request's latency and SQL queries are recorded
+    on the client's own database connection.
+
+    The report gives throughput, p50/p95/p99 latency and mean queries per
+    request for each endpoint. --output writes it, with the commit and the
+    options of the run, to a JSON file for comparison across commits.
+    """
+    help = "Seed data and load-test the messaging API with concurrent simulated clients."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='Users to seed.')
+        parser.add_argument('--conversations', type=int, default=100, help='Conversations to seed.')
+        parser.add_argument('--participants', type=int, default=3, help='Participants per seeded conversation.')
+        parser.add_argument('--messages', type=int, default=50, help='Messages per seeded conversation.')
+        parser.add_argument('--reseed', action='store_true', help='Delete and recreate the seeded data.')
+        parser.add_argument('--clients', type=int, default=20, help='Concurrent simulated clients.')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per client after its token.')
+        parser.add_argument(
+            '--send-ratio', type=float, default=0.1, help='Share of requests that send a message (0 to 1).'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the request mix.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['send_ratio'] <= 1:
+            raise CommandError('--send-ratio must be between 0 and 1.')
+        if options['participants'] > options['users']:
+            raise CommandError('--participants cannot exceed --users.')
+
+        users = self.seed(options)
+        if not users:
+            raise CommandError('No seeded users have conversations.')
+        self.stdout.write(
+            f'Running {options["clients"]} clients x {options["requests"]} requests against {len(users)} users.'
+        )
+
+        samples = defaultdict(list)
+        lock = threading.Lock()
+        # The in-process client sends requests for 'testserver'.
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            threads = [
+                threading.Thread(
+                    target=self.run_client,
+                    args=(users[index % len(users)], options, random.Random(options['seed'] + index), samples, lock),
+                )
+                for index in range(options['clients'])
+            ]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+        results = self.summarize(samples, elapsed, options)
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}.')
+
+    def seed(self, options):
+        """
+        Creates the load-test data with bulk inserts and returns the seeded
+        users that have conversations, as (username, [conversation ids]).
+        """
+        seeded = User.objects.filter(username__startswith=USERNAME_PREFIX)
+        if options['reseed']:
+            Conversation.objects.filter(
+                pk__in=ConversationParticipant.objects.filter(user__in=seeded).values('conversation_id')
+            ).delete()
+            seeded.delete()
+        if not seeded.exists():
+            self.stdout.write(
+                f'Seeding {options["users"]} users, {options["conversations"]} conversations '
+                f'and {options["conversations"] * options["messages"]} messages.'
+            )
+            self.create_data(options)
+
+        memberships = defaultdict(list)
+        for username, conversation_id in ConversationParticipant.objects.filter(
+            user__username__startswith=USERNAME_PREFIX
+        ).values_list('user__username', 'conversation_id'):
+            memberships[username].append(conversation_id)
+        return sorted(memberships.items())
+
+    def create_data(self, options):
+        rng = random.Random(options['seed'])
+        password = make_password(PASSWORD)
+        users = [
+            User(
+                username=f'{USERNAME_PREFIX}{index}', email=f'{USERNAME_PREFIX}{index}@example.com',
+                first_name='Load', last_name=f'Test {index}', password=password,
+            )
+            for index in range(options['users'])
+        ]
+        conversations = [Conversation() for _ in range(options['conversations'])]
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+            Conversation.objects.bulk_create(conversations, batch_size=BATCH_SIZE)
+            members = {
+                conversation.pk: rng.sample(users, options['participants']) for conversation in conversations
+            }
+            ConversationParticipant.objects.bulk_create(
+                [
+                    ConversationParticipant(conversation_id=conversation_id, user=user)
+                    for conversation_id, participants in members.items()
+                    for user in participants
+                ],
+                batch_size=BATCH_SIZE,
+            )
+            messages = [
+                Message(
+                    conversation_id=conversation_id,
+                    sender=rng.choice(participants),
+                    message_body=f'Load test message {index}',
+                )
+                for conversation_id, participants in members.items()
+                for index in range(options['messages'])
+            ]
+            Message.objects.bulk_create(messages, batch_size=BATCH_SIZE)
+            # The bulk inserts bypassed the signals that keep these up to date.
+            rebuild_inbox_entries(list(members))
+            search.index_messages(messages, created=True)
+
+    def run_client(self, user, options, rng, samples, lock):
+        username, conversation_ids = user
+        client = Client()
+        counters = {alias: QueryCounter() for alias in connections}
+        wrappers = [connections[alias].execute_wrapper(counter) for alias, counter in counters.items()]
+        for wrapper in wrappers:
+            wrapper.__enter__()
+        try:
+            def request(endpoint, method, path, expected, **kwargs):
+                before = sum(counter.count for counter in counters.values())
+                started = time.perf_counter()
+                try:
+                    response = getattr(client, method)(path, **kwargs)
+                    error = None if response.status_code == expected else f'HTTP {response.status_code}'
+                except Exception as exc:
+                    response, error = None, type(exc).__name__
+                latency = time.perf_counter() - started
+                queries = sum(counter.count for counter in counters.values()) - before
+                with lock:
+                    samples[endpoint].append((latency, queries, error))
+                return response if error is None else None
+
+            response = request(
+                'token_obtain', 'post', '/api/token/', 200, data={'username': username, 'password': PASSWORD}
+            )
+            if response is None:
+                return
+            headers = {'authorization': f'Bearer {response.json()["access"]}', 'accept': 'application/json'}
+            for number in range(options['requests']):
+                conversation_id = rng.choice(conversation_ids)
+                draw = rng.random()
+                if draw < options['send_ratio']:
+                    request(
+                        'send_message', 'post', f'/api/conversations/{conversation_id}/send_message/', 201,
+                        data={'message_body': f'Load test reply {number}'}, content_type='application/json',
+                        headers=headers,
+                    )
+                elif draw < (1 + options['send_ratio']) / 2:
+                    # Reads are split evenly between the two lists.
+                    request('conversation_list', 'get', '/api/conversations/', 200, headers=headers)
+                else:
+                    request(
+                        'message_list', 'get', f'/api/conversations/{conversation_id}/messages/', 200,
+                        headers=headers,
+                    )
+        finally:
+            for wrapper in reversed(wrappers):
+                wrapper.__exit__(None, None, None)
+            connections.close_all()
+
+    def summarize(self, samples, elapsed, options):
+        endpoints = {}
+        for endpoint, rows in sorted(samples.items()):
+            latencies = sorted(latency for latency, _, _ in rows)
+            endpoints[endpoint] = {
+                'requests': len(rows),
+                'errors': sum(error is not None for _, _, error in rows),
+                'error_kinds': dict(Counter(error for _, _, error in rows if error is not None)),
+                'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+                'queries_per_request': round(sum(queries for _, queries, _ in rows) / len(rows), 2),
+            }
+        total = sum(endpoint['requests'] for endpoint in endpoints.values())
+        return {
+            'commit': self.get_commit(),
+            'started_at': timezone.now().isoformat(),
+            'database': connections['default'].vendor,
+            'options': {
+                name: options[name]
+                for name in ('users', 'conversations', 'participants', 'messages', 'clients', 'requests',
+                             'send_ratio', 'seed')
+            },
+            'seconds': round(elapsed, 3),
+            'requests': total,
+            'errors': sum(endpoint['errors'] for endpoint in endpoints.values()),
+            'requests_per_second': round(total / elapsed, 1) if elapsed else None,
+            'endpoints': endpoints,
+        }
+
+    @staticmethod
+    def get_commit():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def report(self, results):
+        columns = ('requests', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request')
+        self.stdout.write('')
+        self.stdout.write(f'{"endpoint":>19}  ' + '  '.join(f'{column:>19}' for column in columns))
+        for endpoint, result in results['endpoints'].items():
+            self.stdout.write(f'{endpoint:>19}  ' + '  '.join(f'{result[column]!s:>19}' for column in columns))
+        self.stdout.write(self.style.SUCCESS(
+            f'{results["requests"]} requests in {results["seconds"]}s: '
+            f'{results["requests_per_second"]} requests/s, {results["errors"]} errors.'
+        ))
@@ -0,0 +1,109 @@
+import time
+import uuid
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from chats import caching
+from chats.models import Conversation, Message
+from chats.sharding import get_message_shards, hashed_shard, set_placement, shard_for
+
+BATCH_SIZE = 2000
+
+
+class Command(BaseCommand):
+    """
+    Moves the messages of conversations between shards while they stay in use.
+
+    A move copies the messages to the target, switches the conversation's
+    placement so new reads and writes go to the target, waits `--grace`
+    seconds for requests that looked up the old placement to finish, copies
+    whatever they wrote, drops from the target what they deleted, and
+    finally deletes the messages from the source. An edit to a message made
+    on the source during the first copy may be lost.
+
+    The placement is kept in the chats cache, which must be shared by every
+    server process for the switch to be seen by all of them.
+    """
+    help = "Move the messages of conversations to another shard."
+
+    def add_arguments(self, parser):
+        parser.add_argument('conversation_id', nargs='?', type=uuid.UUID, help='Conversation to move.')
+        parser.add_argument('target', nargs='?', help='Database alias to move it to.')
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Move every conversation that is not on the shard its id hashes to, e.g. after adding a shard.',
+        )
+        parser.add_argument('--grace', type=float, default=5, help='Seconds to wait after switching placement.')
+
+    def handle(self, *args, **options):
+        shards = get_message_shards()
+        if options['all']:
+            moves = (
+                (conversation_id, hashed_shard(conversation_id))
+                for conversation_id in Conversation.objects.values_list('pk', flat=True).iterator()
+            )
+        elif options['conversation_id'] and options['target']:
+            if not Conversation.objects.filter(pk=options['conversation_id']).exists():
+                raise CommandError(f"Conversation '{options['conversation_id']}' does not exist.")
+            moves = [(options['conversation_id'], options['target'])]
+        else:
+            raise CommandError('Give a conversation id and a target shard, or --all.')
+
+        moved = 0
+        for conversation_id, target in moves:
+            if target not in shards:
+                raise CommandError(f"'{target}' is not one of CHATS_MESSAGE_SHARDS: {', '.join(shards)}.")
+            source = shard_for(conversation_id)
+            if source == target:
+                continue
+            count = self.move(conversation_id, source, target, options['grace'])
+            self.stdout.write(f'Moved {count} messages of {conversation_id} from {source} to {target}.')
+            moved += 1
+        self.stdout.write(self.style.SUCCESS(f'Moved {moved} conversation(s).'))
+
+    def move(self, conversation_id, source, target, grace):
+        source_messages = Message.objects.using(source).filter(conversation_id=conversation_id)
+        target_messages = Message.objects.using(target).filter(conversation_id=conversation_id)
+
+        self.copy(source_messages, target)
+        switched_at = timezone.now()
+        set_placement(conversation_id, target)
+        caching.bump_conversation(conversation_id)
+        if grace:
+            time.sleep(grace)
+
+        # Catch up with the requests that still used the source.
+        source_ids = self.copy(source_messages, target)
+        # Messages deleted on the source after they were copied.
+        stale = [
+            message_id for message_id in target_messages.filter(
+                sent_at__lt=switched_at
+            ).values_list('message_id', flat=True).iterator()
+            if message_id not in source_ids
+        ]
+        with transaction.atomic(using=target):
+            for start in range(0, len(stale), BATCH_SIZE):
+                target_messages.filter(message_id__in=stale[start:start + BATCH_SIZE])._raw_delete(target)
+
+        # Raw deletes send no signals, which would unindex messages that still
+        # exist on the target.
+        with transaction.atomic(using=source):
+            source_messages._raw_delete(source)
+        caching.bump_conversation(conversation_id)
+        return len(source_ids)
+
+    @staticmethod
+    def copy(messages, target):
+        """
+        Copies the messages that are missing on `target`, in batches, and
+        returns the ids of all of them.
+        """
+        ids = set()
+        rows = messages.order_by('sent_at', 'message_id').iterator(chunk_size=BATCH_SIZE)
+        while batch := list(islice(rows, BATCH_SIZE)):
+            ids.update(message.pk for message in batch)
+            Message.objects.using(target).bulk_create(batch, ignore_conflicts=True)
+        return ids
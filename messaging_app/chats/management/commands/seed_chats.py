@@ -0,0 +1,325 @@
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from chats import search
+from chats.models import Conversation, ConversationParticipant, InboxEntry, Message, User
+from chats.sharding import hashed_shard, is_sharded
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def allocate(total, weights):
+    """
+    Splits `total` into integer shares proportional to `weights`; the
+    rounding remainder goes to the heaviest weights.
+    """
+    weight_sum = sum(weights) or 1
+    shares = [int(total * weight / weight_sum) for weight in weights]
+    heaviest = sorted(range(len(weights)), key=weights.__getitem__, reverse=True)
+    for index in heaviest[:total - sum(shares)]:
+        shares[index] += 1
+    return shares
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """
+    Lets bulk_create store the given auto_now_add fields as set on the
+    instances instead of overwriting them with the current time.
+    """
+    saved = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now_add in zip(fields, saved):
+            field.auto_now_add = auto_now_add
+
+
+@contextmanager
+def fast_sqlite_writes():
+    """
+    Trades durability for speed on SQLite for the duration of the seeding:
+    no fsync and a larger page cache. A crash may leave the file corrupt,
+    which does not matter for generated data. Inside a transaction, where
+    SQLite does not allow the change, nothing is changed.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA synchronous')
+        synchronous = cursor.fetchone()[0]
+        cursor.execute('PRAGMA synchronous = OFF')
+        cursor.execute('PRAGMA cache_size = -262144')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA synchronous = {int(synchronous)}')
+
+
+class Command(BaseCommand):
+    """
+    Generates a large synthetic chats dataset for reproducing production
+    scale locally.
+
+    Rows are generated lazily and streamed into batched inserts, so memory
+    stays flat however many messages are asked for: bulk_create for most
+    tables, executemany for the messages themselves. Participants are
+    inserted into the through-table directly, and inbox rows and the search
+    index are built from the generated data at the end rather than by the
+    per-row signals.
+
+    The shape is skewed like real traffic: a few large group chats get
+    --group-share of the messages, the rest goes to many two-person DMs, and
+    both message counts per conversation and user activity follow a Pareto
+    distribution (--skew, lower is more skewed). Timestamps spread over the
+    last --days days.
+    """
+    help = "Generate a large synthetic chats dataset with bulk inserts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000, help='Users to create.')
+        parser.add_argument('--dms', type=int, default=50_000, help='Two-person conversations to create.')
+        parser.add_argument('--groups', type=int, default=20, help='Group conversations to create.')
+        parser.add_argument('--group-size', type=int, default=500, help='Participants per group conversation.')
+        parser.add_argument('--messages', type=int, default=1_000_000, help='Messages to create in total.')
+        parser.add_argument(
+            '--group-share', type=float, default=0.3, help='Share of the messages sent in group conversations.'
+        )
+        parser.add_argument('--skew', type=float, default=1.2, help='Pareto shape of activity; lower is more skewed.')
+        parser.add_argument('--days', type=int, default=365, help='Spread timestamps over this many days.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert.')
+        parser.add_argument('--prefix', default='seed-', help='Prefix of the generated usernames.')
+        parser.add_argument('--password', default='seed-password', help='Password of every generated user.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+        parser.add_argument('--no-search-index', action='store_true', help='Skip rebuilding the search index.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['users'] < options['group_size']:
+            raise CommandError('--users must be at least 2 and at least --group-size.')
+        if not 0 <= options['group_share'] <= 1:
+            raise CommandError('--group-share must be between 0 and 1.')
+        if User.objects.filter(username__startswith=options['prefix']).exists():
+            raise CommandError(f"Users prefixed '{options['prefix']}' exist already; pick another --prefix.")
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.start = self.now - timedelta(days=options['days'])
+        started = time.perf_counter()
+
+        with fast_sqlite_writes(), explicit_timestamps(Conversation._meta.get_field('created_at')):
+            user_ids = self.timed('users', self.create_users, options)
+            conversations = self.timed('conversations', self.create_conversations, user_ids, options)
+            self.timed('participants', self.create_participants, conversations)
+            latest = self.timed('messages', self.create_messages, conversations, options)
+            self.timed('inbox entries', self.create_inbox_entries, conversations, latest)
+        if not options['no_search_index']:
+            self.timed('search index', self.rebuild_search_index)
+
+        self.stdout.write(self.style.SUCCESS(f'Done in {time.perf_counter() - started:.1f}s.'))
+
+    def timed(self, name, step, *args):
+        """
+        Runs a step returning (rows written, result) and reports its rate.
+        """
+        started = time.perf_counter()
+        count, result = step(*args)
+        elapsed = time.perf_counter() - started
+        rate = f' ({count / elapsed:,.0f}/s)' if count and elapsed else ''
+        self.stdout.write(f'{name}: {count:,} in {elapsed:.1f}s{rate}')
+        return result
+
+    def random_time(self, after):
+        return after + (self.now - after) * self.rng.random()
+
+    def insert(self, model, rows, using=DEFAULT_DB_ALIAS):
+        """
+        Streams `rows` into `model` with one bulk insert per batch, in one
+        transaction, and returns how many were inserted.
+        """
+        count = 0
+        with transaction.atomic(using=using):
+            for batch in batched(rows, self.batch_size):
+                model.objects.using(using).bulk_create(batch)
+                count += len(batch)
+        return count
+
+    def insert_messages(self, rows, using=DEFAULT_DB_ALIAS):
+        """
+        Streams (message_id, conversation_id, sender_id, body, sent_at) tuples
+        into the messages table with executemany, one transaction per call.
+
+        bulk_create spends most of its time building instances and preparing
+        each field value; for millions of rows the values are adapted here
+        once per column type instead, the way the backend stores them.
+        """
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        fields = [Message._meta.get_field(name) for name in (
+            'message_id', 'conversation', 'sender', 'message_body', 'sent_at'
+        )]
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(Message._meta.db_table),
+            ', '.join(quote(field.column) for field in fields),
+            ', '.join(['%s'] * len(fields)),
+        )
+        native_uuid = connection.features.has_native_uuid_field
+        adapt_datetime = connection.ops.adapt_datetimefield_value
+        count = 0
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            for batch in batched(rows, self.batch_size):
+                cursor.executemany(sql, [
+                    (
+                        message_id if native_uuid else message_id.hex,
+                        conversation_id if native_uuid else conversation_id.hex,
+                        sender_id if native_uuid else sender_id.hex,
+                        body,
+                        adapt_datetime(sent_at),
+                    )
+                    for message_id, conversation_id, sender_id, body, sent_at in batch
+                ])
+                count += len(batch)
+        return count
+
+    def create_users(self, options):
+        password = make_password(options['password'])
+        prefix = options['prefix']
+        users = [uuid.uuid4() for _ in range(options['users'])]
+        self.insert(User, (
+            User(
+                user_id=user_id, username=f'{prefix}{index}', email=f'{prefix}{index}@example.com',
+                first_name='Seed', last_name=f'User {index}', password=password,
+            )
+            for index, user_id in enumerate(users)
+        ))
+        return len(users), users
+
+    def create_conversations(self, user_ids, options):
+        """
+        Returns [(conversation_id, created_at, [participant ids])], groups
+        first. DM partners are drawn by Pareto-distributed user activity.
+        """
+        rng = self.rng
+        activity = [rng.paretovariate(options['skew']) for _ in user_ids]
+        cumulative = []
+        running = 0
+        for weight in activity:
+            running += weight
+            cumulative.append(running)
+
+        conversations = []
+        for _ in range(options['groups']):
+            conversations.append((uuid.uuid4(), self.random_time(self.start), rng.sample(user_ids, options['group_size'])))
+        for _ in range(options['dms']):
+            first, second = rng.choices(user_ids, cum_weights=cumulative, k=2)
+            while second == first:
+                second = rng.choice(user_ids)
+            conversations.append((uuid.uuid4(), self.random_time(self.start), [first, second]))
+
+        sharded = is_sharded()
+        self.insert(Conversation, (
+            Conversation(
+                conversation_id=conversation_id, created_at=created_at,
+                message_shard=hashed_shard(conversation_id) if sharded else '',
+            )
+            for conversation_id, created_at, _ in conversations
+        ))
+        return len(conversations), conversations
+
+    def create_participants(self, conversations):
+        return self.insert(ConversationParticipant, (
+            ConversationParticipant(conversation_id=conversation_id, user_id=user_id)
+            for conversation_id, _, participants in conversations
+            for user_id in participants
+        )), None
+
+    def create_messages(self, conversations, options):
+        """
+        Inserts the messages, each conversation's in time order. The result
+        is {conversation_id: (message_id, body, sent_at) of the latest}, for
+        the inbox rows.
+        """
+        rng = self.rng
+        groups = options['groups']
+        weights = [rng.paretovariate(options['skew']) for _ in conversations]
+        group_messages = round(options['messages'] * options['group_share']) if groups else 0
+        counts = allocate(group_messages, weights[:groups]) + allocate(
+            options['messages'] - group_messages, weights[groups:]
+        )
+        latest = {}
+
+        def generate():
+            for (conversation_id, created_at, participants), count in zip(conversations, counts):
+                if not count:
+                    continue
+                # In groups a few members do most of the talking.
+                senders = [1 / (rank + 1) for rank in range(len(participants))]
+                sender_ids = rng.choices(participants, weights=senders, k=count)
+                span = (self.now - created_at).total_seconds()
+                offsets = sorted(rng.random() * span for _ in range(count))
+                body = f'Message {{}} of a {len(participants)}-person conversation'
+                for index, (sender_id, offset) in enumerate(zip(sender_ids, offsets)):
+                    row = (
+                        uuid.uuid4(), conversation_id, sender_id, body.format(index),
+                        created_at + timedelta(seconds=offset),
+                    )
+                    yield row
+                latest[conversation_id] = (row[0], row[3], row[4])
+
+        if not is_sharded():
+            return self.insert_messages(generate()), latest
+        # One buffer per shard; conversations were placed on their hashed shard.
+        count = 0
+        buffers = {}
+        for row in generate():
+            alias = hashed_shard(row[1])
+            buffer = buffers.setdefault(alias, [])
+            buffer.append(row)
+            if len(buffer) >= self.batch_size:
+                count += self.insert_messages(buffer, using=alias)
+                buffer.clear()
+        for alias, buffer in buffers.items():
+            count += self.insert_messages(buffer, using=alias)
+        return count, latest
+
+    def create_inbox_entries(self, conversations, latest):
+        """
+        One inbox row per participant, with the history already read, as
+        chats.inbox.open_inbox_entries creates them.
+        """
+        def generate():
+            for conversation_id, created_at, participants in conversations:
+                message_id, body, sent_at = latest.get(conversation_id, (None, '', None))
+                for user_id in participants:
+                    yield InboxEntry(
+                        user_id=user_id,
+                        conversation_id=conversation_id,
+                        last_message_at=sent_at or created_at,
+                        last_message_preview=body[:InboxEntry.PREVIEW_LENGTH],
+                        last_read_at=sent_at,
+                        last_read_message_id=message_id,
+                    )
+        return self.insert(InboxEntry, generate()), None
+
+    def rebuild_search_index(self):
+        # Rebuilt from every message, including any that existed before.
+        search.rebuild_index()
+        return Message.objects.count() if not is_sharded() else 0, None
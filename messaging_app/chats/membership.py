@@ -0,0 +1,41 @@
+from .models import Conversation
+
+# Attribute on the underlying HttpRequest that holds the memoized answers.
+_CACHE_ATTR = '_chats_membership_cache'
+
+
+def _request_cache(request):
+    """
+    Returns the membership cache for this request, creating it on first use.
+    The cache lives on the Django HttpRequest so it is shared between the
+    DRF Request wrapper, permission classes and the view itself.
+    """
+    http_request = getattr(request, '_request', request)
+    cache = getattr(http_request, _CACHE_ATTR, None)
+    if cache is None:
+        cache = {}
+        setattr(http_request, _CACHE_ATTR, cache)
+    return cache
+
+
+def is_participant(request, conversation):
+    """
+    Returns True if the requesting user participates in the conversation.
+
+    `conversation` may be a Conversation instance or its primary key. The
+    check is an EXISTS query on the participants through-table, served by its
+    unique (conversation, user) index, and the answer is memoized for the
+    rest of the request.
+    """
+    user = request.user
+    if not user or not user.is_authenticated:
+        return False
+
+    conversation_id = getattr(conversation, 'pk', conversation)
+    cache = _request_cache(request)
+    key = (str(user.pk), str(conversation_id))
+    if key not in cache:
+        cache[key] = Conversation.participants.through.objects.filter(
+            conversation_id=conversation_id, user_id=user.pk
+        ).exists()
+    return cache[key]
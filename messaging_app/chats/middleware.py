@@ -0,0 +1,126 @@
+import json
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+from .timing import RequestTimings, bind, current_timings, unbind
+
+logger = logging.getLogger('chats.timing')
+
+
+def get_sample_rate():
+    return getattr(settings, 'CHATS_SERVER_TIMING_SAMPLE_RATE', 0.0)
+
+
+class ServerTimingMiddleware:
+    """
+    Breaks the time of a sampled share of the requests down into SQL, view,
+    serializer and render phases (see chats.timing).
+
+    Sampled responses get a `Server-Timing` header, which browser developer
+    tools display, and one JSON log line on the `chats.timing` logger. Other
+    requests pass straight through. Should be first in MIDDLEWARE so that the
+    queries of the other middleware count too.
+
+    Works under WSGI and ASGI without moving async views to a thread; the
+    execute wrappers of async requests are installed on the thread their ORM
+    calls run on. Streaming responses are timed up to their first byte.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # Django runs the hooks in the handler's mode; sync ones would
+            # cost async requests a thread hop each.
+            self.process_view = self.aprocess_view
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if random.random() >= get_sample_rate():
+            return self.get_response(request)
+        timings = RequestTimings()
+        token = bind(timings)
+        timings.install()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings.uninstall()
+            unbind(token)
+        self.finish(request, response, timings)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= get_sample_rate():
+            return await self.get_response(request)
+        timings = RequestTimings()
+        token = bind(timings)
+        await sync_to_async(timings.install)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(timings.uninstall)()
+            unbind(token)
+        self.finish(request, response, timings)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.start_view()
+        return None
+
+    def process_template_response(self, request, response):
+        self.time_render(response)
+        return response
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        self.start_view()
+        return None
+
+    async def aprocess_template_response(self, request, response):
+        self.time_render(response)
+        return response
+
+    @staticmethod
+    def start_view():
+        timings = current_timings()
+        if timings is not None:
+            timings.view_started = time.perf_counter()
+
+    def time_render(self, response):
+        timings = current_timings()
+        if timings is None:
+            return
+        # Template responses are rendered after the view returns.
+        self.end_view(timings)
+        render_started = time.perf_counter()
+        response.add_post_render_callback(
+            lambda rendered: timings.add('render', time.perf_counter() - render_started)
+        )
+
+    @staticmethod
+    def end_view(timings):
+        if timings.view_started is not None:
+            timings.add('view', time.perf_counter() - timings.view_started)
+            timings.view_started = None
+
+    def finish(self, request, response, timings):
+        self.end_view(timings)
+        milliseconds = timings.milliseconds()
+        response['Server-Timing'] = timings.server_timing(milliseconds)
+        resolver_match = getattr(request, 'resolver_match', None)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': resolver_match.view_name if resolver_match else None,
+            'status': response.status_code,
+            'queries': timings.queries,
+            **{f'{name}_ms': duration for name, duration in milliseconds},
+        }))
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_inbox_entries(apps, schema_editor):
+    """
+    Creates an inbox row for every existing conversation participant.
+    """
+    Conversation = apps.get_model('chats', 'Conversation')
+    InboxEntry = apps.get_model('chats', 'InboxEntry')
+    Message = apps.get_model('chats', 'Message')
+    for conversation in Conversation.objects.prefetch_related('participants').iterator(chunk_size=500):
+        latest = Message.objects.filter(conversation=conversation).order_by('-sent_at', '-message_id').first()
+        InboxEntry.objects.bulk_create([
+            InboxEntry(
+                user=user,
+                conversation=conversation,
+                last_message_at=latest.sent_at if latest else conversation.created_at,
+                last_message_preview=latest.message_body[:100] if latest else '',
+            )
+            for user in conversation.participants.all()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0002_message_conversation_sent_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_at', models.DateTimeField()),
+                ('last_message_preview', models.CharField(blank=True, default='', max_length=100)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to='chats.conversation')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-last_message_at'], name='chats_inbox_user_activity_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'conversation'), name='chats_inbox_user_conv_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_inbox_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+
+def create_fulltext_index(apps, schema_editor):
+    """
+    SQLite: an FTS5 table kept in sync by chats.search on message save/delete.
+    MySQL: a FULLTEXT index on the message body, maintained by the server.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE chats_message_fts USING fts5("
+            "message_id UNINDEXED, conversation_id UNINDEXED, message_body, "
+            "tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            "INSERT INTO chats_message_fts (message_id, conversation_id, message_body) "
+            "SELECT message_id, conversation_id, message_body FROM chats_message"
+        )
+    elif vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE chats_message ADD FULLTEXT INDEX chats_msg_body_ft (message_body)')
+
+
+def drop_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS chats_message_fts')
+    elif vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE chats_message DROP INDEX chats_msg_body_ft')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0004_conversationparticipant_and_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0005_message_fulltext_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inboxentry',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='inboxentry',
+            name='last_read_message_id',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+    ]
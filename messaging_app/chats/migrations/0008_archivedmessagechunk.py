@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:50
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0007_message_sharding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMessageChunk',
+            fields=[
+                ('chunk_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('oldest_sent_at', models.DateTimeField()),
+                ('newest_sent_at', models.DateTimeField()),
+                ('message_count', models.PositiveIntegerField()),
+                ('payload', models.BinaryField()),
+                ('conversation', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_chunks', to='chats.conversation')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['conversation', 'newest_sent_at'], name='chats_archive_conv_newest_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+def create_fts_ids(apps, schema_editor):
+    """
+    SQLite: maps message ids to the integer rowids of their FTS5 rows, so the
+    index can update and delete a message's row without scanning the table.
+    Existing rows keep their rowids.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE TABLE chats_message_fts_ids ("
+        "id integer NOT NULL PRIMARY KEY, message_id char(32) NOT NULL UNIQUE)"
+    )
+    schema_editor.execute(
+        "INSERT OR IGNORE INTO chats_message_fts_ids (id, message_id) "
+        "SELECT rowid, message_id FROM chats_message_fts"
+    )
+    # Duplicate rows of a message, if any, would otherwise never be removed.
+    schema_editor.execute(
+        "DELETE FROM chats_message_fts WHERE rowid NOT IN (SELECT id FROM chats_message_fts_ids)"
+    )
+
+
+def drop_fts_ids(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS chats_message_fts_ids')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0008_archivedmessagechunk'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_ids, drop_fts_ids),
+    ]
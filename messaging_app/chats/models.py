@@ -1,4 +1,6 @@
-from django.db import models
+from contextlib import nullcontext
+
+from django.db import DEFAULT_DB_ALIAS, models, router, transaction
 from django.contrib.auth.models import AbstractUser
 import uuid
 
@@ -36,19 +38,161 @@ class User(AbstractUser):
 
 class Conversation(models.Model):
     conversation_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    participants = models.ManyToManyField(User, related_name='conversations')
+    participants = models.ManyToManyField(User, related_name='conversations', through='ConversationParticipant')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Database holding the conversation's messages (see chats.sharding);
+    # blank means 'default'.
+    message_shard = models.CharField(max_length=64, blank=True, default='')
 
     def __str__(self):
         return f"Converation {self.conversation_id}"
 
 
+class ConversationParticipant(models.Model):
+    """
+    Through-table between Conversation and User. It keeps the table name of
+    the former auto-created table so existing rows are preserved.
+    """
+    # Both single-column indexes are covered by the composite indexes below.
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+
+    class Meta:
+        db_table = 'chats_conversation_participants'
+        # Membership checks and conversation -> users lookups.
+        unique_together = [('conversation', 'user')]
+        indexes = [
+            # user -> conversations lookups (get_queryset, participant filters).
+            models.Index(fields=['user', 'conversation'], name='chats_part_user_conv_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} in Conversation {self.conversation_id}"
+
+
+class MessageQuerySet(models.QuerySet):
+    """
+    Inserts through a queryset not bound with using() go to the shard of the
+    messages' conversation (see chats.sharding), like Message.save does.
+    """
+
+    def _routed(self, message):
+        return self.using(router.db_for_write(self.model, instance=message))
+
+    def create(self, **kwargs):
+        if self._db is None:
+            return self._routed(self.model(**kwargs)).create(**kwargs)
+        return super().create(**kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if self._db is not None:
+            return super().bulk_create(objs, *args, **kwargs)
+        by_alias = {}
+        for message in objs:
+            by_alias.setdefault(router.db_for_write(self.model, instance=message), []).append(message)
+        created = []
+        for alias, messages in by_alias.items():
+            created.extend(self.using(alias).bulk_create(messages, *args, **kwargs))
+        return created
+
+
 class Message(models.Model):
     message_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    conversation = models.ForeignKey(Conversation, related_name='messages', on_delete=models.CASCADE)
-    sender = models.ForeignKey(User, related_name='sent_messages', on_delete=models.CASCADE)
+    # The conversation index is covered by chats_msg_conv_sent_idx. Neither
+    # key is a database constraint, since messages may live on another
+    # database than conversations and users (see chats.sharding).
+    conversation = models.ForeignKey(
+        Conversation, related_name='messages', on_delete=models.CASCADE, db_index=False, db_constraint=False
+    )
+    sender = models.ForeignKey(
+        User, related_name='sent_messages', on_delete=models.CASCADE, db_index=False, db_constraint=False
+    )
     message_body = models.TextField()
     sent_at = models.DateTimeField(auto_now_add=True)
 
+    objects = MessageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Serves the keyset pagination seek on (sent_at, message_id) within a conversation.
+            models.Index(fields=['conversation', 'sent_at', 'message_id'], name='chats_msg_conv_sent_idx'),
+            # A sender's messages, newest first.
+            models.Index(fields=['sender', '-sent_at'], name='chats_msg_sender_sent_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Keep the row and the post_save bookkeeping (inbox rows) in one
+        # transaction; with sharding, one on each database involved.
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        primary = transaction.atomic(using=DEFAULT_DB_ALIAS) if using != DEFAULT_DB_ALIAS else nullcontext()
+        with primary, transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+
     def __str__(self):
-        return f"Message {self.sender.username} in Conversation {self.conversation.conversation_id}"
\ No newline at end of file
+        return f"Message {self.sender.username} in Conversation {self.conversation.conversation_id}"
+
+
+class InboxEntry(models.Model):
+    """
+    Denormalized, per-user view of a conversation.
+
+    One row exists for every conversation participant. It is updated in the
+    same transaction as every new message, and after edits and deletes, so
+    a user's conversations can be listed in activity order from the
+    (user, last_message_at) index alone.
+
+    The row also holds the user's read watermark, the (sent_at, message_id)
+    position of the last message they have read (null until they first mark
+    the conversation read), and the number of messages from others past it.
+    """
+    PREVIEW_LENGTH = 100
+
+    # The user index is covered by the unique constraint and the activity index.
+    user = models.ForeignKey(User, related_name='inbox_entries', on_delete=models.CASCADE, db_index=False)
+    conversation = models.ForeignKey(Conversation, related_name='inbox_entries', on_delete=models.CASCADE)
+    last_message_at = models.DateTimeField()
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True, default='')
+    unread_count = models.PositiveIntegerField(default=0)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    last_read_message_id = models.UUIDField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'conversation'], name='chats_inbox_user_conv_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-last_message_at'], name='chats_inbox_user_activity_idx'),
+        ]
+
+    def __str__(self):
+        return f"Inbox of {self.user_id} for Conversation {self.conversation_id}"
+
+
+class ArchivedMessageChunk(models.Model):
+    """
+    A run of a conversation's oldest messages, moved out of the messages
+    table by `manage.py archive_messages` (see chats.archive).
+
+    The messages are stored as one compressed JSON payload, oldest first, so
+    the archive costs a single index entry per chunk. Archived messages are
+    always older than the conversation's messages still in the messages
+    table, and chunks of a conversation never overlap.
+    """
+    chunk_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # The conversation index is covered by chats_archive_conv_newest_idx.
+    conversation = models.ForeignKey(
+        Conversation, related_name='archived_chunks', on_delete=models.CASCADE, db_index=False
+    )
+    oldest_sent_at = models.DateTimeField()
+    newest_sent_at = models.DateTimeField()
+    message_count = models.PositiveIntegerField()
+    payload = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'newest_sent_at'], name='chats_archive_conv_newest_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.message_count} archived messages of Conversation {self.conversation_id}"
+
@@ -1,18 +1,176 @@
-from rest_framework.pagination import PageNumberPagination
+import uuid
+from base64 import b64decode, b64encode
+from urllib import parse
 
-class MessagePagination(PageNumberPagination):
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+class MessageCursorPagination(BasePagination):
     """
-    Custom pagination class to enforce 20 messages per page
-    and allow client-side control via query parameters.
+    Keyset pagination over messages, newest first.
+
+    Pages seek on the (sent_at, message_id) pair, which is backed by the
+    (conversation, sent_at, message_id) index on Message, so every page
+    costs the same no matter how deep the client has scrolled. No COUNT
+    query is issued. The cursor is opaque to clients and encodes the
+    position of the first or last row of the current page together with
+    the direction of travel.
     """
     page_size = 20
     page_size_query_param = 'page_size'
     max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
 
-    def get_paginated_response(self, data):
+    def paginate_queryset(self, queryset, request, view=None):
+        rows = list(self.prepare_page_queryset(queryset, request))
+        # Views may continue the page past the table (see chats.archive).
+        read_through = getattr(view, 'read_through_archive', None)
+        if read_through is not None:
+            rows = read_through(rows, self.cursor, self.page_size_requested + 1)
+        return self.set_page(rows)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        Async version of paginate_queryset, for the ASGI read views.
+        """
+        return self.set_page([row async for row in self.prepare_page_queryset(queryset, request)])
+
+    def prepare_page_queryset(self, queryset, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size_requested = self.get_page_size(request)
+        self.cursor = self.decode_cursor(request)
+        return self.get_page_queryset(queryset, self.cursor, self.page_size_requested)
+
+    def set_page(self, rows):
+        page_size, cursor = self.page_size_requested, self.cursor
+        if cursor is None or not cursor['reverse']:
+            self.has_next = len(rows) > page_size
+            self.has_previous = cursor is not None
+            rows = rows[:page_size]
+        else:
+            # Rows were read in ascending order; flip them back so the page
+            # is always newest first.
+            self.has_previous = len(rows) > page_size
+            self.has_next = True
+            rows = list(reversed(rows[:page_size]))
+
+        self.page = rows
+        return rows
+
+    def get_page_queryset(self, queryset, cursor, page_size):
+        """
+        Returns the sliced queryset for one page, including one extra row
+        that tells whether another page exists in the direction of travel.
+        """
+        queryset = queryset.order_by('-sent_at', '-message_id')
+        if cursor is None:
+            return queryset[:page_size + 1]
+        sent_at, message_id = cursor['position']
+        if not cursor['reverse']:
+            # Rows older than the position. Written as a range on sent_at
+            # minus the ties at the boundary so the index seek stays usable.
+            return queryset.filter(
+                Q(sent_at__lte=sent_at) & ~Q(sent_at=sent_at, message_id__gte=message_id)
+            )[:page_size + 1]
+        # Rows newer than the position, nearest first.
+        return queryset.filter(
+            Q(sent_at__gte=sent_at) & ~Q(sent_at=sent_at, message_id__lte=message_id)
+        ).order_by('sent_at', 'message_id')[:page_size + 1]
+
+    def get_page_size(self, request):
+        """
+        Returns the requested page size, capped at max_page_size. Missing,
+        malformed and non-positive values get the default.
         """
-        Customizes the response format if needed, but the check
-        "page.paginator.count" is an internal check used by the
-        framework to get the total count, which is handled here.
+        if self.page_size_query_param:
+            try:
+                page_size = int(request.query_params[self.page_size_query_param])
+            except (KeyError, ValueError):
+                return self.page_size
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        return self.page_size
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def decode_cursor(self, request):
+        """
+        Returns the decoded cursor from the request, or None for the first page.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            return self.decode_position(encoded)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, message, reverse):
+        # Pages hold Message instances, or values() rows on the fast list path.
+        if isinstance(message, dict):
+            sent_at, message_id = message['sent_at'], message['message_id']
+        else:
+            sent_at, message_id = message.sent_at, message.message_id
+        encoded = self.encode_position(sent_at, message_id, reverse=reverse)
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    @staticmethod
+    def encode_position(sent_at, message_id, reverse=False):
         """
-        return super().get_paginated_response(data)
\ No newline at end of file
+        Encodes a (sent_at, message_id) position into an opaque cursor string.
+        """
+        tokens = {'s': sent_at.isoformat(), 'm': str(message_id)}
+        if reverse:
+            tokens['r'] = '1'
+        querystring = parse.urlencode(tokens, doseq=True)
+        return b64encode(querystring.encode('ascii')).decode('ascii')
+
+    @staticmethod
+    def decode_position(encoded):
+        """
+        Decodes an opaque cursor string. Raises ValueError if it is malformed.
+        """
+        querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+        tokens = parse.parse_qs(querystring, keep_blank_values=True)
+        sent_at = parse_datetime(tokens['s'][0]) if 's' in tokens else None
+        if sent_at is None:
+            raise ValueError('Cursor has no position.')
+        message_id = uuid.UUID(tokens['m'][0]) if 'm' in tokens else None
+        if message_id is None:
+            raise ValueError('Cursor has no message id.')
+        return {
+            'position': (sent_at, message_id),
+            'reverse': tokens.get('r', ['0'])[0] == '1',
+        }
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -1,6 +1,5 @@
 from rest_framework import permissions
-# Corrects the import name
-# from .permissions import IsParticipantOrSender
+from .membership import is_participant
 
 class IsParticipantOrSender(permissions.BasePermission):
     """
@@ -13,11 +12,11 @@ class IsParticipantOrSender(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             # Check for Conversation object
             if hasattr(obj, 'participants'):
-                return request.user in obj.participants.all()
+                return is_participant(request, obj)
 
             # Check for Message object
             if hasattr(obj, 'sender'):
-                return request.user == obj.sender or request.user in obj.conversation.participants.all()
+                return request.user == obj.sender or is_participant(request, obj.conversation_id)
 
             return False
 
@@ -29,6 +28,6 @@ class IsParticipantOrSender(permissions.BasePermission):
         # For Conversation, only a participant may update/leave it, but often
         # deletion/modification is handled via specific view logic, not generic perm.
         if hasattr(obj, 'participants'):
-            return request.user in obj.participants.all()
+            return is_participant(request, obj)
 
         return False
\ No newline at end of file
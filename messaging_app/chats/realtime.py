@@ -0,0 +1,66 @@
+import json
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from .renderers import ORJSONRenderer
+from .serializers import MessageSerializer
+
+
+def conversation_group_name(conversation_id):
+    """
+    Channel layer group that every WebSocket subscribed to the conversation joins.
+    """
+    return f'chats.conversation.{conversation_id}'
+
+
+def user_group_name(user_id):
+    """
+    Channel layer group of every WebSocket a user has open, for membership
+    changes.
+    """
+    return f'chats.user.{user_id}'
+
+
+def push_membership(conversation_ids, user_ids, joined):
+    """
+    Tells the users' open WebSockets, once the current transaction commits,
+    to subscribe to (or, if not `joined`, leave) the conversations. Does
+    nothing when no channel layer is configured.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not conversation_ids or not user_ids:
+        return
+    event_type = 'chat.join' if joined else 'chat.leave'
+    events = [
+        (user_group_name(user_id), {'type': event_type, 'conversation': str(conversation_id)})
+        for user_id in user_ids
+        for conversation_id in conversation_ids
+    ]
+
+    def send():
+        for group, event in events:
+            async_to_sync(channel_layer.group_send)(group, event)
+
+    transaction.on_commit(send)
+
+
+def push_messages(conversation_id, messages):
+    """
+    Sends new messages to the conversation's group once the current
+    transaction commits. Does nothing when no channel layer is configured.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not messages:
+        return
+    # Channel layers only carry plain JSON types (UUIDs and datetimes would
+    # not survive msgpack on the Redis layer), so render the payloads here.
+    payloads = json.loads(ORJSONRenderer().render(MessageSerializer(messages, many=True).data))
+    group = conversation_group_name(conversation_id)
+
+    def send():
+        for payload in payloads:
+            async_to_sync(channel_layer.group_send)(group, {'type': 'chat.message', 'message': payload})
+
+    transaction.on_commit(send)
@@ -0,0 +1,172 @@
+import contextvars
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework import permissions
+
+from .caching import get_cache
+from .models import Conversation, Message
+from .sharding import get_message_shards, is_sharded, shard_for
+
+# Replica alias chosen for the reads of the current request, if any.
+_replica_alias = contextvars.ContextVar('chats_replica_alias', default=None)
+
+
+def get_read_replicas():
+    return list(getattr(settings, 'CHATS_READ_REPLICAS', []))
+
+
+def get_sticky_window():
+    return getattr(settings, 'CHATS_REPLICA_STICKY_SECONDS', 5)
+
+
+def sticky_key(user_id):
+    return f'chats:primary-sticky:{user_id}'
+
+
+def stick_to_primary(user):
+    """
+    Sends the user's reads to the primary for the sticky window, so they
+    read their own writes even while replicas lag behind.
+    """
+    if get_read_replicas() and user.is_authenticated:
+        get_cache().set(sticky_key(user.pk), True, timeout=get_sticky_window())
+
+
+def pick_replica(sticky):
+    replicas = get_read_replicas()
+    if not replicas or sticky:
+        return None
+    return random.choice(replicas)
+
+
+def use_replica(user):
+    """
+    Routes the rest of the current request's reads to one replica, unless the
+    user recently wrote. Returns a token for `reset_replica`.
+    """
+    sticky = bool(get_read_replicas()) and bool(get_cache().get(sticky_key(user.pk)))
+    return _replica_alias.set(pick_replica(sticky))
+
+
+async def ause_replica(user):
+    sticky = bool(get_read_replicas()) and bool(await get_cache().aget(sticky_key(user.pk)))
+    return _replica_alias.set(pick_replica(sticky))
+
+
+def reset_replica(token):
+    _replica_alias.reset(token)
+
+
+def current_replica():
+    """
+    Returns the replica the current request reads from, or None for the
+    primary.
+    """
+    return _replica_alias.get()
+
+
+class ReplicaRouter:
+    """
+    Sends reads to the replica picked for the current request (see
+    ReplicaReadMixin) and everything else to the primary.
+
+    Replicas are listed in CHATS_READ_REPLICAS. Without a replica for the
+    request, reads go where Django sends them by default.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _replica_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Instances read from a replica must still be saved to the primary.
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in get_read_replicas():
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_read_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class MessageShardRouter:
+    """
+    Sends Message queries that carry an instance hint (related managers,
+    saves, deletes, foreign key access) to the shard of the conversation,
+    and the users and conversations reached from a message to the primary.
+
+    Queries without a hint are left to the next router; code that spans
+    conversations goes through chats.sharding explicitly. Does nothing
+    unless CHATS_MESSAGE_SHARDS lists more than 'default'.
+    """
+
+    def _shard(self, instance):
+        if isinstance(instance, Message):
+            return instance._state.db or shard_for(instance.conversation_id)
+        if isinstance(instance, Conversation):
+            return shard_for(instance.pk)
+        return None
+
+    def db_for_read(self, model, **hints):
+        if not is_sharded():
+            return None
+        instance = hints.get('instance')
+        if model is Message:
+            return self._shard(instance)
+        if isinstance(instance, Message):
+            return _replica_alias.get() or DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        if not is_sharded():
+            return None
+        instance = hints.get('instance')
+        if model is Message:
+            if isinstance(instance, Message) and instance.conversation_id is not None:
+                # Where the row belongs, which is where it is unless it was
+                # read before its conversation moved.
+                return shard_for(instance.conversation_id)
+            return self._shard(instance)
+        if isinstance(instance, Message):
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not is_sharded() or not (isinstance(obj1, Message) or isinstance(obj2, Message)):
+            return None
+        databases = {DEFAULT_DB_ALIAS, *get_read_replicas(), *get_message_shards()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaReadMixin:
+    """
+    Serves safe `replica_actions` from a read replica and keeps a user on the
+    primary for CHATS_REPLICA_STICKY_SECONDS after any successful write.
+    Responses read from a replica are neither cached nor given validators
+    (see VersionedResponseCacheMixin), since the replica may lag behind the
+    version token they would be stored under.
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.replica_actions and request.method in permissions.SAFE_METHODS:
+            self._replica_token = use_replica(request.user)
+
+    def response_is_cacheable(self):
+        return super().response_is_cacheable() and current_replica() is None
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            reset_replica(token)
+            self._replica_token = None
+        if request.method not in permissions.SAFE_METHODS and response.status_code < 400:
+            stick_to_primary(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,189 @@
+import heapq
+from itertools import islice
+
+from django.db import connections, router
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+
+from .models import Conversation, Message
+from .sharding import get_message_shards, group_by_shard, is_sharded
+
+FTS_TABLE = 'chats_message_fts'
+# Integer rowids of the FTS rows by message id. FTS5 can only look its rows
+# up by rowid; filtering on message_id would scan the whole table.
+FTS_IDS_TABLE = 'chats_message_fts_ids'
+REBUILD_CHUNK_SIZE = 2000
+
+
+def _db_alias():
+    return router.db_for_write(Message)
+
+
+def _prep(field, value, connection):
+    """
+    Converts a value to the form the column stores (UUIDs are char(32) hex on
+    SQLite and MySQL).
+    """
+    return field.get_db_prep_value(value, connection)
+
+
+def build_match_query(text):
+    """
+    Turns free text into an FTS5 query that matches all terms, treating each
+    term as a quoted phrase so user input cannot inject FTS syntax.
+    """
+    terms = [term.replace('"', '""') for term in text.split()]
+    return ' '.join(f'"{term}"' for term in terms if term)
+
+
+def index_messages(messages, created=False):
+    """
+    Adds or refreshes messages in the full-text index. Only SQLite needs
+    this; MySQL maintains its FULLTEXT index itself. `created` messages are
+    known not to be indexed yet, so their rows are inserted outright.
+    """
+    connection = connections[_db_alias()]
+    if connection.vendor != 'sqlite' or not messages:
+        return
+    pk = Message._meta.pk
+    conversation_fk = Message._meta.get_field('conversation')
+    rows = [
+        (
+            _prep(pk, message.pk, connection),
+            _prep(conversation_fk, message.conversation_id, connection),
+            message.message_body,
+        )
+        for message in messages
+    ]
+    if created:
+        insert_id, insert_row = 'INSERT', 'INSERT'
+    else:
+        # Indexed messages keep their rowid and have their row replaced.
+        insert_id, insert_row = 'INSERT OR IGNORE', 'INSERT OR REPLACE'
+    with connection.cursor() as cursor:
+        cursor.executemany(f'{insert_id} INTO {FTS_IDS_TABLE} (message_id) VALUES (%s)', [row[:1] for row in rows])
+        cursor.executemany(
+            f'{insert_row} INTO {FTS_TABLE} (rowid, message_id, conversation_id, message_body) '
+            f'SELECT id, %s, %s, %s FROM {FTS_IDS_TABLE} WHERE message_id = %s',
+            [(*row, row[0]) for row in rows],
+        )
+
+
+def unindex_message(message):
+    unindex_messages([message])
+
+
+def unindex_messages(messages):
+    connection = connections[_db_alias()]
+    if connection.vendor != 'sqlite' or not messages:
+        return
+    message_ids = [[_prep(Message._meta.pk, message.pk, connection)] for message in messages]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT id FROM {FTS_IDS_TABLE} WHERE message_id = %s)',
+            message_ids,
+        )
+        cursor.executemany(f'DELETE FROM {FTS_IDS_TABLE} WHERE message_id = %s', message_ids)
+
+
+def rebuild_index():
+    """
+    Rebuilds the SQLite full-text index from the messages table. Used after
+    loading data that bypassed the model signals.
+
+    The index lives on the primary; sharded messages are copied into it in
+    chunks from each shard.
+    """
+    connection = connections[_db_alias()]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(f'DELETE FROM {FTS_IDS_TABLE}')
+        if not is_sharded():
+            cursor.execute(f'INSERT INTO {FTS_IDS_TABLE} (message_id) SELECT message_id FROM {Message._meta.db_table}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, message_id, conversation_id, message_body) '
+                f'SELECT i.id, m.message_id, m.conversation_id, m.message_body '
+                f'FROM {Message._meta.db_table} m JOIN {FTS_IDS_TABLE} i ON i.message_id = m.message_id'
+            )
+            return
+    for alias in get_message_shards():
+        messages = Message.objects.using(alias).only(
+            'message_id', 'conversation_id', 'message_body'
+        ).iterator(chunk_size=REBUILD_CHUNK_SIZE)
+        while chunk := list(islice(messages, REBUILD_CHUNK_SIZE)):
+            index_messages(chunk, created=True)
+
+
+def search_message_ids(user, text, limit, offset=0):
+    """
+    Returns the ids of the best matching messages in the user's conversations,
+    best match first.
+
+    SQLite uses the FTS5 table ranked by bm25(); MySQL uses the FULLTEXT
+    index ranked by MATCH ... AGAINST. Other databases fall back to a
+    substring scan, which is only meant for development. Sharded messages
+    keep the SQLite index on the primary; otherwise each shard is searched
+    and the results merged.
+    """
+    connection = connections[_db_alias()]
+    if is_sharded() and connection.vendor != 'sqlite':
+        return scatter_search(user, text, limit, offset)
+    participants = Conversation.participants.through._meta.db_table
+    messages = Message._meta.db_table
+    user_id = _prep(Conversation.participants.through._meta.get_field('user'), user.pk, connection)
+
+    if connection.vendor == 'sqlite':
+        match = build_match_query(text)
+        if not match:
+            return []
+        sql = (
+            f'SELECT f.message_id FROM {FTS_TABLE} f '
+            f'JOIN {participants} p ON p.conversation_id = f.conversation_id '
+            f'WHERE {FTS_TABLE} MATCH %s AND p.user_id = %s '
+            f'ORDER BY bm25({FTS_TABLE}) LIMIT %s OFFSET %s'
+        )
+        params = [match, user_id, limit, offset]
+    elif connection.vendor == 'mysql':
+        sql = (
+            f'SELECT m.message_id FROM {messages} m '
+            f'JOIN {participants} p ON p.conversation_id = m.conversation_id '
+            f'WHERE MATCH(m.message_body) AGAINST (%s IN NATURAL LANGUAGE MODE) AND p.user_id = %s '
+            f'ORDER BY MATCH(m.message_body) AGAINST (%s IN NATURAL LANGUAGE MODE) DESC '
+            f'LIMIT %s OFFSET %s'
+        )
+        params = [text, user_id, text, limit, offset]
+    else:
+        return list(
+            Message.objects.filter(
+                conversation__participants=user, message_body__icontains=text
+            ).order_by('-sent_at').values_list('message_id', flat=True)[offset:offset + limit]
+        )
+
+    pk = Message._meta.pk
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [pk.to_python(row[0]) for row in cursor.fetchall()]
+
+
+def scatter_search(user, text, limit, offset):
+    """
+    Searches the messages of the user's conversations on each shard and
+    merges the per-shard rankings: MATCH relevance on MySQL, recency
+    elsewhere.
+    """
+    conversation_ids = list(user.conversations.values_list('pk', flat=True))
+    rankings = []
+    for alias, ids in group_by_shard(conversation_ids).items():
+        messages = Message.objects.using(alias).filter(conversation_id__in=ids)
+        if connections[alias].vendor == 'mysql':
+            messages = messages.annotate(
+                rank=RawSQL('MATCH(message_body) AGAINST (%s IN NATURAL LANGUAGE MODE)', [text])
+            ).filter(rank__gt=0)
+        else:
+            messages = messages.filter(message_body__icontains=text).annotate(rank=F('sent_at'))
+        # The best `offset + limit` of each shard cover the requested page.
+        rankings.append(messages.order_by('-rank').values_list('rank', 'message_id')[:offset + limit])
+    merged = heapq.merge(*rankings, key=lambda row: row[0], reverse=True)
+    return [message_id for _, message_id in merged][offset:offset + limit]
@@ -1,7 +1,19 @@
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
-from .models import User, Conversation, Message
+from .models import User, Conversation, InboxEntry, Message
+from .sharding import with_senders
+from .timing import phase
 
-class UserSerializer(serializers.ModelSerializer):
+class TimedRepresentationMixin:
+    """
+    Reports building representations as the request's 'serializer' phase.
+    """
+    def to_representation(self, instance):
+        with phase('serializer'):
+            return super().to_representation(instance)
+
+class UserSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     """
     Serializer for the User model.
     """
@@ -10,7 +22,7 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['user_id', 'username', 'email', 'first_name', 'last_name', 'phone_number', 'role']
         read_only_fields = ['user_id', 'email']
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     """
     Serializer for the Message model.
     It includes nested user data for the sender.
@@ -33,32 +45,100 @@ class MessageSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Message body cannot be empty.")
         return value
 
-class ConversationSerializer(serializers.ModelSerializer):
+class SentMessageSerializer(serializers.ModelSerializer):
+    """
+    Validates a message sent to the conversation in the URL (send_message,
+    send_messages). Only the body is read from the payload, so validating a
+    batch costs no conversation lookups.
+    """
+    message_body = serializers.CharField(max_length=2000)
+
+    class Meta:
+        model = Message
+        fields = ['message_body']
+
+    validate_message_body = MessageSerializer.validate_message_body
+
+def get_message_preview_size():
+    """
+    Number of latest messages embedded in each serialized conversation.
+    """
+    return getattr(settings, 'CHATS_MESSAGE_PREVIEW_SIZE', 3)
+
+
+class ConversationSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     """
     Serializer for the Conversation model.
-    It includes nested relationships for participants and messages.
+    It includes nested participants and a preview of the latest messages.
+    The full history is served by the paginated messages endpoint.
+    New conversations take their participants as `participant_ids`.
     """
     participants = UserSerializer(many=True, read_only=True)
+    participant_ids = serializers.ListField(child=serializers.UUIDField(), write_only=True, required=False)
     messages = serializers.SerializerMethodField()
 
     class Meta:
         model = Conversation
-        fields = ['conversation_id', 'participants', 'messages', 'created_at']
+        fields = ['conversation_id', 'participants', 'participant_ids', 'messages', 'created_at']
         read_only_fields = ['conversation_id', 'created_at']
 
     def get_messages(self, obj):
         """
-        Returns a list of messages for the conversation.
+        Returns the latest messages of the conversation, oldest first.
+        Uses the `latest_messages` prefetch when the view provided it.
+        """
+        messages = getattr(obj, 'latest_messages', None)
+        if messages is None:
+            messages = with_senders(obj.messages).order_by(
+                '-sent_at', '-message_id'
+            )[:get_message_preview_size()]
+        return MessageSerializer(list(reversed(messages)), many=True).data
+
+    def validate_participant_ids(self, value):
+        """
+        Checks that every id belongs to a user, with one query for the whole
+        list. Duplicates are dropped.
         """
-        messages = obj.messages.all().order_by('sent_at')
-        return MessageSerializer(messages, many=True).data
+        user_ids = list(dict.fromkeys(value))
+        found = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+        unknown = [str(user_id) for user_id in user_ids if user_id not in found]
+        if unknown:
+            raise serializers.ValidationError(f"Unknown users: {', '.join(unknown)}.")
+        return user_ids
 
     def validate(self, data):
         """
-        Example of object-level validation.
+        Participants are only set on creation; later changes go through
+        the membership of the conversation.
         """
-        if 'participants' not in data and self.instance is None:
-            # This is a hypothetical check for creating a new conversation
-            # with at least one participant.
-            raise serializers.ValidationError("New conversations must have participants.")
+        if self.instance is not None and 'participant_ids' in data:
+            raise serializers.ValidationError("Participants of an existing conversation cannot be replaced.")
         return data
+
+    def create(self, validated_data):
+        """
+        Creates the conversation with its participants, and `creator` if the
+        view passes one, in one transaction. The through-table rows and their
+        inbox rows are each written with one bulk insert.
+        """
+        participant_ids = validated_data.pop('participant_ids', [])
+        creator = validated_data.pop('creator', None)
+        if creator is not None and creator.pk not in participant_ids:
+            participant_ids.append(creator.pk)
+        with transaction.atomic():
+            conversation = super().create(validated_data)
+            if participant_ids:
+                conversation.participants.add(*participant_ids)
+        return conversation
+
+
+class ReadStateSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
+    """
+    Serializer for a user's read state in one conversation, from their inbox row.
+    """
+    conversation = serializers.UUIDField(source='conversation_id', read_only=True)
+
+    class Meta:
+        model = InboxEntry
+        fields = ['conversation', 'unread_count', 'last_read_at', 'last_read_message_id']
+        read_only_fields = ['unread_count', 'last_read_at', 'last_read_message_id']
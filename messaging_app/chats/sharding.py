@@ -0,0 +1,194 @@
+"""
+Placement of Message rows across the databases in CHATS_MESSAGE_SHARDS.
+
+Every message lives on the shard of its conversation. A new conversation is
+placed by a stable hash of its id, and the placement is recorded in
+Conversation.message_shard so that changing the list of shards never moves
+existing conversations implicitly; `manage.py reshard_messages` moves them.
+Conversations without a recorded placement (created before sharding was
+enabled, or inserted in bulk) live on 'default'. Everything else (users,
+conversations, participants, inbox rows and the search index) stays on the
+primary.
+
+Queries that know their conversation go to its shard (`messages_for`,
+related managers through chats.routers.MessageShardRouter). The few that
+span conversations gather from every shard (`scatter_in_bulk`,
+`scatter_values`). With the default single shard, 'default', none of this
+changes a query.
+"""
+
+import zlib
+from contextlib import contextmanager, nullcontext
+from itertools import chain
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .caching import get_cache
+from .models import Conversation, Message, User
+
+
+def get_message_shards():
+    return list(getattr(settings, 'CHATS_MESSAGE_SHARDS', [DEFAULT_DB_ALIAS]))
+
+
+def is_sharded():
+    return get_message_shards() != [DEFAULT_DB_ALIAS]
+
+
+def hashed_shard(conversation_id):
+    """
+    The shard a new conversation is placed on.
+    """
+    shards = get_message_shards()
+    return shards[zlib.crc32(str(conversation_id).encode('ascii')) % len(shards)]
+
+
+def placement_key(conversation_id):
+    return f'chats:shard:{conversation_id}'
+
+
+def shard_for(conversation_id):
+    """
+    Returns the database alias holding the conversation's messages. The
+    placement is read from the primary once and then kept in the chats cache.
+    """
+    if not is_sharded():
+        return DEFAULT_DB_ALIAS
+    cache = get_cache()
+    alias = cache.get(placement_key(conversation_id))
+    if alias is None:
+        placement = Conversation.objects.using(DEFAULT_DB_ALIAS).filter(
+            pk=conversation_id
+        ).values_list('message_shard', flat=True)
+        for message_shard in placement:
+            alias = message_shard or DEFAULT_DB_ALIAS
+            cache.set(placement_key(conversation_id), alias, timeout=None)
+    # Unknown conversations have no messages anywhere; they are not cached,
+    # so one created later is looked up again.
+    return alias or DEFAULT_DB_ALIAS
+
+
+async def ashard_for(conversation_id):
+    if not is_sharded():
+        return DEFAULT_DB_ALIAS
+    cache = get_cache()
+    alias = await cache.aget(placement_key(conversation_id))
+    if alias is None:
+        placement = Conversation.objects.using(DEFAULT_DB_ALIAS).filter(
+            pk=conversation_id
+        ).values_list('message_shard', flat=True)
+        async for message_shard in placement:
+            alias = message_shard or DEFAULT_DB_ALIAS
+            await cache.aset(placement_key(conversation_id), alias, timeout=None)
+    return alias or DEFAULT_DB_ALIAS
+
+
+def set_placement(conversation_id, alias):
+    """
+    Records that the conversation's messages now live on `alias`.
+    """
+    Conversation.objects.using(DEFAULT_DB_ALIAS).filter(pk=conversation_id).update(message_shard=alias)
+    get_cache().set(placement_key(conversation_id), alias, timeout=None)
+
+
+@contextmanager
+def atomic_with_shard(conversation_id):
+    """
+    Opens a transaction on the primary and, when it is another database, on
+    the conversation's shard. Yields the shard's alias.
+    """
+    alias = shard_for(conversation_id)
+    shard = transaction.atomic(using=alias) if alias != DEFAULT_DB_ALIAS else nullcontext()
+    with transaction.atomic(using=DEFAULT_DB_ALIAS), shard:
+        yield alias
+
+
+def messages_for(conversation_id):
+    """
+    Returns the conversation's messages, read from its shard.
+    """
+    return Message.objects.using(shard_for(conversation_id)).filter(conversation_id=conversation_id)
+
+
+async def amessages_for(conversation_id):
+    return Message.objects.using(await ashard_for(conversation_id)).filter(conversation_id=conversation_id)
+
+
+def with_senders(queryset):
+    """
+    Loads message senders with the messages. Senders live on the primary, so
+    sharded messages cannot join them and get them with a second query.
+    """
+    if is_sharded():
+        return queryset.prefetch_related('sender')
+    return queryset.select_related('sender')
+
+
+def group_by_shard(conversation_ids):
+    shards = {}
+    for conversation_id in conversation_ids:
+        shards.setdefault(shard_for(conversation_id), []).append(conversation_id)
+    return shards
+
+
+def scatter_in_bulk(message_ids):
+    """
+    Returns {message_id: Message} for ids that may live on any shard, with
+    senders loaded.
+    """
+    found = {}
+    for alias in get_message_shards():
+        missing = [message_id for message_id in message_ids if message_id not in found]
+        if not missing:
+            break
+        found.update(with_senders(Message.objects.using(alias)).in_bulk(missing))
+    return found
+
+
+def scatter_values(build, conversation_ids):
+    """
+    Runs `build(queryset, conversation_ids)` on the shard of each group of
+    conversations and chains the values() rows.
+    """
+    return list(chain.from_iterable(
+        build(Message.objects.using(alias), ids) for alias, ids in group_by_shard(conversation_ids).items()
+    ))
+
+
+def fill_sender_columns(rows, joined):
+    """
+    Adds the `sender__*` columns to values() rows read without the join, with
+    one query on the primary. Rows that already have them are left alone.
+    """
+    missing = [row for row in rows if joined and joined[0] not in row]
+    if not missing:
+        return rows
+    fields = [column[len('sender__'):] for column in joined]
+    senders = {
+        row['pk']: row for row in User.objects.using(DEFAULT_DB_ALIAS).filter(
+            pk__in={row['sender_id'] for row in missing}
+        ).values('pk', *fields)
+    }
+    for row in missing:
+        sender = senders.get(row['sender_id'], {})
+        for column, field in zip(joined, fields):
+            row[column] = sender.get(field)
+    return rows
+
+
+async def afill_sender_columns(rows, joined):
+    missing = [row for row in rows if joined and joined[0] not in row]
+    if not missing:
+        return rows
+    fields = [column[len('sender__'):] for column in joined]
+    senders = {
+        row['pk']: row async for row in User.objects.using(DEFAULT_DB_ALIAS).filter(
+            pk__in={row['sender_id'] for row in missing}
+        ).values('pk', *fields)
+    }
+    for row in missing:
+        sender = senders.get(row['sender_id'], {})
+        for column, field in zip(joined, fields):
+            row[column] = sender.get(field)
+    return rows
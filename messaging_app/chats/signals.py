@@ -0,0 +1,198 @@
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+
+from . import caching, inbox, realtime, search, sharding
+from .auth import user_claims_cache
+from .models import Conversation, Message, User
+
+# Sent by views that insert messages with bulk_create, which skips post_save.
+# Arguments: conversation, messages.
+messages_bulk_created = Signal()
+
+
+@receiver(post_save, sender=Message)
+def update_inbox_on_message_save(sender, instance, created, **kwargs):
+    """
+    Updates the participants' inbox rows whenever a message is saved: a new
+    message is recorded, an edit may change the preview.
+    """
+    if created:
+        inbox.record_messages(instance.conversation_id, [instance])
+    else:
+        inbox.refresh_latest_message(instance.conversation_id)
+
+
+@receiver(post_delete, sender=Message)
+def update_inbox_on_message_delete(sender, instance, origin=None, **kwargs):
+    """
+    Takes a deleted message out of the unread counts and the preview. Not
+    needed when the whole conversation is being deleted with its inbox rows.
+    """
+    if isinstance(origin, Conversation):
+        return
+    inbox.forget_message(instance)
+
+
+@receiver(messages_bulk_created)
+def update_inbox_on_bulk_messages(sender, conversation, messages, **kwargs):
+    """
+    Updates the participants' inbox rows after a bulk insert.
+    """
+    inbox.record_messages(conversation.pk, messages)
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def sync_inbox_with_participants(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps one inbox row per participant as participants are added or removed.
+    `reverse` is True when the change was made from the user side
+    (user.conversations.add(...)).
+    """
+    if action == 'post_add':
+        if reverse:
+            for conversation_id in pk_set:
+                inbox.open_inbox_entries(conversation_id, [instance.pk])
+        else:
+            inbox.open_inbox_entries(instance.pk, pk_set)
+    elif action == 'post_remove':
+        if reverse:
+            for conversation_id in pk_set:
+                inbox.close_inbox_entries(conversation_id, [instance.pk])
+        else:
+            inbox.close_inbox_entries(instance.pk, pk_set)
+    elif action == 'pre_clear':
+        if reverse:
+            instance.inbox_entries.all().delete()
+        else:
+            inbox.close_inbox_entries(instance.pk)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def invalidate_responses_on_message_change(sender, instance, **kwargs):
+    """
+    Bumps the conversation version when a message is created, edited or deleted.
+    """
+    caching.bump_conversation(instance.conversation_id)
+
+
+@receiver(messages_bulk_created)
+def invalidate_responses_on_bulk_messages(sender, conversation, messages, **kwargs):
+    caching.bump_conversation(conversation.pk)
+
+
+@receiver(pre_delete, sender=Conversation)
+def invalidate_responses_on_conversation_delete(sender, instance, **kwargs):
+    caching.bump_conversation(instance.pk)
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def invalidate_responses_on_participant_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Bumps the versions of the conversations whose participants changed and
+    of the users who joined or left them.
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        conversation_ids = pk_set if pk_set is not None else list(
+            instance.conversations.values_list('pk', flat=True)
+        )
+        user_ids = [instance.pk]
+    else:
+        conversation_ids = [instance.pk]
+        user_ids = pk_set or ()
+    for conversation_id in conversation_ids:
+        caching.bump_conversation(conversation_id)
+    caching.bump_versions(user_ids=user_ids)
+
+
+@receiver(post_save, sender=Message)
+def index_message_on_save(sender, instance, created, **kwargs):
+    """
+    Keeps the full-text index in sync with created and edited messages.
+    """
+    search.index_messages([instance], created=created)
+
+
+@receiver(messages_bulk_created)
+def index_bulk_messages(sender, conversation, messages, **kwargs):
+    search.index_messages(messages, created=True)
+
+
+@receiver(post_delete, sender=Message)
+def unindex_message_on_delete(sender, instance, **kwargs):
+    search.unindex_message(instance)
+
+
+@receiver(pre_save, sender=Conversation)
+def place_new_conversation(sender, instance, **kwargs):
+    """
+    Records the shard a new conversation's messages will live on.
+    """
+    if instance._state.adding and not instance.message_shard and sharding.is_sharded():
+        instance.message_shard = sharding.hashed_shard(instance.pk)
+
+
+@receiver(pre_delete, sender=Conversation)
+def delete_sharded_messages_of_conversation(sender, instance, **kwargs):
+    """
+    Cascades a conversation delete to its messages on another shard, which
+    the delete collector, working on the primary, cannot see.
+    """
+    if sharding.shard_for(instance.pk) != DEFAULT_DB_ALIAS:
+        sharding.messages_for(instance.pk).delete()
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_messages_of_user(sender, instance, **kwargs):
+    """
+    Cascades a user delete to the messages they sent on the other shards.
+    """
+    for alias in sharding.get_message_shards():
+        if alias != DEFAULT_DB_ALIAS:
+            Message.objects.using(alias).filter(sender_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def evict_cached_user_claims(sender, instance, **kwargs):
+    """
+    Drops the user's cached claims so the next request reloads them.
+    """
+    user_claims_cache.evict(instance.pk)
+
+
+@receiver(post_save, sender=Message)
+def push_new_message(sender, instance, created, **kwargs):
+    """
+    Broadcasts a new message to the WebSockets subscribed to its conversation.
+    """
+    if created:
+        realtime.push_messages(instance.conversation_id, [instance])
+
+
+@receiver(messages_bulk_created)
+def push_bulk_messages(sender, conversation, messages, **kwargs):
+    realtime.push_messages(conversation.pk, messages)
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def push_membership_changes(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Subscribes open WebSockets to conversations their user joins, and
+    unsubscribes them from those they leave.
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if action == 'pre_clear':
+        pk_set = set(
+            instance.conversations.values_list('pk', flat=True) if reverse
+            else instance.participants.values_list('pk', flat=True)
+        )
+    if reverse:
+        conversation_ids, user_ids = pk_set, [instance.pk]
+    else:
+        conversation_ids, user_ids = [instance.pk], pk_set
+    realtime.push_membership(conversation_ids, user_ids, joined=action == 'post_add')
@@ -1,3 +1,1383 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import os
+import tempfile
+import time
+import unittest
+import uuid
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.db.models import Count
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import AsyncRequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import async_views, search
+from .inbox import mark_read
+from .auth import CachedClaimsJWTAuthentication, user_claims_cache
+from .caching import user_version_key
+from .membership import is_participant
+from .routing import websocket_urlpatterns
+from .ws_auth import JWTAuthMiddleware
+from .filters import MessageFilter
+from .archive import unpack
+from .models import ArchivedMessageChunk, Conversation, ConversationParticipant, InboxEntry, Message, User
+from .pagination import MessageCursorPagination
+from .routers import sticky_key
+from .serializers import UserSerializer
+from .sharding import hashed_shard, set_placement, shard_for
+
+
+class MessageCursorPaginationTests(APITestCase):
+    """
+    Tests for the keyset pagination on the nested messages endpoint.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', email='alice@example.com', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        base = timezone.now() - timedelta(days=1)
+        for i in range(25):
+            message = Message.objects.create(
+                conversation=self.conversation, sender=self.user, message_body=f'message {i}'
+            )
+            # Give a few messages the same timestamp to exercise the message_id tie-breaker.
+            Message.objects.filter(pk=message.pk).update(sent_at=base + timedelta(minutes=i // 3))
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/conversations/{self.conversation.conversation_id}/messages/'
+
+    def test_malformed_ids_are_not_found(self):
+        for url in ('/api/conversations/not-a-uuid/messages/', f'{self.url}not-a-uuid/'):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_forward_and_backward_navigation(self):
+        expected = list(
+            Message.objects.order_by('-sent_at', '-message_id').values_list('message_body', flat=True)
+        )
+        first = self.client.get(self.url, {'page_size': 10}).json()
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).json()
+        third = self.client.get(second['next']).json()
+        self.assertIsNone(third['next'])
+        seen = [m['message_body'] for page in (first, second, third) for m in page['results']]
+        self.assertEqual(seen, expected)
+
+        back = self.client.get(third['previous']).json()
+        self.assertEqual(back['results'], second['results'])
+        self.assertIsNotNone(back['previous'])
+
+    def test_pages_issue_no_count_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('COUNT(' in q['sql'].upper() for q in queries.captured_queries))
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CHATS_MESSAGE_PREVIEW_SIZE=2)
+class ConversationListTests(APITestCase):
+    """
+    Tests for the conversation list and its message preview.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='bob', email='bob@example.com', password='pass')
+        self.other = User.objects.create_user(username='carol', email='carol@example.com', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def create_conversation(self, message_count):
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.user, self.other)
+        for i in range(message_count):
+            Message.objects.create(conversation=conversation, sender=self.other, message_body=f'hi {i}')
+        return conversation
+
+    def test_preview_contains_latest_messages_oldest_first(self):
+        self.create_conversation(5)
+        response = self.client.get('/api/conversations/')
+        messages = response.json()['results'][0]['messages']
+        self.assertEqual([m['message_body'] for m in messages], ['hi 3', 'hi 4'])
+
+    def test_browsable_api_renders_without_collected_static_files(self):
+        response = self.client.get('/api/conversations/', HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_runs_constant_number_of_queries(self):
+        self.create_conversation(3)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get('/api/conversations/')
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(4):
+                self.create_conversation(10)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get('/api/conversations/')
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertEqual(len(small), len(large))
+
+
+class MembershipTests(APITestCase):
+    """
+    Tests for the EXISTS-based participant membership service.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='dave', email='dave@example.com', password='pass')
+        self.outsider = User.objects.create_user(username='erin', email='erin@example.com', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+
+    def test_answer_is_memoized_for_the_request(self):
+        request = APIRequestFactory().get('/')
+        request.user = self.user
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(is_participant(request, self.conversation))
+            self.assertTrue(is_participant(request, self.conversation.pk))
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql']
+        self.assertIn(Conversation.participants.through._meta.db_table, sql)
+        self.assertIn('LIMIT 1', sql)
+
+    def test_outsider_is_not_a_participant(self):
+        request = APIRequestFactory().get('/')
+        request.user = self.outsider
+        self.assertFalse(is_participant(request, self.conversation))
+
+    def test_send_message_checks_membership_once(self):
+        self.client.force_authenticate(self.user)
+        url = f'/api/conversations/{self.conversation.conversation_id}/send_message/'
+        through_table = Conversation.participants.through._meta.db_table
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {
+                'conversation': str(self.conversation.conversation_id),
+                'message_body': 'hello',
+            })
+        self.assertEqual(response.status_code, 201)
+        membership_checks = [
+            q for q in queries.captured_queries
+            if q['sql'].startswith('SELECT 1 AS "a" FROM "%s"' % through_table)
+        ]
+        self.assertEqual(len(membership_checks), 1)
+
+
+class BulkSendMessagesTests(APITestCase):
+    """
+    Tests for the bulk send_messages endpoint.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='frank', email='frank@example.com', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/conversations/{self.conversation.conversation_id}/send_messages/'
+
+    def test_creates_all_messages(self):
+        payload = [{'message_body': f'bulk {i}'} for i in range(5)]
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results], ['created'] * 5)
+        self.assertEqual(results[2]['message']['message_body'], 'bulk 2')
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 5)
+
+    def test_invalid_item_rejects_whole_batch(self):
+        payload = {'messages': [{'message_body': 'ok'}, {'message_body': '   '}]}
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results], ['valid', 'invalid'])
+        self.assertFalse(Message.objects.exists())
+
+    def test_message_create_still_takes_the_conversation_from_the_payload(self):
+        url = f'/api/conversations/{self.conversation.conversation_id}/messages/'
+        response = self.client.post(url, {'message_body': 'single'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('conversation', response.json())
+        response = self.client.post(
+            url, {'message_body': 'single', 'conversation': str(self.conversation.conversation_id)}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['conversation'], str(self.conversation.conversation_id))
+
+    @override_settings(CHATS_BULK_MESSAGE_MAX_BATCH_SIZE=2)
+    def test_batch_size_cap(self):
+        payload = [{'message_body': 'x'}] * 3
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+
+class InboxTests(APITestCase):
+    """
+    Tests for the per-user inbox rows maintained on message write.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='grace', email='grace@example.com', password='pass')
+        self.other = User.objects.create_user(username='heidi', email='heidi@example.com', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def create_conversation(self):
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.user, self.other)
+        return conversation
+
+    def test_participants_get_inbox_rows(self):
+        conversation = self.create_conversation()
+        self.assertEqual(InboxEntry.objects.filter(conversation=conversation).count(), 2)
+        conversation.participants.remove(self.other)
+        self.assertFalse(InboxEntry.objects.filter(user=self.other).exists())
+
+    def test_new_messages_update_preview_and_unread_counts(self):
+        conversation = self.create_conversation()
+        Message.objects.create(conversation=conversation, sender=self.other, message_body='first')
+        Message.objects.create(conversation=conversation, sender=self.other, message_body='second')
+        mine = InboxEntry.objects.get(user=self.user, conversation=conversation)
+        theirs = InboxEntry.objects.get(user=self.other, conversation=conversation)
+        self.assertEqual(mine.unread_count, 2)
+        self.assertEqual(theirs.unread_count, 0)
+        self.assertEqual(mine.last_message_preview, 'second')
+
+    def test_edits_and_deletes_keep_preview_and_unread_counts(self):
+        conversation = self.create_conversation()
+        first = Message.objects.create(conversation=conversation, sender=self.other, message_body='first')
+        second = Message.objects.create(conversation=conversation, sender=self.other, message_body='second')
+        mine = InboxEntry.objects.filter(user=self.user, conversation=conversation)
+
+        second.message_body = 'second, edited'
+        second.save()
+        self.assertEqual(mine.get().last_message_preview, 'second, edited')
+
+        second.delete()
+        entry = mine.get()
+        self.assertEqual(entry.last_message_preview, 'first')
+        self.assertEqual(entry.last_message_at, first.sent_at)
+        self.assertEqual(entry.unread_count, 1)
+
+        # A message the user has read does not count down again.
+        mark_read(self.user.pk, conversation.pk, (first.sent_at, first.message_id))
+        first.delete()
+        entry = mine.get()
+        self.assertEqual(entry.unread_count, 0)
+        self.assertEqual((entry.last_message_preview, entry.last_message_at), ('', conversation.created_at))
+
+    def test_deleting_a_conversation_drops_its_inbox_rows(self):
+        conversation = self.create_conversation()
+        Message.objects.create(conversation=conversation, sender=self.other, message_body='bye')
+        conversation.delete()
+        self.assertFalse(InboxEntry.objects.exists())
+
+    def test_bulk_messages_update_inbox(self):
+        conversation = self.create_conversation()
+        self.client.post(
+            f'/api/conversations/{conversation.conversation_id}/send_messages/',
+            [{'message_body': 'a'}, {'message_body': 'b'}, {'message_body': 'c'}],
+            format='json',
+        )
+        self.assertEqual(InboxEntry.objects.get(user=self.other, conversation=conversation).unread_count, 3)
+        self.assertEqual(InboxEntry.objects.get(user=self.user, conversation=conversation).unread_count, 0)
+
+    def test_conversations_are_listed_by_latest_activity(self):
+        older = self.create_conversation()
+        newer = self.create_conversation()
+        Message.objects.create(conversation=older, sender=self.other, message_body='bump')
+        response = self.client.get('/api/conversations/')
+        ids = [c['conversation_id'] for c in response.json()['results']]
+        self.assertEqual(ids, [str(older.conversation_id), str(newer.conversation_id)])
+
+
+class ReadStateTests(APITestCase):
+    """
+    Tests for read watermarks and the unread counts endpoint.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='ivan', email='ivan@example.com', password='pass')
+        self.other = User.objects.create_user(username='judy', email='judy@example.com', password='pass')
+        self.client.force_authenticate(self.user)
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+        self.messages = [
+            Message.objects.create(conversation=self.conversation, sender=self.other, message_body=str(index))
+            for index in range(3)
+        ]
+
+    def read_url(self):
+        return f'/api/conversations/{self.conversation.pk}/read/'
+
+    def test_mark_read_up_to_message_recounts_unread(self):
+        response = self.client.post(self.read_url(), {'message_id': str(self.messages[0].pk)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['unread_count'], 2)
+        self.assertEqual(response.json()['last_read_message_id'], str(self.messages[0].pk))
+
+        response = self.client.post(self.read_url(), format='json')
+        self.assertEqual(response.json()['unread_count'], 0)
+        Message.objects.create(conversation=self.conversation, sender=self.other, message_body='new')
+        entry = InboxEntry.objects.get(user=self.user, conversation=self.conversation)
+        self.assertEqual(entry.unread_count, 1)
+        self.assertEqual(entry.last_read_message_id, self.messages[-1].pk)
+
+    def test_watermark_never_moves_backwards(self):
+        self.client.post(self.read_url(), format='json')
+        response = self.client.post(self.read_url(), {'message_id': str(self.messages[0].pk)}, format='json')
+        self.assertEqual(response.json()['unread_count'], 0)
+        self.assertEqual(response.json()['last_read_message_id'], str(self.messages[-1].pk))
+
+    def test_unknown_message_is_rejected(self):
+        for message_id in (str(uuid.uuid4()), 'not-a-uuid'):
+            response = self.client.post(self.read_url(), {'message_id': message_id}, format='json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_unread_counts_for_all_conversations_in_one_query(self):
+        quiet = Conversation.objects.create()
+        quiet.participants.add(self.user, self.other)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/conversations/unread/')
+        self.assertEqual(len(queries), 1)
+        counts = {row['conversation']: row['unread_count'] for row in response.json()['results']}
+        self.assertEqual(counts, {str(self.conversation.pk): 3, str(quiet.pk): 0})
+        self.assertEqual(response.json()['total_unread'], 3)
+
+
+class ExplainChatsQueriesCommandTests(APITestCase):
+    """
+    Tests that the endpoint queries are served by indexes.
+    """
+    def test_no_full_table_scans(self):
+        user = User.objects.create_user(username='ivan', email='ivan@example.com', password='pass')
+        conversation = Conversation.objects.create()
+        conversation.participants.add(user)
+        Message.objects.create(conversation=conversation, sender=user, message_body='hello')
+        out = StringIO()
+        call_command('explain_chats_queries', username='ivan', stdout=out)
+        self.assertIn('No full table scans found.', out.getvalue())
+
+
+class VersionedResponseCacheTests(APITestCase):
+    """
+    Tests for the per-user, version-keyed response cache.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='judy', email='judy@example.com', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        self.client.force_authenticate(self.user)
+        self.messages_url = f'/api/conversations/{self.conversation.conversation_id}/messages/'
+
+    def test_hit_runs_no_queries(self):
+        first = self.client.get('/api/conversations/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/conversations/')
+        self.assertEqual(first.json(), second.json())
+
+    def test_new_message_invalidates_list_and_messages(self):
+        self.client.get('/api/conversations/')
+        self.client.get(self.messages_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                f'/api/conversations/{self.conversation.conversation_id}/send_message/',
+                {'message_body': 'fresh'},
+            )
+        conversations = self.client.get('/api/conversations/').json()['results']
+        self.assertEqual(conversations[0]['messages'][-1]['message_body'], 'fresh')
+        messages = self.client.get(self.messages_url).json()['results']
+        self.assertEqual(messages[0]['message_body'], 'fresh')
+
+    def test_messages_refresh_other_participants_lists_without_bumping_them(self):
+        other = User.objects.create_user(username='kim', email='kim@example.com', password='pass')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conversation.participants.add(other)
+        self.client.force_authenticate(other)
+        self.client.get('/api/conversations/')
+        version = cache.get(user_version_key(other.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(conversation=self.conversation, sender=self.user, message_body='for both')
+        self.assertEqual(cache.get(user_version_key(other.pk)), version)
+        conversations = self.client.get('/api/conversations/').json()['results']
+        self.assertEqual(conversations[0]['messages'][-1]['message_body'], 'for both')
+
+    def test_cache_is_per_user(self):
+        self.client.get('/api/conversations/')
+        outsider = User.objects.create_user(username='ken', email='ken@example.com', password='pass')
+        self.client.force_authenticate(outsider)
+        self.assertEqual(self.client.get('/api/conversations/').json()['results'], [])
+
+
+class ConversationExportTests(APITestCase):
+    """
+    Tests for the streaming conversation export.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='liam', email='liam@example.com', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        for i in range(3):
+            Message.objects.create(conversation=self.conversation, sender=self.user, message_body=f'line {i}')
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/conversations/{self.conversation.conversation_id}/export/'
+
+    def test_json_lines_export(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        bodies = [json.loads(line)['message_body'] for line in lines]
+        self.assertEqual(bodies, ['line 0', 'line 1', 'line 2'])
+
+    def test_csv_export(self):
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([row['message_body'] for row in rows], ['line 0', 'line 1', 'line 2'])
+        self.assertEqual(rows[0]['sender_username'], 'liam')
+
+    async def test_export_streams_asynchronously_under_asgi(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        bodies = [json.loads(line)['message_body'] for line in content.decode().splitlines()]
+        self.assertEqual(bodies, ['line 0', 'line 1', 'line 2'])
+
+    def test_outsider_cannot_export(self):
+        outsider = User.objects.create_user(username='mia', email='mia@example.com', password='pass')
+        self.client.force_authenticate(outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class ConditionalGetTests(APITestCase):
+    """
+    Tests for ETag / Last-Modified support on the chats endpoints.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='nina', email='nina@example.com', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/conversations/{self.conversation.conversation_id}/'
+
+    def test_matching_etag_gets_304_without_queries(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+
+    def test_etag_changes_after_a_write(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(conversation=self.conversation, sender=self.user, message_body='new')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class MessageSearchTests(APITestCase):
+    """
+    Tests for the full-text message search endpoint.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='oscar', email='oscar@example.com', password='pass')
+        self.other = User.objects.create_user(username='peggy', email='peggy@example.com', password='pass')
+        self.mine = Conversation.objects.create()
+        self.mine.participants.add(self.user)
+        self.theirs = Conversation.objects.create()
+        self.theirs.participants.add(self.other)
+        Message.objects.create(conversation=self.mine, sender=self.user, message_body='lunch at noon?')
+        Message.objects.create(conversation=self.mine, sender=self.user, message_body='lunch lunch lunch')
+        Message.objects.create(conversation=self.mine, sender=self.user, message_body='dinner later')
+        Message.objects.create(conversation=self.theirs, sender=self.other, message_body='secret lunch plans')
+        self.client.force_authenticate(self.user)
+
+    def search(self, query):
+        return self.client.get('/api/conversations/search/', {'q': query}).json()['results']
+
+    def test_results_are_ranked_and_scoped_to_the_user(self):
+        bodies = [m['message_body'] for m in self.search('lunch')]
+        self.assertEqual(bodies, ['lunch lunch lunch', 'lunch at noon?'])
+
+    def test_index_follows_edits_and_deletes(self):
+        message = Message.objects.get(message_body='dinner later')
+        message.message_body = 'breakfast later'
+        message.save()
+        self.assertEqual(self.search('dinner'), [])
+        self.assertEqual(len(self.search('breakfast')), 1)
+        message.delete()
+        self.assertEqual(self.search('breakfast'), [])
+
+    def test_new_messages_are_indexed_without_deletes(self):
+        with CaptureQueriesContext(connection) as queries:
+            Message.objects.create(conversation=self.mine, sender=self.user, message_body='brand new lunch')
+        self.assertFalse([query for query in queries if 'DELETE' in query['sql']])
+        self.assertEqual(self.search('brand')[0]['message_body'], 'brand new lunch')
+
+    def test_fts_syntax_in_the_query_is_treated_as_text(self):
+        self.assertEqual(self.search('lunch" OR "dinner'), [])
+
+
+class FastListSerializationTests(APITestCase):
+    """
+    Tests that the values()-based list path matches the serializers byte for byte.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='quinn', email='quinn@example.com', password='pass', phone_number='+254700000000'
+        )
+        self.other = User.objects.create_user(username='rupert', email='rupert@example.com', password='pass')
+        for _ in range(2):
+            conversation = Conversation.objects.create()
+            conversation.participants.add(self.user, self.other)
+            for body in ['plain', 'unicode \u00e9\u4e2d \u2028 separators', 'quote " and \\ backslash', 'last']:
+                Message.objects.create(conversation=conversation, sender=self.other, message_body=body)
+        self.conversation = conversation
+        self.client.force_authenticate(self.user)
+
+    def assert_same_bytes(self, url):
+        cache.clear()
+        with override_settings(CHATS_FAST_LIST_SERIALIZATION=False):
+            slow = self.client.get(url)
+        cache.clear()
+        with override_settings(CHATS_FAST_LIST_SERIALIZATION=True):
+            fast = self.client.get(url)
+        self.assertEqual(slow.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+
+    def test_conversation_list_matches(self):
+        self.assert_same_bytes('/api/conversations/')
+
+    def test_message_list_matches(self):
+        self.assert_same_bytes(f'/api/conversations/{self.conversation.conversation_id}/messages/?page_size=3')
+
+
+class MessageFilterTests(APITestCase):
+    """
+    Tests for the index-backed, join-free MessageFilter.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='sybil', email='sybil@example.com', password='pass')
+        self.other = User.objects.create_user(username='trent', email='trent@example.com', password='pass')
+        self.shared = Conversation.objects.create()
+        self.shared.participants.add(self.user, self.other)
+        self.private = Conversation.objects.create()
+        self.private.participants.add(self.user)
+        self.old = Message.objects.create(conversation=self.shared, sender=self.user, message_body='old')
+        Message.objects.filter(pk=self.old.pk).update(sent_at=timezone.now() - timedelta(days=10))
+        self.new = Message.objects.create(conversation=self.shared, sender=self.user, message_body='new')
+        self.alone = Message.objects.create(conversation=self.private, sender=self.user, message_body='alone')
+
+    def filtered(self, **params):
+        return MessageFilter(params, queryset=Message.objects.all()).qs
+
+    def test_date_range_uses_sent_at(self):
+        since = (timezone.now() - timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+        self.assertEqual(set(self.filtered(min_date=since)), {self.new, self.alone})
+        self.assertEqual(list(self.filtered(max_date=since)), [self.old])
+
+    def test_participant_filter_is_a_semi_join_subquery(self):
+        queryset = self.filtered(user_id=str(self.other.pk))
+        self.assertEqual(set(queryset), {self.old, self.new})
+        sql = str(queryset.query).upper()
+        self.assertIn('IN (SELECT', sql)
+        self.assertNotIn('DISTINCT', sql)
+        self.assertNotIn('JOIN', sql)
+
+    def test_date_range_plan_uses_the_conversation_index(self):
+        queryset = self.filtered(min_date='2020-01-01 00:00:00').filter(conversation=self.shared)
+        self.assertIn('chats_msg_conv_sent_idx', queryset.explain())
+
+
+@unittest.skipUnless(
+    os.environ.get('CHATS_FILTER_BENCHMARK_MESSAGES'),
+    'Set CHATS_FILTER_BENCHMARK_MESSAGES (e.g. 1000000) to run the MessageFilter benchmark.'
+)
+class MessageFilterBenchmark(APITestCase):
+    """
+    Compares the subquery participant filter with the former JOIN + DISTINCT
+    form on a seeded dataset, printing both query plans and timings.
+    """
+    def test_subquery_is_not_slower_than_join_distinct(self):
+        total = int(os.environ['CHATS_FILTER_BENCHMARK_MESSAGES'])
+        users = User.objects.bulk_create([
+            User(username=f'bench{i}', email=f'bench{i}@example.com') for i in range(50)
+        ])
+        conversations = Conversation.objects.bulk_create([Conversation() for _ in range(1000)])
+        ConversationParticipant.objects.bulk_create([
+            ConversationParticipant(conversation=conversation, user=users[(index + offset) % len(users)])
+            for index, conversation in enumerate(conversations) for offset in range(5)
+        ])
+        batch = []
+        for index in range(total):
+            batch.append(Message(
+                message_id=uuid.uuid4(),
+                conversation=conversations[index % len(conversations)],
+                sender=users[index % len(users)],
+                message_body='benchmark',
+            ))
+            if len(batch) == 10000:
+                Message.objects.bulk_create(batch)
+                batch = []
+        Message.objects.bulk_create(batch)
+
+        user_id = users[0].pk
+        legacy = Message.objects.filter(conversation__participants__user_id=user_id).distinct()
+        current = self.filtered_by_participant(user_id)
+        timings = {}
+        for name, queryset in (('join+distinct', legacy), ('subquery', current)):
+            print(f'\n{name} plan:\n{queryset.order_by("-sent_at")[:20].explain()}')
+            start = time.perf_counter()
+            list(queryset.order_by('-sent_at')[:20])
+            timings[name] = time.perf_counter() - start
+            print(f'{name}: {timings[name]:.4f}s')
+        self.assertLessEqual(timings['subquery'], timings['join+distinct'] * 1.5)
+
+    @staticmethod
+    def filtered_by_participant(user_id):
+        return MessageFilter({'user_id': str(user_id)}, queryset=Message.objects.all()).qs
+
+
+class CachedClaimsJWTAuthenticationTests(APITestCase):
+    """
+    Tests for JWT authentication backed by the cached claims layer.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='uma', email='uma@example.com', password='s3cret-pass', role='host'
+        )
+        response = self.client.post('/api/token/', {'username': 'uma', 'password': 's3cret-pass'})
+        self.assertEqual(response.status_code, 200)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}")
+
+    def test_token_carries_role_claim(self):
+        token = AccessToken(self.client._credentials['HTTP_AUTHORIZATION'].split()[1])
+        self.assertEqual(token['role'], 'host')
+
+    def test_warm_requests_do_not_load_the_user(self):
+        self.client.get('/api/conversations/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/conversations/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_serializing_the_request_user_loads_nothing(self):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=self.client._credentials['HTTP_AUTHORIZATION'])
+        user, _ = CachedClaimsJWTAuthentication().authenticate(request)
+        with self.assertNumQueries(0):
+            data = UserSerializer(user).data
+        self.assertEqual(data['role'], 'host')
+
+    def test_deactivation_takes_effect_immediately(self):
+        self.client.get('/api/conversations/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/conversations/').status_code, 401)
+
+    def test_changes_from_other_processes_apply_after_the_ttl(self):
+        self.client.get('/api/conversations/')
+        # An update() sends no signals, like a change made by another process.
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get('/api/conversations/').status_code, 200)
+
+        user_claims_cache.clear()
+        User.objects.filter(pk=self.user.pk).update(is_active=True)
+        with override_settings(CHATS_AUTH_USER_CACHE_TTL=0):
+            # Cached rows expire at once.
+            self.assertEqual(self.client.get('/api/conversations/').status_code, 200)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get('/api/conversations/').status_code, 401)
+
+    def test_request_user_can_write_messages(self):
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.user)
+        response = self.client.post(
+            f'/api/conversations/{conversation.conversation_id}/send_message/', {'message_body': 'hi'}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['sender']['username'], 'uma')
+
+
+class ConversationConsumerTests(TransactionTestCase):
+    """
+    Tests for WebSocket push delivery over the in-memory channel layer.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='victor', email='victor@example.com', password='pass')
+        self.other = User.objects.create_user(username='wendy', email='wendy@example.com', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+        self.application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+    def connect(self, user):
+        return WebsocketCommunicator(
+            self.application, '/ws/chats/', subprotocols=['bearer', str(AccessToken.for_user(user))]
+        )
+
+    async def test_new_message_is_pushed_to_participants(self):
+        communicator = self.connect(self.user)
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, 'bearer')
+        await sync_to_async(Message.objects.create)(
+            conversation=self.conversation, sender=self.other, message_body='pushed'
+        )
+        event = await communicator.receive_json_from(timeout=2)
+        self.assertEqual(event['message']['message_body'], 'pushed')
+        self.assertEqual(event['message']['sender']['username'], 'wendy')
+        await communicator.disconnect()
+
+    async def test_socket_follows_conversations_joined_and_left_while_connected(self):
+        communicator = self.connect(self.user)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        later = await sync_to_async(Conversation.objects.create)()
+        await sync_to_async(later.participants.add)(self.user, self.other)
+        # Give the consumer a turn to process the join event.
+        await asyncio.sleep(0.1)
+        await sync_to_async(Message.objects.create)(conversation=later, sender=self.other, message_body='joined')
+        event = await communicator.receive_json_from(timeout=2)
+        self.assertEqual(event['message']['message_body'], 'joined')
+
+        await sync_to_async(later.participants.remove)(self.user)
+        await asyncio.sleep(0.1)
+        await sync_to_async(Message.objects.create)(conversation=later, sender=self.other, message_body='left')
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+        await communicator.disconnect()
+
+    async def test_anonymous_socket_is_rejected(self):
+        communicator = WebsocketCommunicator(self.application, '/ws/chats/')
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4401)
+
+    async def test_query_string_tokens_are_ignored(self):
+        # They would end up in the server's access log.
+        communicator = WebsocketCommunicator(self.application, f'/ws/chats/?token={AccessToken.for_user(self.user)}')
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4401)
+
+
+class LongPollMessagesTests(TransactionTestCase):
+    """
+    Tests for the long-poll endpoint that waits for messages past a cursor.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='xena', email='xena@example.com', password='pass')
+        self.other = User.objects.create_user(username='yuri', email='yuri@example.com', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+        self.first = Message.objects.create(conversation=self.conversation, sender=self.other, message_body='first')
+        self.url = f'/api/conversations/{self.conversation.pk}/messages/poll/'
+        self.auth = {'headers': {'authorization': f'Bearer {AccessToken.for_user(self.user)}'}}
+
+    def cursor(self, message):
+        return MessageCursorPagination.encode_position(message.sent_at, message.message_id)
+
+    async def test_returns_messages_past_cursor_immediately(self):
+        second = await sync_to_async(Message.objects.create)(
+            conversation=self.conversation, sender=self.other, message_body='second'
+        )
+        response = await self.async_client.get(self.url, {'after': self.cursor(self.first)}, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([m['message_body'] for m in data['results']], ['second'])
+        self.assertEqual(data['after'], self.cursor(second))
+
+    async def test_send_message_wakes_waiting_poll(self):
+        poll = asyncio.ensure_future(
+            self.async_client.get(self.url, {'after': self.cursor(self.first), 'timeout': 5}, **self.auth)
+        )
+        await asyncio.sleep(0.2)
+        self.assertFalse(poll.done())
+
+        def send():
+            client = APIClient()
+            client.force_authenticate(self.other)
+            return client.post(
+                f'/api/conversations/{self.conversation.pk}/send_message/', {'message_body': 'wake up'}, format='json'
+            )
+
+        started = time.monotonic()
+        self.assertEqual((await sync_to_async(send)()).status_code, 201)
+        response = await poll
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual([m['message_body'] for m in response.json()['results']], ['wake up'])
+
+    async def test_timeout_returns_empty_page(self):
+        response = await self.async_client.get(self.url, {'timeout': 0.1}, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'after': self.cursor(self.first), 'results': []})
+
+    async def test_timeout_reads_messages_whose_wake_up_was_missed(self):
+        poll = asyncio.ensure_future(
+            self.async_client.get(self.url, {'after': self.cursor(self.first), 'timeout': 0.5}, **self.auth)
+        )
+        await asyncio.sleep(0.2)
+        # bulk_create sends no signals, so nothing wakes the poll.
+        await sync_to_async(Message.objects.bulk_create)([
+            Message(conversation=self.conversation, sender=self.other, message_body='unannounced')
+        ])
+        response = await poll
+        self.assertEqual([m['message_body'] for m in response.json()['results']], ['unannounced'])
+
+    async def test_rejects_non_finite_timeout(self):
+        for timeout in ('nan', 'inf'):
+            response = await self.async_client.get(self.url, {'timeout': timeout}, **self.auth)
+            self.assertEqual(response.status_code, 400)
+
+    async def test_requires_authenticated_participant(self):
+        response = await self.async_client.get(self.url, {'timeout': 0})
+        self.assertEqual(response.status_code, 401)
+        outsider = await sync_to_async(User.objects.create_user)(
+            username='zed', email='zed@example.com', password='pass'
+        )
+        response = await self.async_client.get(
+            self.url, {'timeout': 0}, headers={'authorization': f'Bearer {AccessToken.for_user(outsider)}'}
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class AsyncReadViewTests(APITestCase):
+    """
+    Tests for the async read views, which must answer exactly like the viewsets.
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='ken', email='ken@example.com', password='pass')
+        self.other = User.objects.create_user(username='lena', email='lena@example.com', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+        self.messages = [
+            Message.objects.create(conversation=self.conversation, sender=self.other, message_body=f'm{index}')
+            for index in range(5)
+        ]
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.factory = AsyncRequestFactory()
+
+    async def call(self, view, path, data=None, **kwargs):
+        request = self.factory.get(path, data, headers={'authorization': self.token})
+        return await view(request, **kwargs)
+
+    def sync_get(self, path, data=None):
+        cache.clear()
+        return self.client.get(path, data, HTTP_AUTHORIZATION=self.token)
+
+    async def test_conversation_paths_match_viewset(self):
+        response = await self.call(async_views.conversation_list, '/api/conversations/')
+        self.assertEqual(response.status_code, 200)
+        expected = await sync_to_async(self.sync_get)('/api/conversations/')
+        self.assertEqual(json.loads(response.content), expected.json())
+
+        path = f'/api/conversations/{self.conversation.pk}/'
+        response = await self.call(async_views.conversation_detail, path, pk=self.conversation.pk)
+        expected = await sync_to_async(self.sync_get)(path)
+        self.assertEqual(json.loads(response.content), expected.json())
+
+    async def test_message_paths_match_viewset(self):
+        path = f'/api/conversations/{self.conversation.pk}/messages/'
+        kwargs = {'conversation_pk': self.conversation.pk}
+        first = await self.call(async_views.message_list, path, {'page_size': 2}, **kwargs)
+        expected = await sync_to_async(self.sync_get)(path, {'page_size': 2})
+        self.assertEqual(json.loads(first.content), expected.json())
+
+        cursor = json.loads(first.content)['next'].split('cursor=')[1].split('&')[0]
+        second = await self.call(async_views.message_list, path, {'page_size': 2, 'cursor': cursor}, **kwargs)
+        self.assertEqual([m['message_body'] for m in json.loads(second.content)['results']], ['m2', 'm1'])
+
+        message = self.messages[0]
+        response = await self.call(async_views.message_detail, f'{path}{message.pk}/', pk=message.pk, **kwargs)
+        self.assertEqual(json.loads(response.content)['message_body'], 'm0')
+
+    async def test_revalidation_and_missing_rows(self):
+        first = await self.call(async_views.conversation_list, '/api/conversations/')
+        request = self.factory.get(
+            '/api/conversations/', headers={'authorization': self.token, 'if-none-match': first['ETag']}
+        )
+        self.assertEqual((await async_views.conversation_list(request)).status_code, 304)
+
+        response = await self.call(async_views.conversation_detail, '/api/conversations/x/', pk=uuid.uuid4())
+        self.assertEqual(response.status_code, 404)
+        response = await self.call(async_views.conversation_list, '/api/conversations/', {'page': 9})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_messages_refresh_the_cached_list(self):
+        await self.call(async_views.conversation_list, '/api/conversations/')
+
+        def send():
+            with self.captureOnCommitCallbacks(execute=True):
+                Message.objects.create(conversation=self.conversation, sender=self.other, message_body='new')
+
+        await sync_to_async(send)()
+        response = await self.call(async_views.conversation_list, '/api/conversations/')
+        self.assertEqual(json.loads(response.content)['results'][0]['messages'][-1]['message_body'], 'new')
+
+    async def test_unauthenticated_requests_fall_through_to_viewset(self):
+        response = await async_views.conversation_list(self.factory.get('/api/conversations/'))
+        self.assertEqual(response.status_code, 401)
+
+
+class WarmUpTests(APITestCase):
+    """
+    Tests for the warm-up steps the gunicorn config runs before forking.
+    """
+    def test_warm_up_prepares_resolver_and_serializers(self):
+        from messaging_app import warmup
+        from .serializers import ConversationSerializer, MessageSerializer
+
+        self.assertTrue(warmup.warm_up_url_resolvers()._populated)
+        warmed = warmup.warm_up_serializers()
+        self.assertIn(ConversationSerializer, warmed)
+        self.assertIn(MessageSerializer, warmed)
+
+
+class TemporaryDatabasesMixin:
+    """
+    Adds the `extra_databases` aliases for the test class, each a migrated
+    SQLite file of its own.
+    """
+    extra_databases = ()
+    # The extra aliases are only configured in setUpClass.
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.extra_database_paths = {}
+        default = connections.settings['default']
+        for alias in cls.extra_databases:
+            handle, cls.extra_database_paths[alias] = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(handle)
+            connections.settings[alias] = {
+                **default, 'NAME': cls.extra_database_paths[alias], 'TEST': {**default['TEST'], 'MIRROR': None},
+            }
+        super().setUpClass()
+        for alias in cls.extra_databases:
+            call_command('migrate', database=alias, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias, path in cls.extra_database_paths.items():
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+            os.remove(path)
+
+
+@override_settings(CHATS_READ_REPLICAS=['replica'], CHATS_REPLICA_STICKY_SECONDS=60)
+class ReplicaRouterTests(TemporaryDatabasesMixin, TransactionTestCase):
+    """
+    Tests for replica reads with read-your-writes stickiness, using a second
+    SQLite file as the replica. Nothing replicates to it, so it looks like a
+    replica that is lagging behind.
+    """
+    extra_databases = ('replica',)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='mona', email='mona@example.com', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def conversation_ids(self):
+        return [row['conversation_id'] for row in self.client.get('/api/conversations/').json()['results']]
+
+    def test_reads_use_replica_and_writes_use_primary(self):
+        self.assertEqual(self.conversation_ids(), [])
+        response = self.client.get(f'/api/conversations/{self.conversation.pk}/messages/')
+        self.assertEqual(response.json()['results'], [])
+
+        self.client.post(f'/api/conversations/{self.conversation.pk}/send_message/', {'message_body': 'hi'})
+        self.assertTrue(Message.objects.using('default').filter(message_body='hi').exists())
+        self.assertFalse(Message.objects.using('replica').exists())
+
+    def test_reads_stick_to_primary_after_a_write(self):
+        self.client.post(f'/api/conversations/{self.conversation.pk}/send_message/', {'message_body': 'hi'})
+        self.assertEqual(self.conversation_ids(), [str(self.conversation.pk)])
+        response = self.client.get(f'/api/conversations/{self.conversation.pk}/messages/')
+        self.assertEqual([m['message_body'] for m in response.json()['results']], ['hi'])
+
+        cache.delete(sticky_key(self.user.pk))
+        Message.objects.create(conversation=self.conversation, sender=self.user, message_body='bump')
+        self.assertEqual(self.conversation_ids(), [])
+
+    def test_replica_reads_are_not_cached_or_validated(self):
+        response = self.client.get('/api/conversations/')
+        self.assertEqual(response.json()['results'], [])
+        self.assertNotIn('ETag', response)
+        # Once the replica catches up, here by reading the primary, the
+        # conversation shows up without waiting for a write.
+        with override_settings(CHATS_READ_REPLICAS=[]):
+            response = self.client.get('/api/conversations/')
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertIn('ETag', response)
+
+    async def test_async_replica_reads_are_not_cached_or_validated(self):
+        token = f'Bearer {await sync_to_async(AccessToken.for_user)(self.user)}'
+        request = AsyncRequestFactory().get('/api/conversations/', headers={'authorization': token})
+        response = await async_views.conversation_list(request)
+        self.assertEqual(json.loads(response.content)['results'], [])
+        self.assertNotIn('ETag', response)
+        with override_settings(CHATS_READ_REPLICAS=[]):
+            response = await async_views.conversation_list(request)
+        self.assertEqual(len(json.loads(response.content)['results']), 1)
+
+
+@override_settings(CHATS_MESSAGE_SHARDS=['default', 'shard1'])
+class ShardedMessagesTests(TemporaryDatabasesMixin, TransactionTestCase):
+    """
+    Tests for messages sharded across two databases, with a second SQLite
+    file as the other shard.
+    """
+    extra_databases = ('shard1',)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='nina', email='nina@example.com', password='pass')
+        self.other = User.objects.create_user(username='omar', email='omar@example.com', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+        set_placement(self.conversation.pk, 'shard1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def send(self, body):
+        return self.client.post(f'/api/conversations/{self.conversation.pk}/send_message/', {'message_body': body})
+
+    def test_new_conversations_record_their_hashed_shard(self):
+        conversation = Conversation.objects.create()
+        self.assertEqual(conversation.message_shard, hashed_shard(conversation.pk))
+        self.assertEqual(shard_for(conversation.pk), hashed_shard(conversation.pk))
+
+    def test_messages_are_stored_and_read_on_the_conversation_shard(self):
+        self.assertEqual(self.send('hello').status_code, 201)
+        response = self.client.post(
+            f'/api/conversations/{self.conversation.pk}/send_messages/',
+            {'messages': [{'message_body': 'one'}, {'message_body': 'two'}]}, format='json',
+        )
+        self.assertEqual(response.status_code, 201)
+        Message.objects.create(conversation=self.conversation, sender=self.other, message_body='three')
+        self.assertEqual(Message.objects.using('shard1').count(), 4)
+        self.assertFalse(Message.objects.using('default').exists())
+
+        results = self.client.get(f'/api/conversations/{self.conversation.pk}/messages/').json()['results']
+        self.assertEqual([m['message_body'] for m in results], ['three', 'two', 'one', 'hello'])
+        self.assertEqual(results[0]['sender']['username'], 'omar')
+        message_id = results[0]['message_id']
+        response = self.client.get(f'/api/conversations/{self.conversation.pk}/messages/{message_id}/')
+        self.assertEqual(response.json()['message_body'], 'three')
+
+        conversation = self.client.get('/api/conversations/').json()['results'][0]
+        self.assertEqual(conversation['messages'][-1]['message_body'], 'three')
+        conversation = self.client.get(f'/api/conversations/{self.conversation.pk}/').json()
+        self.assertEqual(conversation['messages'][-1]['sender']['username'], 'omar')
+        unread = self.client.get('/api/conversations/unread/').json()
+        self.assertEqual(unread['total_unread'], 1)
+
+    def test_participant_filter_reads_memberships_from_the_primary(self):
+        self.send('hello')
+        url = f'/api/conversations/{self.conversation.pk}/messages/'
+        results = self.client.get(url, {'user_id': str(self.other.pk)}).json()['results']
+        self.assertEqual([m['message_body'] for m in results], ['hello'])
+        outsider = User.objects.create_user(username='quin', email='quin@example.com', password='pass')
+        self.assertEqual(self.client.get(url, {'user_id': str(outsider.pk)}).json()['results'], [])
+
+    def test_message_list_requires_membership(self):
+        self.send('hello')
+        outsider = User.objects.create_user(username='pia', email='pia@example.com', password='pass')
+        self.client.force_authenticate(outsider)
+        response = self.client.get(f'/api/conversations/{self.conversation.pk}/messages/')
+        self.assertEqual(response.json()['results'], [])
+
+    def test_search_read_and_export_gather_from_the_shard(self):
+        self.send('find the needle')
+        results = self.client.get('/api/conversations/search/', {'q': 'needle'}).json()['results']
+        self.assertEqual([m['message_body'] for m in results], ['find the needle'])
+
+        self.client.force_authenticate(self.other)
+        response = self.client.post(f'/api/conversations/{self.conversation.pk}/read/')
+        self.assertEqual(response.json()['unread_count'], 0)
+        response = self.client.get(f'/api/conversations/{self.conversation.pk}/export/')
+        row = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual((row['sender_username'], row['message_body']), ('nina', 'find the needle'))
+
+    def test_reshard_moves_messages(self):
+        self.send('first')
+        self.send('second')
+        out = StringIO()
+        call_command('reshard_messages', str(self.conversation.pk), 'default', grace=0, stdout=out)
+        self.assertIn('Moved 2 messages', out.getvalue())
+        self.assertFalse(Message.objects.using('shard1').exists())
+        self.assertEqual(Message.objects.using('default').count(), 2)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_shard, 'default')
+
+        self.send('third')
+        results = self.client.get(f'/api/conversations/{self.conversation.pk}/messages/').json()['results']
+        self.assertEqual([m['message_body'] for m in results], ['third', 'second', 'first'])
+        self.assertEqual(Message.objects.using('default').count(), 3)
+
+    def test_deletes_cascade_to_the_shard(self):
+        self.send('mine')
+        other_conversation = Conversation.objects.create()
+        other_conversation.participants.add(self.other, self.user)
+        set_placement(other_conversation.pk, 'shard1')
+        Message.objects.create(conversation=other_conversation, sender=self.other, message_body='theirs')
+
+        self.conversation.delete()
+        self.assertEqual(list(Message.objects.using('shard1').values_list('message_body', flat=True)), ['theirs'])
+        self.other.delete()
+        self.assertFalse(Message.objects.using('shard1').exists())
+
+
+class MessageArchiveTests(APITestCase):
+    """
+    Tests for archiving old messages and reading through to the archive.
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='nora', email='nora@example.com', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        now = timezone.now()
+        for i in range(15):
+            message = Message.objects.create(conversation=self.conversation, sender=self.user, message_body=f'old {i}')
+            Message.objects.filter(pk=message.pk).update(sent_at=now - timedelta(days=100, minutes=15 - i))
+        for i in range(10):
+            Message.objects.create(conversation=self.conversation, sender=self.user, message_body=f'new {i}')
+        call_command('archive_messages', chunk_size=4, stdout=StringIO())
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/conversations/{self.conversation.pk}/messages/'
+        self.newest_first = [f'new {i}' for i in reversed(range(10))] + [f'old {i}' for i in reversed(range(15))]
+
+    def walk(self, url, link):
+        pages = []
+        while url:
+            data = self.client.get(url).json()
+            pages.append([m['message_body'] for m in data['results']])
+            url = data[link]
+        return pages
+
+    def test_archive_moves_old_messages_into_chunks(self):
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 10)
+        chunks = ArchivedMessageChunk.objects.order_by('newest_sent_at')
+        self.assertEqual([chunk.message_count for chunk in chunks], [4, 4, 4, 3])
+        self.assertEqual([m.message_body for m in unpack(chunks[0])], ['old 0', 'old 1', 'old 2', 'old 3'])
+
+        # A later run tops up the newest chunk first.
+        Message.objects.filter(message_body='new 0').update(sent_at=timezone.now() - timedelta(days=99))
+        call_command('archive_messages', chunk_size=4, stdout=StringIO())
+        self.assertEqual([chunk.message_count for chunk in chunks.all()], [4, 4, 4, 4])
+
+    def test_pages_read_through_to_the_archive(self):
+        pages = self.walk(self.url + '?page_size=6', 'next')
+        self.assertEqual(sum(pages, []), self.newest_first)
+        self.assertEqual([len(page) for page in pages], [6, 6, 6, 6, 1])
+
+        data = self.client.get(self.url + '?page_size=6').json()
+        while data['next']:
+            data = self.client.get(data['next']).json()
+        pages = self.walk(data['previous'], 'previous')
+        self.assertEqual(sum(reversed(pages), []), self.newest_first[:-1])
+
+    @override_settings(CHATS_FAST_LIST_SERIALIZATION=False)
+    def test_serializer_pages_read_through_to_the_archive(self):
+        self.assertEqual(sum(self.walk(self.url + '?page_size=6', 'next'), []), self.newest_first)
+
+    def test_filters_apply_to_archived_messages(self):
+        min_date = (timezone.now() - timedelta(days=100, minutes=5, seconds=30)).isoformat()
+        response = self.client.get(self.url, {'min_date': min_date})
+        self.assertEqual([m['message_body'] for m in response.json()['results']], self.newest_first[:15])
+
+    def test_outsider_cannot_read_archived_messages(self):
+        outsider = User.objects.create_user(username='otto', email='otto@example.com', password='pass')
+        self.client.force_authenticate(outsider)
+        self.assertEqual(self.client.get(self.url).json()['results'], [])
+
+    def test_export_includes_archived_messages(self):
+        response = self.client.get(f'/api/conversations/{self.conversation.pk}/export/')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['message_body'] for line in lines], self.newest_first[::-1])
+
+
+class LoadTestCommandTests(TransactionTestCase):
+    """
+    Tests for the load_test command. The simulated clients run on threads
+    with their own connections, so the seeded rows must be committed. One
+    client is used: SQLite's shared in-memory test database fails concurrent
+    writers with 'table is locked' instead of waiting for them.
+    """
+    def test_seeds_drives_endpoints_and_writes_results(self):
+        handle, path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        call_command(
+            'load_test', users=4, conversations=3, participants=2, messages=5, clients=1, requests=12,
+            send_ratio=0.3, output=path, stdout=StringIO(),
+        )
+        self.assertEqual(User.objects.filter(username__startswith='loadtest-').count(), 4)
+        self.assertEqual(InboxEntry.objects.count(), 6)
+
+        with open(path) as output:
+            results = json.load(output)
+        self.assertEqual(results['errors'], 0)
+        self.assertEqual(results['requests'], 13)
+        self.assertEqual(results['endpoints']['token_obtain']['requests'], 1)
+        for endpoint in results['endpoints'].values():
+            self.assertGreater(endpoint['queries_per_request'], 0)
+            self.assertLessEqual(endpoint['p50_ms'], endpoint['p99_ms'])
+
+
+class SeedChatsCommandTests(APITestCase):
+    """
+    Tests for the seed_chats command.
+    """
+    def test_generates_the_requested_shape(self):
+        call_command(
+            'seed_chats', users=10, dms=6, groups=1, group_size=4, messages=200, group_share=0.5,
+            batch_size=7, stdout=StringIO(),
+        )
+        self.assertEqual(User.objects.filter(username__startswith='seed-').count(), 10)
+        self.assertEqual(Conversation.objects.count(), 7)
+        self.assertEqual(Message.objects.count(), 200)
+        group = Conversation.objects.annotate(size=Count('participants')).get(size=4)
+        self.assertEqual(group.messages.count(), 100)
+        # Timestamps are spread out, not all the time of the insert.
+        self.assertGreater(Message.objects.values('sent_at').distinct().count(), 190)
+        for message in Message.objects.all():
+            self.assertTrue(message.conversation.participants.filter(pk=message.sender_id).exists())
+
+        # One inbox row per participant, pointing at the latest message.
+        self.assertEqual(InboxEntry.objects.count(), 4 + 6 * 2)
+        entry = InboxEntry.objects.filter(conversation=group).first()
+        latest = group.messages.order_by('-sent_at').first()
+        self.assertEqual(entry.last_read_message_id, latest.pk)
+        self.assertEqual(entry.last_message_at, latest.sent_at)
+        self.assertIn(latest.pk, search.search_message_ids(group.participants.first(), 'Message 99', 50))
+
+    def test_refuses_an_existing_prefix(self):
+        User.objects.create_user(username='seed-0', password='x')
+        with self.assertRaises(CommandError):
+            call_command('seed_chats', users=10, stdout=StringIO())
+
+
+@override_settings(CHATS_SERVER_TIMING_SAMPLE_RATE=1)
+class ServerTimingMiddlewareTests(TransactionTestCase):
+    """
+    Tests for the Server-Timing header and log line of sampled requests.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='tim', email='tim@example.com', password='pass')
+        self.other = User.objects.create_user(username='una', email='una@example.com', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+        Message.objects.create(conversation=self.conversation, sender=self.other, message_body='hello')
+
+    @staticmethod
+    def parse(header):
+        timings = {}
+        for metric in header.split(', '):
+            name, duration, *desc = metric.split(';')
+            timings[name] = (float(duration[len('dur='):]), desc)
+        return timings
+
+    def test_sampled_request_reports_phases(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.assertLogs('chats.timing', 'INFO') as logs:
+            response = client.get(f'/api/conversations/{self.conversation.pk}/messages/')
+        self.assertEqual(response.status_code, 200)
+        timings = self.parse(response['Server-Timing'])
+        self.assertEqual(set(timings), {'db', 'view', 'serializer', 'render', 'total'})
+        self.assertLessEqual(timings['view'][0], timings['total'][0])
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['view'], 'conversation-messages-list')
+        self.assertGreater(record['queries'], 0)
+        self.assertEqual(timings['db'][1], [f'desc="{record["queries"]} queries"'])
+
+    @override_settings(CHATS_SERVER_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_request_is_left_alone(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.assertNoLogs('chats.timing'):
+            response = client.get('/api/conversations/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+
+    async def test_async_view_counts_its_queries(self):
+        with self.assertLogs('chats.timing', 'INFO') as logs:
+            response = await self.async_client.get(
+                f'/api/conversations/{self.conversation.pk}/messages/poll/', {'timeout': 0},
+                headers={'authorization': f'Bearer {AccessToken.for_user(self.user)}'},
+            )
+        self.assertEqual(response.status_code, 200)
+        timings = self.parse(response['Server-Timing'])
+        self.assertIn('serializer', timings)
+        self.assertIn('render', timings)
+        self.assertGreater(json.loads(logs.records[0].getMessage())['queries'], 0)
+
+
+class ConversationCreateTests(APITestCase):
+    """
+    Tests for creating conversations with their participants.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='vic', email='vic@example.com', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def create_users(self, count, prefix):
+        return User.objects.bulk_create([
+            User(username=f'{prefix}{index}', email=f'{prefix}{index}@example.com') for index in range(count)
+        ])
+
+    def test_creates_conversation_with_participants_and_inbox_rows(self):
+        others = self.create_users(3, 'member-')
+        response = self.client.post(
+            '/api/conversations/', {'participant_ids': [str(user.pk) for user in others]}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        conversation = Conversation.objects.get(pk=response.json()['conversation_id'])
+        expected = {self.user.pk, *(user.pk for user in others)}
+        self.assertEqual(set(conversation.participants.values_list('pk', flat=True)), expected)
+        self.assertEqual(set(conversation.inbox_entries.values_list('user_id', flat=True)), expected)
+        self.assertEqual(len(response.json()['participants']), 4)
+        self.assertNotIn('participant_ids', response.json())
+
+    def test_creates_conversation_with_only_the_creator(self):
+        response = self.client.post('/api/conversations/', {}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([p['username'] for p in response.json()['participants']], ['vic'])
+
+    def test_rejects_unknown_users_without_creating_anything(self):
+        other = self.create_users(1, 'member-')[0]
+        unknown = uuid.uuid4()
+        response = self.client.post(
+            '/api/conversations/', {'participant_ids': [str(other.pk), str(unknown)]}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(unknown), response.json()['participant_ids'][0])
+        self.assertFalse(Conversation.objects.exists())
+
+    def test_query_count_does_not_grow_with_participants(self):
+        small = [str(user.pk) for user in self.create_users(2, 'small-')]
+        large = [str(user.pk) for user in self.create_users(100, 'large-')]
+        with CaptureQueriesContext(connection) as few:
+            self.client.post('/api/conversations/', {'participant_ids': small}, format='json')
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.post('/api/conversations/', {'participant_ids': large}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(few), len(many))
@@ -0,0 +1,114 @@
+"""
+Per-request timing breakdown of the chats API.
+
+chats.middleware.ServerTimingMiddleware opens a RequestTimings for a sampled
+share of the requests (CHATS_SERVER_TIMING_SAMPLE_RATE). While it is open,
+an execute wrapper on every database connection counts the queries and their
+time, and the code doing the work reports its phases with `phase()`:
+serializers and the values() fast path as 'serializer', the async views'
+JSON encoding as 'render'. The middleware adds the view and template-response
+render phases itself.
+
+Phases overlap: a query run while serializing counts towards both 'db' and
+'serializer', and both are part of 'view'. Outside a sampled request
+`phase()` only costs a context variable lookup.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+
+_current = ContextVar('chats_request_timings', default=None)
+
+
+class RequestTimings:
+    """
+    Timings of one request: seconds per phase, plus the queries run on any
+    database connection.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.active = set()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.view_started = None
+        self._wrappers = []
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql_seconds += time.perf_counter() - started
+
+    def install(self):
+        """
+        Wraps every database connection of the calling thread. Async
+        requests call this, and `uninstall`, on the thread their ORM calls
+        run on.
+        """
+        for alias in connections:
+            wrapper = connections[alias].execute_wrapper(self)
+            wrapper.__enter__()
+            self._wrappers.append(wrapper)
+
+    def uninstall(self):
+        while self._wrappers:
+            self._wrappers.pop().__exit__(None, None, None)
+
+    def milliseconds(self):
+        """
+        Returns [(name, milliseconds)]: 'db', the phases in the order they
+        were first reported, and 'total'.
+        """
+        total = time.perf_counter() - self.started
+        timings = [('db', self.sql_seconds)] + list(self.phases.items()) + [('total', total)]
+        return [(name, round(seconds * 1000, 2)) for name, seconds in timings]
+
+    def server_timing(self, milliseconds):
+        """
+        Formats the timings as a Server-Timing header value.
+        """
+        return ', '.join(
+            f'{name};dur={duration}' + (f';desc="{self.queries} queries"' if name == 'db' else '')
+            for name, duration in milliseconds
+        )
+
+
+def current_timings():
+    return _current.get()
+
+
+def bind(timings):
+    return _current.set(timings)
+
+
+def unbind(token):
+    _current.reset(token)
+
+
+@contextmanager
+def phase(name):
+    """
+    Adds the time spent in the block to the current request's `name` phase.
+    Nested blocks of the same phase, such as nested serializers, are counted
+    once.
+    """
+    timings = _current.get()
+    if timings is None or name in timings.active:
+        yield
+        return
+    timings.active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.active.discard(name)
+        timings.add(name, time.perf_counter() - started)
@@ -1,7 +1,9 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework_nested.routers import NestedDefaultRouter
 from rest_framework.routers import DefaultRouter
 from .views import ConversationViewSet, MessageViewSet
+from .longpoll import poll_messages
 
 # Create a router and register our viewsets with it.
 router = DefaultRouter()
@@ -12,6 +14,20 @@ conversations_router = NestedDefaultRouter(router, r'conversations', lookup='con
 conversations_router.register(r'messages', MessageViewSet, basename='conversation-messages')
 # The API URLs are now determined automatically by the router.
 urlpatterns = [
+    # Ahead of the nested router, which would read 'poll' as a message pk.
+    path('conversations/<uuid:conversation_pk>/messages/poll/', poll_messages, name='conversation-messages-poll'),
     path('', include(router.urls)),
     path('', include(conversations_router.urls)),
-]
\ No newline at end of file
+]
+
+if getattr(settings, 'CHATS_ASYNC_READ_VIEWS', False):
+    # Async versions of the read paths, for ASGI deployments. They take over
+    # the router's list and detail URLs and hand writes back to the viewsets.
+    from . import async_views
+
+    urlpatterns = [
+        path('conversations/', async_views.conversation_list),
+        path('conversations/<uuid:pk>/', async_views.conversation_detail),
+        path('conversations/<uuid:conversation_pk>/messages/', async_views.message_list),
+        path('conversations/<uuid:conversation_pk>/messages/<uuid:pk>/', async_views.message_detail),
+    ] + urlpatterns
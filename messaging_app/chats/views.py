@@ -1,47 +1,100 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from rest_framework import viewsets, permissions, status, serializers, generics, filters
+from rest_framework import viewsets, permissions, status, serializers, generics
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.utils.urls import replace_query_param, remove_query_param
 from django_filters.rest_framework import DjangoFilterBackend
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Prefetch
+from django.urls.converters import UUIDConverter
 
-from .models import Conversation, Message, User
-from .serializers import ConversationSerializer, MessageSerializer, UserSerializer
+from .models import Conversation, ConversationParticipant, InboxEntry, Message, User
+from .serializers import (
+    ConversationSerializer, MessageSerializer, ReadStateSerializer, SentMessageSerializer, UserSerializer,
+    get_message_preview_size,
+)
 from .permissions import IsParticipantOrSender
-from .pagination import MessagePagination
+from .membership import is_participant
+from .inbox import mark_read
+from .routers import ReplicaReadMixin
+from .sharding import atomic_with_shard, is_sharded, messages_for, scatter_in_bulk, with_senders
+from .caching import VersionedResponseCacheMixin, conversation_version_key, get_user_versions
+from .pagination import MessageCursorPagination
 from .filters import MessageFilter
+from .signals import messages_bulk_created
+from .export import (
+    CSVExportRenderer, JSONLinesExportRenderer, aiter_in_chunks, get_export_chunk_size, iter_conversation_messages,
+)
+from .search import search_message_ids
+from .fastpath import FastListMixin, conversation_dicts, conversation_rows, instance_rows, message_dicts, message_rows
+from .archive import archived_messages
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth import logout
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
 from django.views.decorators.cache import cache_page
 
-class ConversationViewSet(viewsets.ModelViewSet):
+class ConversationViewSet(ReplicaReadMixin, VersionedResponseCacheMixin, FastListMixin, viewsets.ModelViewSet):
     """
     ViewSet for handling conversations.
     Provides list, retrieve, create, and other actions.
     """
     queryset = Conversation.objects.all().order_by('-created_at')
     serializer_class = ConversationSerializer
+    # Also constrains the nested messages routes' conversation_pk; anything
+    # else would reach the UUID filters and fail with a 500 instead of a 404.
+    lookup_value_regex = UUIDConverter.regex
     permission_classes = [permissions.IsAuthenticated, IsParticipantOrSender]
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend]
+    # Message text search is served by the full-text index, see `search`.
+    filter_backends = [DjangoFilterBackend]
     filterset_fields = ['participants']  # Allows filtering conversations by participant ID
+    fast_list_rows = staticmethod(conversation_rows)
+    fast_list_dicts = staticmethod(conversation_dicts)
+    # Actions that only need the conversation row, not its serialized form.
+    object_only_actions = ('send_message', 'send_messages', 'export', 'read')
 
     def get_queryset(self):
         """Only show conversations the current user is a participant of."""
-        return self.request.user.conversations.all().order_by('-created_at')
+        if self.action in self.object_only_actions:
+            return self.request.user.conversations.all()
+        # Participants and the message preview are loaded in one prefetch each,
+        # so the page costs a constant number of queries.
+        prefetches = [Prefetch('participants', queryset=User.objects.order_by('username'))]
+        if not is_sharded():
+            # A prefetch reads one database; sharded previews are read per
+            # conversation by the serializer (lists use conversation_dicts).
+            latest_messages = Message.objects.select_related('sender').order_by(
+                '-sent_at', '-message_id'
+            )[:get_message_preview_size()]
+            prefetches.append(Prefetch('messages', queryset=latest_messages, to_attr='latest_messages'))
+        # Conversations are listed in activity order straight from the
+        # user's inbox rows, using the (user, last_message_at) index.
+        return Conversation.objects.filter(
+            inbox_entries__user=self.request.user
+        ).prefetch_related(*prefetches).order_by('-inbox_entries__last_message_at', '-created_at')
+
+    def get_cache_version_key(self):
+        return conversation_version_key(self.kwargs['pk'])
+
+    def get_cache_versions(self):
+        """The list depends on all of the user's conversations, a detail on one."""
+        if self.action == 'retrieve':
+            return super().get_cache_versions()
+        return get_user_versions(self.request.user.pk)
 
     def perform_create(self, serializer):
-        """Add the creating user as a participant when a conversation is created."""
-        conversation = serializer.save()
-        conversation.participants.add(self.request.user)
+        """The creating user always joins the conversation."""
+        serializer.save(creator=self.request.user)
 
     @action(detail=True, methods=['post'], url_path='send_message')
     def send_message(self, request, pk=None):
         """Custom action to send a new message in a conversation."""
         conversation = self.get_object()
-        serializer = MessageSerializer(data=request.data)
+        serializer = SentMessageSerializer(data=request.data)
         if serializer.is_valid():
-            if self.request.user not in conversation.participants.all():
+            if not is_participant(self.request, conversation):
                 return Response(
                     {"detail": "You are not a participant in this conversation."},
                     status=status.HTTP_403_FORBIDDEN
@@ -53,22 +106,240 @@ class ConversationViewSet(viewsets.ModelViewSet):
             return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=True, methods=['post'], url_path='send_messages')
+    def send_messages(self, request, pk=None):
+        """
+        Custom action to send a batch of messages in a conversation.
+        Accepts a list of messages, or an object with a `messages` list.
+        Membership is checked once and all messages are inserted with a
+        single bulk insert; the response carries one result per item.
+        """
+        conversation = self.get_object()
+        items = request.data.get('messages') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response(
+                {"detail": "Expected a non-empty list of messages."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        max_batch_size = getattr(settings, 'CHATS_BULK_MESSAGE_MAX_BATCH_SIZE', 100)
+        if len(items) > max_batch_size:
+            return Response(
+                {"detail": f"A batch may contain at most {max_batch_size} messages."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not is_participant(self.request, conversation):
+            return Response(
+                {"detail": "You are not a participant in this conversation."},
+                status=status.HTTP_403_FORBIDDEN
+            )
 
-class MessageViewSet(viewsets.ModelViewSet):
+        serializer = SentMessageSerializer(data=items, many=True)
+        if not serializer.is_valid():
+            errors = serializer.errors
+            # Depending on the DRF version, errors come back as a list aligned
+            # with the input or as a mapping of index -> errors.
+            if isinstance(errors, dict):
+                errors = [errors.get(index, {}) for index in range(len(items))]
+            results = [
+                {'index': index, 'status': 'invalid', 'errors': item_errors}
+                if item_errors else {'index': index, 'status': 'valid'}
+                for index, item_errors in enumerate(errors)
+            ]
+            return Response({'results': results}, status=status.HTTP_400_BAD_REQUEST)
+
+        new_messages = [
+            Message(sender=self.request.user, conversation=conversation, **attrs)
+            for attrs in serializer.validated_data
+        ]
+        with atomic_with_shard(conversation.pk) as alias:
+            Message.objects.using(alias).bulk_create(new_messages)
+            messages_bulk_created.send(sender=Message, conversation=conversation, messages=new_messages)
+        results = [
+            {'index': index, 'status': 'created', 'message': data}
+            for index, data in enumerate(MessageSerializer(new_messages, many=True).data)
+        ]
+        return Response({'results': results}, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'], url_path='export',
+            renderer_classes=[JSONLinesExportRenderer, CSVExportRenderer])
+    def export(self, request, pk=None):
+        """
+        Streams the full message history of a conversation as JSON Lines
+        (default) or CSV (`?format=csv` or `Accept: text/csv`).
+        """
+        conversation = self.get_object()
+        renderer = request.accepted_renderer
+        content = renderer.stream(iter_conversation_messages(conversation.pk))
+        if isinstance(request._request, ASGIRequest):
+            content = aiter_in_chunks(content, get_export_chunk_size())
+        response = StreamingHttpResponse(
+            content, content_type=f'{renderer.media_type}; charset={renderer.charset}',
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="conversation-{conversation.pk}.{renderer.format}"'
+        )
+        return response
+
+    @action(detail=True, methods=['post'], url_path='read')
+    def read(self, request, pk=None):
+        """
+        Marks the conversation read up to `message_id`, or up to its latest
+        message when none is given, and returns the user's read state.
+        """
+        conversation = self.get_object()
+        messages = messages_for(conversation.pk)
+        message_id = request.data.get('message_id')
+        if message_id:
+            try:
+                messages = messages.filter(message_id=message_id)
+            except ValidationError:
+                messages = messages.none()
+        else:
+            messages = messages.order_by('-sent_at', '-message_id')
+        position = messages.values_list('sent_at', 'message_id').first()
+        if position is None and message_id:
+            return Response(
+                {"detail": "Message not found in this conversation."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if position is None:
+            entry = InboxEntry.objects.filter(user=request.user, conversation_id=conversation.pk).first()
+        else:
+            entry = mark_read(request.user.pk, conversation.pk, position)
+        if entry is None:
+            return Response(
+                {"detail": "You are not a participant in this conversation."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        return Response(ReadStateSerializer(entry).data)
+
+    @action(detail=False, methods=['get'], url_path='unread')
+    def unread(self, request):
+        """
+        Returns the unread count of every conversation of the user, read from
+        their inbox rows with one query on the (user, conversation) index.
+        """
+        entries = InboxEntry.objects.filter(user=request.user).only(
+            'conversation_id', 'unread_count', 'last_read_at', 'last_read_message_id'
+        ).order_by('conversation_id')
+        results = ReadStateSerializer(entries, many=True).data
+        return Response({
+            'total_unread': sum(entry['unread_count'] for entry in results),
+            'results': results,
+        })
+
+    @action(detail=False, methods=['get'], url_path='search')
+    def search(self, request):
+        """
+        Full-text search over the messages of the user's conversations.
+        Results are ranked best match first and paginated with `page`.
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"detail": "The 'q' parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        page_size = MessageCursorPagination.page_size
+
+        message_ids = search_message_ids(request.user, query, limit=page_size + 1, offset=(page - 1) * page_size)
+        has_next = len(message_ids) > page_size
+        message_ids = message_ids[:page_size]
+        found = scatter_in_bulk(message_ids)
+        results = [found[message_id] for message_id in message_ids if message_id in found]
+
+        url = request.build_absolute_uri()
+        previous_link = None
+        if page > 2:
+            previous_link = replace_query_param(url, 'page', page - 1)
+        elif page == 2:
+            previous_link = remove_query_param(url, 'page')
+        return Response({
+            'next': replace_query_param(url, 'page', page + 1) if has_next else None,
+            'previous': previous_link,
+            'results': MessageSerializer(results, many=True).data,
+        })
+
+
+class MessageViewSet(ReplicaReadMixin, VersionedResponseCacheMixin, FastListMixin, viewsets.ModelViewSet):
     """
     ViewSet for handling messages.
     Provides list, retrieve, create, update, and delete actions.
     """
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated, IsParticipantOrSender]
-    pagination_class = MessagePagination
+    lookup_value_regex = UUIDConverter.regex
+    pagination_class = MessageCursorPagination
+    fast_list_rows = staticmethod(message_rows)
+    fast_list_dicts = staticmethod(message_dicts)
     filterset_class = MessageFilter
     filter_backends = [DjangoFilterBackend]
 
     def get_queryset(self):
         """Return only messages from conversations the user participates in."""
+        if is_sharded():
+            return self.get_sharded_queryset()
         user_conversations = self.request.user.conversations.all()
-        return Message.objects.filter(conversation__in=user_conversations).order_by('-sent_at')
+        queryset = Message.objects.filter(conversation__in=user_conversations)
+        # Scope to the conversation from the nested route so the
+        # (conversation, sent_at, message_id) index drives the page seek.
+        conversation_pk = self.kwargs.get('conversation_pk')
+        if conversation_pk is not None:
+            queryset = queryset.filter(conversation_id=conversation_pk)
+        return queryset.select_related('sender').order_by('-sent_at', '-message_id')
+
+    def get_sharded_queryset(self):
+        """
+        Messages of the nested route's conversation, read from its shard. The
+        membership check cannot join across databases, so it runs first.
+        Without a conversation there is no single database to read from.
+        """
+        conversation_pk = self.kwargs.get('conversation_pk')
+        if conversation_pk is None or not is_participant(self.request, conversation_pk):
+            return Message.objects.none()
+        return with_senders(messages_for(conversation_pk)).order_by('-sent_at', '-message_id')
+
+    def read_through_archive(self, rows, cursor, limit):
+        """
+        Continues a page of the nested route into the archived messages
+        (see chats.archive) once it reaches past the messages table. Archived
+        messages are older than every message in the table, so they follow
+        the table's rows going back in time and precede them going forward.
+        """
+        conversation_pk = self.kwargs.get('conversation_pk')
+        reverse = cursor is not None and cursor['reverse']
+        if conversation_pk is None or (not reverse and len(rows) >= limit):
+            return rows
+        if not is_participant(self.request, conversation_pk):
+            return rows
+        filterset = MessageFilter(self.request.query_params, queryset=Message.objects.none())
+        filterset.is_valid()
+        bounds = filterset.form.cleaned_data
+        if bounds.get('user_id') and not ConversationParticipant.objects.filter(
+            conversation_id=conversation_pk, user_id=bounds['user_id']
+        ).exists():
+            return rows
+        archived = archived_messages(
+            conversation_pk,
+            position=cursor['position'] if cursor else None,
+            reverse=reverse,
+            limit=limit if reverse else limit - len(rows),
+            min_sent_at=bounds.get('min_date'),
+            max_sent_at=bounds.get('max_date'),
+        )
+        if self.use_fast_list():
+            archived = instance_rows(archived)
+        return (archived + rows)[:limit] if reverse else rows + archived
+
+    def get_cache_version_key(self):
+        return conversation_version_key(self.kwargs['conversation_pk'])
+
+    def get_cache_versions(self):
+        """Message pages depend on the conversation from the nested route."""
+        if 'conversation_pk' in self.kwargs:
+            return super().get_cache_versions()
+        return get_user_versions(self.request.user.pk)
 
     def perform_create(self, serializer):
         """Ensure user is a participant when creating a message."""
@@ -78,7 +349,7 @@ class MessageViewSet(viewsets.ModelViewSet):
         except Conversation.DoesNotExist:
             raise serializers.ValidationError({"detail": "Conversation not found."})
 
-        if self.request.user not in conversation.participants.all():
+        if not is_participant(self.request, conversation):
             raise serializers.ValidationError({"detail": "You are not a participant in this conversation."})
 
         serializer.save(sender=self.request.user, conversation=conversation)
@@ -0,0 +1,48 @@
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from .auth import CachedClaimsJWTAuthentication
+
+# Subprotocol a client offers ahead of its access token, e.g.
+# `new WebSocket(url, ['bearer', token])`. The consumer accepts it.
+BEARER_SUBPROTOCOL = 'bearer'
+
+
+@database_sync_to_async
+def get_token_user(raw_token):
+    authentication = CachedClaimsJWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (AuthenticationFailed, InvalidToken, TokenError):
+        return None
+
+
+def get_subprotocol_token(subprotocols):
+    """
+    Returns the access token offered after BEARER_SUBPROTOCOL, or None.
+    """
+    subprotocols = list(subprotocols or ())
+    if BEARER_SUBPROTOCOL in subprotocols[:-1]:
+        return subprotocols[subprotocols.index(BEARER_SUBPROTOCOL) + 1]
+    return None
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Authenticates WebSocket connections from an access token offered in the
+    Sec-WebSocket-Protocol header, as `bearer, <access token>`, since
+    browsers cannot set an Authorization header on a WebSocket handshake.
+    Unlike a query parameter, the header stays out of access logs. Leaves
+    `scope['user']` untouched (for example a session user from
+    AuthMiddlewareStack) when no token is given.
+    """
+
+    async def __call__(self, scope, receive, send):
+        raw_token = get_subprotocol_token(scope.get('subprotocols'))
+        if raw_token:
+            user = await get_token_user(raw_token)
+            if user is not None:
+                scope = dict(scope, user=user)
+        return await super().__call__(scope, receive, send)
@@ -0,0 +1,37 @@
+"""
+gunicorn configuration for production serving:
+
+    gunicorn -c gunicorn.conf.py
+
+Serves the ASGI app, so the WebSocket consumer and the long-poll endpoint
+run on each worker's event loop instead of holding a worker per client. The
+app is preloaded in the master and warmed up before workers are forked (see
+messaging_app/warmup.py). Every setting can be overridden from the
+environment.
+"""
+
+import multiprocessing
+import os
+
+wsgi_app = 'messaging_app.asgi:application'
+worker_class = 'uvicorn_worker.UvicornWorker'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# How long a worker's event loop may stay unresponsive before the master
+# restarts it; requests may take longer, such as waiting long polls.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+# Recycle workers now and then to bound memory growth, staggered so they do
+# not all restart at once.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+preload_app = True
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+    from messaging_app.warmup import warm_up_app
+
+    warm_up_app()
+    server.log.info('Application warmed up')
@@ -9,8 +9,37 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
+from asgiref.wsgi import WsgiToAsgi
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'messaging_app.settings')
 
-application = get_asgi_application()
+# Initialize Django before importing anything that touches models.
+django_asgi_app = get_asgi_application()
+
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.security.websocket import AllowedHostsOriginValidator  # noqa: E402
+
+from chats.routing import websocket_urlpatterns  # noqa: E402
+from chats.ws_auth import JWTAuthMiddleware  # noqa: E402
+from messaging_app.wsgi import application as static_wsgi_app  # noqa: E402
+
+# WhiteNoise only speaks WSGI, so collected static files are served by the
+# WhiteNoise-wrapped WSGI app (see wsgi.py), run in a thread. Paths it has no
+# file for fall through to Django there and get its usual 404.
+static_app = WsgiToAsgi(static_wsgi_app)
+
+
+async def http_app(scope, receive, send):
+    app = static_app if scope['path'].startswith(settings.STATIC_URL) else django_asgi_app
+    await app(scope, receive, send)
+
+
+application = ProtocolTypeRouter({
+    'http': http_app,
+    'websocket': AllowedHostsOriginValidator(
+        AuthMiddlewareStack(JWTAuthMiddleware(URLRouter(websocket_urlpatterns)))
+    ),
+})
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -24,9 +25,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-9&p1g!#z&)7d03%b^0)jxc62*s&_h7r3x=-0ysthgy@-+5^00-'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DJANGO_DEBUG', '1') == '1'
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',') if host]
 
 
 # Application definition
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chats.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,6 +83,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections open between requests (seconds); they are
+        # checked before reuse.
+        'CONN_MAX_AGE': int(os.environ.get('DJANGO_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -120,6 +126,24 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    # Hashed, pre-compressed files that whitenoise (see wsgi.py) can let
+    # clients cache forever. Only where collectstatic has run, as in the
+    # Docker image: without the manifest every page referencing a static
+    # file fails once DEBUG is off, tests included.
+    'staticfiles': {
+        'BACKEND': (
+            'whitenoise.storage.CompressedManifestStaticFilesStorage'
+            if os.environ.get('DJANGO_STATIC_MANIFEST', '0') == '1'
+            else 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        ),
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -128,7 +152,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'chats.auth.CachedClaimsJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
@@ -142,6 +166,11 @@ REST_FRAMEWORK = {
 
     "PAGE_SIZE": 20,
 
+    'DEFAULT_RENDERER_CLASSES': (
+        'chats.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+
 }
 
 AUTH_USER_MODEL = 'chats.User'
@@ -159,7 +188,7 @@ SIMPLE_JWT = {
     "LEEWAY": 0,
     "AUTH_HEADER_TYPES": ("Bearer",),
     "AUTH_HEADER_NAME": "HTTP_AUTHORIZATION",
-    "USER_ID_FIELD": "id",
+    "USER_ID_FIELD": "user_id",
     "USER_ID_CLAIM": "user_id",
     "USER_AUTHENTICATION_RULE": "rest_framework_simplejwt.authentication.default_user_authentication_rule",
     "JTI_CLAIM": "jti",
@@ -171,9 +200,115 @@ SIMPLE_JWT = {
     'TOKEN_OBTAIN_SERIALIZER': 'chats.auth.CustomTokenObtainPairSerializer',
 }
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# Redis server shared by every worker process: response cache versions,
+# replica stickiness, shard placement and the channel layer all live there.
+# Without it each process keeps its own, which only suits a single process
+# (runserver, tests).
+REDIS_URL = os.environ.get('REDIS_URL', '')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'unique-snowflake',
+        }
+    }
+
+# Number of latest messages embedded in each conversation returned by the API.
+CHATS_MESSAGE_PREVIEW_SIZE = 3
+
+# Maximum number of messages accepted by the bulk send_messages endpoint.
+CHATS_BULK_MESSAGE_MAX_BATCH_SIZE = 100
+
+# Cache used for versioned list/retrieve responses. It must be shared when
+# running more than one process (see REDIS_URL).
+CHATS_CACHE_ALIAS = 'default'
+CHATS_RESPONSE_CACHE_TIMEOUT = 300
+
+# Rows fetched per database round trip when streaming a conversation export.
+CHATS_EXPORT_CHUNK_SIZE = 2000
+
+# Serve chats list actions from values() rows instead of ModelSerializers.
+CHATS_FAST_LIST_SERIALIZATION = True
+
+# Maximum number of users whose token claims are cached per process, and how
+# long, in seconds, a cached row is trusted. Changes made in other processes
+# (other workers, management commands) take effect within the TTL.
+CHATS_AUTH_USER_CACHE_SIZE = 10000
+CHATS_AUTH_USER_CACHE_TTL = 30
+
+# Channel layer used to push new messages to WebSocket clients and wake long
+# polls. The in-memory layer only reaches clients served by the same process,
+# so Redis is used whenever REDIS_URL is set.
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [REDIS_URL]},
+        },
     }
-}
\ No newline at end of file
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# Longest time, in seconds, a long-poll request for new messages waits before
+# returning an empty page.
+CHATS_LONG_POLL_TIMEOUT = 25
+
+# Serve the chats list and detail reads from async views (chats.async_views).
+# Under ASGI a synchronous view holds a thread for the whole request, while
+# the async views only hop to one for queries. Under WSGI every async view
+# costs an event loop hop instead.
+CHATS_ASYNC_READ_VIEWS = os.environ.get('CHATS_ASYNC_READ_VIEWS', '0') == '1'
+
+# Read replicas: database aliases (added to DATABASES) that serve the chats
+# list and retrieve reads. Writes always go to 'default', and a user who
+# writes reads from 'default' for CHATS_REPLICA_STICKY_SECONDS afterwards.
+DATABASE_ROUTERS = ['chats.routers.MessageShardRouter', 'chats.routers.ReplicaRouter']
+CHATS_READ_REPLICAS = []
+CHATS_REPLICA_STICKY_SECONDS = 5
+
+# Message shards: database aliases (added to DATABASES) that hold the
+# messages, placed by a hash of the conversation id. Users, conversations and
+# everything else stay on 'default'. Move conversations between shards with
+# `manage.py reshard_messages`; all shards need `migrate --database`.
+CHATS_MESSAGE_SHARDS = ['default']
+
+# Message archive: `manage.py archive_messages` moves messages older than
+# CHATS_ARCHIVE_AFTER_DAYS into compressed chunks of up to
+# CHATS_ARCHIVE_CHUNK_SIZE messages. Message pages and exports read through.
+CHATS_ARCHIVE_AFTER_DAYS = 90
+CHATS_ARCHIVE_CHUNK_SIZE = 500
+
+# Server-Timing: the share of requests (0 to 1) whose SQL, view, serializer
+# and render times are sent as a Server-Timing header and logged as one JSON
+# line on the 'chats.timing' logger. Off unless set in the environment, e.g.
+# 0.01 in production or 1 to time every request.
+CHATS_SERVER_TIMING_SAMPLE_RATE = float(os.environ.get('CHATS_SERVER_TIMING_SAMPLE_RATE', '0'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'chats.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
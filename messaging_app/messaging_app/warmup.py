@@ -0,0 +1,58 @@
+"""
+Warm-up steps for production servers.
+
+gunicorn.conf.py runs `warm_up_app` in the master after the app is preloaded,
+so the work is done once and shared copy-on-write by every forked worker.
+Database connections are not warmed up: under ASGI each request opens its
+own, on the thread its synchronous code runs on.
+"""
+
+import inspect
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hashers
+from django.db import connections
+from django.urls import get_resolver
+from django.utils import translation
+from rest_framework import serializers
+from rest_framework.settings import IMPORT_STRINGS, api_settings
+
+
+def warm_up_url_resolvers():
+    """
+    Builds the reverse lookup tables, which compiles every URL pattern.
+    """
+    resolver = get_resolver()
+    resolver.reverse_dict
+    return resolver
+
+
+def warm_up_serializers():
+    """
+    Instantiates every serializer of the chats app and builds its fields, so
+    model metadata caches are filled and lazy imports are done.
+    """
+    from chats import serializers as chats_serializers
+
+    warmed = []
+    for _, serializer_class in inspect.getmembers(chats_serializers, inspect.isclass):
+        if issubclass(serializer_class, serializers.BaseSerializer) and serializer_class.__module__ == chats_serializers.__name__:
+            serializer_class().fields
+            warmed.append(serializer_class)
+    return warmed
+
+
+def warm_up_app():
+    """
+    Does the one-off work Django and DRF otherwise leave to the first request.
+    """
+    warm_up_url_resolvers()
+    # DRF imports the classes named in REST_FRAMEWORK on first access.
+    for name in IMPORT_STRINGS:
+        getattr(api_settings, name)
+    warm_up_serializers()
+    get_hashers()
+    translation.activate(settings.LANGUAGE_CODE)
+    translation.deactivate()
+    # Nothing opened above may leak into the forked workers.
+    connections.close_all()
@@ -9,8 +9,20 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
+from whitenoise import WhiteNoise
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'messaging_app.settings')
 
 application = get_wsgi_application()
+
+# Serve collected static files straight from the app servers. Wrapping the
+# WSGI app instead of using WhiteNoiseMiddleware keeps the middleware chain
+# async-capable for asgi.py. Hashed file names never change content.
+application = WhiteNoise(
+    application,
+    root=settings.STATIC_ROOT,
+    prefix=settings.STATIC_URL,
+    immutable_file_test=r'^.+\.[0-9a-f]{12}\..+$',
+)